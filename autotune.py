@@ -0,0 +1,349 @@
+# autotune.py
+"""CPU 推理自动调优: 在本机实测各种推理设置组合的吞吐，把最好的一组保存为本机调优配置，FaceScorer 加载模型时自动应用
+(界面、batch_score、serve、watch 等单进程打分；batch_score --workers 的工作进程按进程数分配线程，不应用)。
+
+调优的设置:
+    torch_threads / interop_threads  torch 算子内 / 算子间线程数
+    channels_last                    卷积权重和打分输入使用 channels_last 内存布局
+    inference_mode                   打分用 torch.inference_mode 代替 torch.no_grad
+    yolo_image_size                  YOLO 输入尺寸 (越小越快，但小人脸更容易漏检)
+    score_batch_size                 打分模型每次前向的最大人脸数
+
+算子间线程数只能在进程第一次并行计算之前设置，所以每种线程数组合在一个单独的 (spawn) 子进程里测量；
+子进程内用合成输入分别测量检测 (每种 YOLO 输入尺寸 × 内存布局) 和打分 (每种批大小 × 内存布局 × 梯度模式) 的耗时，
+再组合估算每个组合的:
+    每张图片延迟 = 检测耗时 + 一批打分的耗时 (流水线中一张图片的人脸要等所在的那一批算完)
+    吞吐 (张/秒) = 1000 / (检测耗时 + 每张图片人脸数 × 每张人脸的打分耗时)
+选出延迟不超过上限的组合中吞吐最高的一个 (都超出上限时选延迟最低的)。
+
+调优配置按主机名保存，并记录 CPU 型号、可用核数和 torch 版本；这些与当前机器不一致时不应用。
+
+用法:
+    python -m autotune run                              # 测量并保存本机调优配置
+    python -m autotune run --latency-cap 150 --faces 8 --image-sizes 1920x1080,4032x3024
+    python -m autotune show                             # 显示本机调优配置及是否适用
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import socket
+import statistics
+import sys
+import time
+
+import numpy as np
+
+import config
+import metrics
+from parallel import available_cpus
+
+PROFILE_VERSION = 1
+MEASURE_POLL_SECONDS = 1.0 # 等待测量结果时检查子进程是否存活的间隔
+SETTING_KEYS = ("torch_threads", "interop_threads", "channels_last", "inference_mode", "yolo_image_size",
+                "score_batch_size")
+
+
+# --- 1. 调优配置文件 ---
+def cpu_model():
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def host_signature():
+    """决定调优结果是否适用的本机信息"""
+    import torch
+    return {"hostname": socket.gethostname(), "cpu": cpu_model(), "cpus": available_cpus(), "torch": torch.__version__}
+
+
+def profile_path(path=None):
+    """本机调优配置文件路径 (默认 ~/.cache/facial-beauty-scoring/autotune-<主机名>.json)"""
+    path = path or config.AUTOTUNE_PROFILE_PATH
+    if path:
+        return path
+    return os.path.join(os.path.expanduser("~"), ".cache", "facial-beauty-scoring",
+                        f"autotune-{socket.gethostname()}.json")
+
+
+def load_profile(path=None):
+    """读取调优配置，文件不存在或无法解析时返回 None"""
+    path = profile_path(path)
+    try:
+        with open(path, encoding="utf-8") as f:
+            profile = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        metrics.event("autotune_profile_invalid", f"警告: 无法读取调优配置 '{path}': {e}", level="warning",
+                      path=path, error=str(e))
+        return None
+    return profile if profile.get("version") == PROFILE_VERSION else None
+
+
+def save_profile(profile, path=None):
+    path = profile_path(path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+    return path
+
+
+def profile_mismatch(profile):
+    """调优配置与本机不一致的字段，一致时返回空列表"""
+    current = host_signature()
+    return [key for key in ("cpu", "cpus", "torch") if profile["host"].get(key) != current[key]]
+
+
+def apply_thread_settings(torch_threads=None, interop_threads=None):
+    """设置 torch 线程数 (None 表示保持不变)；算子间线程数在已有并行计算后不能再修改，此时忽略"""
+    import torch
+    if torch_threads:
+        torch.set_num_threads(torch_threads)
+    if interop_threads and interop_threads != torch.get_num_interop_threads():
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            metrics.event("autotune_interop_skipped", "警告: torch 已开始并行计算，算子间线程数保持不变。",
+                          level="warning", interop_threads=interop_threads)
+
+
+def apply_profile(face_scorer, path=None):
+    """在 face_scorer.load() 之前调用: 应用 config.py 中的调优设置，本机调优配置存在且适用时再用它覆盖。
+    返回实际应用的调优配置 (没有时为 None)。"""
+    settings = {"torch_threads": config.TORCH_THREADS, "interop_threads": config.TORCH_INTEROP_THREADS}
+    profile = load_profile(path)
+    if profile is not None:
+        mismatch = profile_mismatch(profile)
+        if mismatch:
+            metrics.event("autotune_profile_stale",
+                          f"警告: 调优配置 '{profile_path(path)}' 与本机不一致 ({', '.join(mismatch)})，未应用。"
+                          "可运行 'python -m autotune run' 重新调优。",
+                          level="warning", path=profile_path(path), mismatch=mismatch)
+            profile = None
+        else:
+            settings.update(profile["settings"])
+            face_scorer.channels_last = settings["channels_last"]
+            face_scorer.inference_mode = settings["inference_mode"]
+            face_scorer.yolo_image_size = settings["yolo_image_size"]
+            face_scorer.score_batch_size = settings["score_batch_size"]
+    apply_thread_settings(settings["torch_threads"], settings["interop_threads"])
+    if profile is not None:
+        metrics.event("autotune_applied", f"已应用本机调优配置: {format_settings(settings)}",
+                      path=profile_path(path), **{key: settings[key] for key in SETTING_KEYS})
+    return profile
+
+
+def format_settings(settings):
+    return (f"线程 {settings['torch_threads']}/{settings['interop_threads']}，"
+            f"channels_last {'开' if settings['channels_last'] else '关'}，"
+            f"{'inference_mode' if settings['inference_mode'] else 'no_grad'}，"
+            f"YOLO 输入 {settings['yolo_image_size']}，打分批大小 {settings['score_batch_size']}")
+
+
+# --- 2. 测量 ---
+def _median_ms(function, repeat):
+    function() # 预热 (算子初始化、内存分配)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def _measure_worker(torch_threads, interop_threads, options, results):
+    """子进程: 按给定线程数加载模型，测量检测和打分在各设置下的耗时"""
+    import cv2
+    import torch
+    torch.set_num_threads(torch_threads)
+    torch.set_num_interop_threads(interop_threads)
+    cv2.setNumThreads(1)
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            from scorer import FaceScorer
+            face_scorer = FaceScorer(cache_path=None, detection_mode="single", lazy=True, autotune=False)
+            face_scorer.load()
+            face_scorer.warm_up()
+        if not all(face_scorer.models_loaded.values()):
+            results.put({"error": "模型加载失败"})
+            return
+        rng = np.random.default_rng(0)
+        images = [rng.integers(0, 256, (height, width, 3), dtype=np.uint8) for width, height in options["image_sizes"]]
+        crops = [rng.integers(0, 256, (160, 160, 3), dtype=np.uint8) for _ in range(max(options["batch_sizes"]))]
+        detect, score = [], []
+        for channels_last in options["channels_last"]:
+            if channels_last:
+                face_scorer.channels_last = True
+                face_scorer.use_channels_last()
+            for size in options["yolo_image_sizes"]:
+                face_scorer.yolo_image_size = size
+                ms = statistics.mean(_median_ms(lambda: face_scorer.detect(image), options["repeat"]) for image in images)
+                detect.append({"channels_last": channels_last, "yolo_image_size": size, "ms": ms})
+            for inference_mode in (False, True):
+                face_scorer.inference_mode = inference_mode
+                for batch_size in options["batch_sizes"]:
+                    face_scorer.score_batch_size = batch_size
+                    ms = _median_ms(lambda: face_scorer.score_faces(crops[:batch_size]), options["repeat"])
+                    score.append({"channels_last": channels_last, "inference_mode": inference_mode,
+                                  "score_batch_size": batch_size, "ms": ms})
+        results.put({"detect": detect, "score": score})
+    except Exception as e:
+        results.put({"error": f"{type(e).__name__}: {e}"})
+
+
+def measure_threads(torch_threads, interop_threads, options):
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_measure_worker, args=(torch_threads, interop_threads, options, results))
+    process.start()
+    # 子进程被强制结束 (内存不足、段错误) 时不会放入结果，轮询它是否还活着，而不是一直等下去
+    while True:
+        try:
+            result = results.get(timeout=MEASURE_POLL_SECONDS)
+            break
+        except queue.Empty:
+            if not process.is_alive():
+                try: # 结果可能在退出前刚好放入
+                    result = results.get(timeout=MEASURE_POLL_SECONDS)
+                except queue.Empty:
+                    result = {"error": f"测量子进程异常退出 (退出码 {process.exitcode})"}
+                break
+    process.join()
+    return result
+
+
+def combine(torch_threads, interop_threads, measured, faces_per_image):
+    """由一个线程数组合的检测 / 打分耗时组合出每组设置的延迟和吞吐"""
+    rows = []
+    for detect in measured["detect"]:
+        for score in measured["score"]:
+            if score["channels_last"] != detect["channels_last"]:
+                continue
+            per_face_ms = score["ms"] / score["score_batch_size"]
+            rows.append({"torch_threads": torch_threads, "interop_threads": interop_threads,
+                         "channels_last": detect["channels_last"], "inference_mode": score["inference_mode"],
+                         "yolo_image_size": detect["yolo_image_size"], "score_batch_size": score["score_batch_size"],
+                         "detect_ms": round(detect["ms"], 2), "score_ms_per_face": round(per_face_ms, 3),
+                         "latency_ms": round(detect["ms"] + score["ms"], 2),
+                         "images_per_sec": round(1000 / (detect["ms"] + faces_per_image * per_face_ms), 2)})
+    return rows
+
+
+def choose(rows, latency_cap_ms=None):
+    """延迟不超过上限的组合中吞吐最高的一个；都超出上限时返回延迟最低的"""
+    fitting = [row for row in rows if latency_cap_ms is None or row["latency_ms"] <= latency_cap_ms]
+    if fitting:
+        return max(fitting, key=lambda row: row["images_per_sec"])
+    return min(rows, key=lambda row: row["latency_ms"])
+
+
+def candidates(values, default):
+    """逗号分隔的候选值；省略时用 default"""
+    return [int(value) for value in values.split(",") if value.strip()] if values else default
+
+
+def run(args):
+    cpus = available_cpus()
+    thread_counts = candidates(args.threads, sorted({1, max(1, cpus // 2), cpus}))
+    interop_counts = candidates(args.interop, sorted({1, min(2, cpus), cpus}))
+    options = {"image_sizes": [tuple(int(n) for n in size.lower().split("x")) for size in args.image_sizes.split(",")],
+               "yolo_image_sizes": candidates(args.imgsz, sorted({config.YOLO_IMAGE_SIZE, 512}, reverse=True)),
+               "batch_sizes": candidates(args.batches, sorted({16, 32, config.SCORE_BATCH_SIZE})),
+               "channels_last": (False, True), "repeat": args.repeat}
+    rows = []
+    for torch_threads in thread_counts:
+        for interop_threads in interop_counts:
+            print(f"测量: 线程 {torch_threads}/{interop_threads} ...", file=sys.stderr)
+            measured = measure_threads(torch_threads, interop_threads, options)
+            if "error" in measured:
+                print(f"错误: 线程 {torch_threads}/{interop_threads} 测量失败: {measured['error']}", file=sys.stderr)
+                return 1
+            rows.extend(combine(torch_threads, interop_threads, measured, args.faces))
+
+    best = choose(rows, args.latency_cap)
+    # 基准: 不调优时的设置 (torch 默认线程数即可用核数)
+    baseline = next((row for row in rows if row["torch_threads"] == cpus and row["interop_threads"] == cpus
+                     and not row["channels_last"] and not row["inference_mode"]
+                     and row["yolo_image_size"] == config.YOLO_IMAGE_SIZE
+                     and row["score_batch_size"] == config.SCORE_BATCH_SIZE), None)
+    profile = {"version": PROFILE_VERSION, "host": host_signature(), "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "objective": {"latency_cap_ms": args.latency_cap, "faces_per_image": args.faces,
+                             "image_sizes": args.image_sizes},
+               "settings": {key: best[key] for key in SETTING_KEYS},
+               "expected": {"images_per_sec": best["images_per_sec"], "latency_ms": best["latency_ms"]},
+               "baseline": baseline, "measurements": rows}
+
+    print(format_rows(sorted(rows, key=lambda row: -row["images_per_sec"])[:args.top], args.latency_cap))
+    summary = f"选中: {format_settings(best)} → {best['images_per_sec']} 张/秒，延迟 {best['latency_ms']}ms"
+    if baseline is not None:
+        summary += f" (默认设置 {baseline['images_per_sec']} 张/秒，延迟 {baseline['latency_ms']}ms)"
+    if args.latency_cap is not None and best["latency_ms"] > args.latency_cap:
+        summary += f"；没有组合满足延迟上限 {args.latency_cap}ms，使用延迟最低的"
+    print(summary)
+    if not args.dry_run:
+        print(f"调优配置已保存到 {save_profile(profile, args.output)}")
+    return 0
+
+
+def format_rows(rows, latency_cap_ms):
+    lines = [f"{'线程':>5} {'算子间':>6} {'CL':>3} {'模式':>8} {'YOLO':>5} {'批':>4} {'检测ms':>8} "
+             f"{'ms/人脸':>8} {'延迟ms':>8} {'张/秒':>8}"]
+    for row in rows:
+        over = " *" if latency_cap_ms is not None and row["latency_ms"] > latency_cap_ms else ""
+        lines.append(f"{row['torch_threads']:>5} {row['interop_threads']:>6} {'是' if row['channels_last'] else '否':>3} "
+                     f"{'inf' if row['inference_mode'] else 'no_grad':>8} {row['yolo_image_size']:>5} "
+                     f"{row['score_batch_size']:>4} {row['detect_ms']:>8} {row['score_ms_per_face']:>8} "
+                     f"{row['latency_ms']:>8} {row['images_per_sec']:>8}{over}")
+    if latency_cap_ms is not None:
+        lines.append(f"(* 超出延迟上限 {latency_cap_ms}ms)")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m autotune", description="CPU 推理自动调优")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_parser = sub.add_parser("run", help="实测各设置组合的吞吐，保存本机调优配置")
+    run_parser.add_argument("--latency-cap", type=float, default=config.AUTOTUNE_LATENCY_CAP_MS,
+                            help="每张图片延迟上限 (毫秒，检测 + 一批打分)，省略时只看吞吐")
+    run_parser.add_argument("--faces", type=int, default=4, help="估算吞吐时每张图片的人脸数 (默认 %(default)s)")
+    run_parser.add_argument("--image-sizes", default="1920x1080",
+                            help="合成图片的尺寸 WxH (逗号分隔，检测耗时取平均，默认 %(default)s)")
+    run_parser.add_argument("--threads", help="候选的算子内线程数 (逗号分隔，默认 1、核数一半、核数)")
+    run_parser.add_argument("--interop", help="候选的算子间线程数 (逗号分隔，默认 1、2、核数)")
+    run_parser.add_argument("--imgsz", help=f"候选的 YOLO 输入尺寸 (逗号分隔，默认 {config.YOLO_IMAGE_SIZE},512)")
+    run_parser.add_argument("--batches", help=f"候选的打分批大小 (逗号分隔，默认 16,32,{config.SCORE_BATCH_SIZE})")
+    run_parser.add_argument("--repeat", type=int, default=5, help="每项测量的重复次数，取中位数 (默认 %(default)s)")
+    run_parser.add_argument("--top", type=int, default=10, help="显示吞吐最高的前 N 个组合 (默认 %(default)s)")
+    run_parser.add_argument("-o", "--output", help="调优配置输出路径 (默认为本机调优配置文件)")
+    run_parser.add_argument("--dry-run", action="store_true", help="只显示结果，不保存")
+    show_parser = sub.add_parser("show", help="显示本机调优配置及是否适用于本机")
+    show_parser.add_argument("path", nargs="?", help="调优配置文件 (默认为本机调优配置文件)")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        return run(args)
+    profile = load_profile(args.path)
+    if profile is None:
+        print(f"没有调优配置: {profile_path(args.path)}")
+        return 1
+    mismatch = profile_mismatch(profile)
+    print(f"{profile_path(args.path)} ({profile['created_at']}，{profile['host']['cpu']}，{profile['host']['cpus']} 核)")
+    print(f"设置: {format_settings(profile['settings'])}")
+    print(f"预计: {profile['expected']['images_per_sec']} 张/秒，延迟 {profile['expected']['latency_ms']}ms")
+    print("适用于本机" if not mismatch else f"与本机不一致 ({', '.join(mismatch)})，不会应用")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,263 @@
+# backends.py
+"""导出的推理引擎: TorchScript / ONNX Runtime (CPU)，缺少导出文件时退回 eager PyTorch。
+
+- YOLO 人脸检测: 用 ultralytics 自带的导出 (model.torchscript / model.onnx，动态 batch)，
+  导出文件仍通过 YOLO(...) 加载，预处理、NMS 和 Detections 转换与 .pt 完全一致；
+- 颜值打分: CNNRegressionModel 用 torch.jit.trace 导出 TorchScript，用 torch.onnx 导出 ONNX (batch 维动态)。
+每个导出文件旁边有一个 .json 记录源权重的摘要，源权重更新后旧的导出文件不再使用。
+
+用法:
+    python -m backends export --format torchscript    # 或 onnx / all
+    python -m backends parity photos/                 # 检查各后端的检测框和分数是否一致
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+
+import numpy as np
+import torch
+
+import config
+import metrics
+from result_cache import file_digest
+
+BACKENDS = ("eager", "torchscript", "onnx")
+
+# ONNX Runtime 为可选依赖，首次需要时再导入
+ort = None
+
+
+def import_onnxruntime():
+    """导入 onnxruntime，成功返回 True"""
+    global ort
+    if ort is not None:
+        return True
+    try:
+        import onnxruntime as _ort
+    except ImportError:
+        metrics.event("import_failed", "错误: 缺少 onnxruntime，无法使用 ONNX 后端。请运行 'pip install onnxruntime onnx'",
+                      level="error", module="onnxruntime")
+        return False
+    ort = _ort
+    return True
+
+
+# --- 导出文件路径与有效性 ---
+def yolo_artifact_path(yolo_path, backend):
+    """ultralytics 导出文件的默认位置: 与 .pt 同目录同名"""
+    return os.path.splitext(yolo_path)[0] + {"torchscript": ".torchscript", "onnx": ".onnx"}[backend]
+
+
+def beauty_artifact_path(backend):
+    return {"torchscript": config.BEAUTY_MODEL_TORCHSCRIPT_PATH, "onnx": config.BEAUTY_MODEL_ONNX_PATH}[backend]
+
+
+def _write_manifest(artifact_path, source_path):
+    with open(artifact_path + ".json", "w", encoding="utf-8") as f:
+        json.dump({"source": os.path.abspath(source_path), "source_digest": file_digest(source_path)}, f)
+
+
+def artifact_is_current(artifact_path, source_path):
+    """导出文件存在且由当前的源权重生成"""
+    if not os.path.exists(artifact_path):
+        return False
+    try:
+        with open(artifact_path + ".json", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return manifest.get("source_digest") == file_digest(source_path)
+
+
+# --- 导出 ---
+def export_yolo(yolo_path, backend, image_size=None):
+    """用 ultralytics 导出 YOLO 模型 (动态 batch 和输入尺寸)，返回导出文件路径"""
+    from ultralytics import YOLO
+    exported = YOLO(yolo_path).export(format=backend, imgsz=image_size or config.YOLO_IMAGE_SIZE,
+                                      dynamic=True, verbose=False)
+    # ultralytics 把导出文件放在 .pt 旁边；统一到 yolo_artifact_path 便于加载时查找
+    target = yolo_artifact_path(yolo_path, backend)
+    if os.path.abspath(exported) != os.path.abspath(target):
+        os.replace(exported, target)
+    _write_manifest(target, yolo_path)
+    return target
+
+
+def export_beauty(backend, source_path=None, output_path=None):
+    """导出颜值打分模型 (fp32)，batch 维为动态，返回导出文件路径"""
+    from models import CNNRegressionModel
+    source_path = source_path or config.BEAUTY_MODEL_PATH
+    output_path = output_path or beauty_artifact_path(backend)
+    model = CNNRegressionModel()
+    model.load_state_dict(torch.load(source_path, map_location="cpu"))
+    model.eval()
+    height, width = config.SCORE_MODEL_INPUT_SIZE
+    example = torch.zeros((2, 3, height, width))
+    with torch.no_grad():
+        if backend == "torchscript":
+            torch.jit.save(torch.jit.trace(model, example), output_path)
+        else:
+            torch.onnx.export(model, example, output_path, input_names=["input"], output_names=["score"],
+                              dynamic_axes={"input": {0: "batch"}, "score": {0: "batch"}}, dynamo=False)
+    _write_manifest(output_path, source_path)
+    return output_path
+
+
+# --- 加载 ---
+class OnnxBeautyModel:
+    """用 ONNX Runtime 运行的颜值打分模型，调用方式与 nn.Module 相同 (输入输出均为 torch 张量)"""
+
+    def __init__(self, onnx_path, threads=None):
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(onnx_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch):
+        # score_transform 产出的是连续的 float32 CPU 张量，numpy() 不复制
+        scores = self.session.run(None, {self.input_name: batch.detach().cpu().numpy()})[0]
+        return torch.from_numpy(scores)
+
+    def eval(self):
+        return self
+
+
+def resolve_yolo_path(yolo_path, backend):
+    """返回按后端应加载的 YOLO 文件；导出文件缺失或过期时退回 .pt (eager)。返回 (路径, 实际后端)"""
+    if backend == "eager" or not yolo_path:
+        return yolo_path, "eager"
+    if backend == "onnx" and not import_onnxruntime():
+        return yolo_path, "eager"
+    artifact = yolo_artifact_path(yolo_path, backend)
+    if not artifact_is_current(artifact, yolo_path):
+        metrics.event("backend_fallback", f"警告: 没有可用的 YOLO {backend} 导出文件 ({artifact})，将使用 eager PyTorch。"
+                      f"可运行 'python -m backends export --format {backend}' 生成。",
+                      level="warning", model="yolo", backend=backend, path=artifact)
+        return yolo_path, "eager"
+    return artifact, backend
+
+
+def load_beauty_backend(backend, device=None, source_path=None):
+    """加载导出的颜值打分模型；导出文件缺失、过期或加载失败时返回 None (调用方退回 eager)"""
+    device = torch.device(device or config.DEVICE)
+    source_path = source_path or config.BEAUTY_MODEL_PATH
+    artifact = beauty_artifact_path(backend)
+    if not artifact_is_current(artifact, source_path):
+        metrics.event("backend_fallback", f"警告: 没有可用的颜值打分 {backend} 导出文件 ({artifact})，将使用 eager PyTorch。"
+                      f"可运行 'python -m backends export --format {backend}' 生成。",
+                      level="warning", model="beauty", backend=backend, path=artifact)
+        return None
+    try:
+        if backend == "torchscript":
+            model = torch.jit.load(artifact, map_location=device)
+            model.eval()
+            return model
+        if device.type != "cpu":
+            metrics.event("backend_fallback", f"警告: ONNX 后端只使用 CPU 执行器，当前设备为 {device}，将使用 eager PyTorch。",
+                          level="warning", model="beauty", backend=backend, device=str(device))
+            return None
+        if not import_onnxruntime():
+            return None
+        return OnnxBeautyModel(artifact, threads=torch.get_num_threads())
+    except Exception as e:
+        metrics.event("backend_fallback", f"加载颜值打分 {backend} 导出文件 '{artifact}' 失败: {e}，将使用 eager PyTorch。",
+                      level="warning", model="beauty", backend=backend, path=artifact, error=str(e))
+        return None
+
+
+# --- 一致性检查 ---
+def parity_report(image_paths, backends=BACKENDS, box_tolerance=2.0, score_tolerance=1e-3):
+    """用各后端处理同一批图片，与 eager 的检测框和分数逐一比较。
+
+    返回 [{"backend", "used", "fallback", "images", "mismatched_faces", "max_box_error", "max_score_error", "ok"}, ...]，
+    used 为实际使用的后端；导出文件缺失而退回 eager 时 fallback 为 True，此时的比较没有意义。
+    """
+    from scorer import FaceScorer
+    image_paths = list(image_paths)
+    results = {}
+    used = {}
+    for backend in backends:
+        with contextlib.redirect_stdout(sys.stderr):
+            face_scorer = FaceScorer(cache_path=None, backend=backend, precision="fp32")
+        used[backend] = face_scorer.backends_used
+        results[backend] = [face_scorer.score_image(path) for path in image_paths]
+
+    baseline = results["eager"]
+    rows = []
+    for backend in backends:
+        if backend == "eager":
+            continue
+        mismatched = 0
+        max_box = 0.0
+        max_score = 0.0
+        for expected, actual in zip(baseline, results[backend]):
+            if len(expected["faces"]) != len(actual["faces"]) or expected["status"] != actual["status"]:
+                mismatched += max(len(expected["faces"]), len(actual["faces"]), 1)
+                continue
+            for face_a, face_b in zip(expected["faces"], actual["faces"]):
+                max_box = max(max_box, float(np.abs(np.subtract(face_a["box"], face_b["box"])).max()))
+                max_score = max(max_score, abs(face_a["score"] - face_b["score"]))
+        fallback = any(value != backend for value in used[backend].values())
+        rows.append({"backend": backend, "used": used[backend], "fallback": fallback, "images": len(image_paths),
+                     "mismatched_faces": mismatched, "max_box_error": max_box, "max_score_error": max_score,
+                     "ok": mismatched == 0 and max_box <= box_tolerance and max_score <= score_tolerance})
+    return rows
+
+
+def format_parity_report(rows):
+    lines = [f"{'后端':>12} {'实际使用':>24} {'图片数':>6} {'不一致人脸':>10} {'最大框误差':>10} {'最大分数误差':>12} {'结果':>4}"]
+    for row in rows:
+        used = f"yolo={row['used']['yolo']},beauty={row['used']['beauty']}"
+        verdict = "失败" if not row["ok"] else ("回退" if row["fallback"] else "通过")
+        lines.append(f"{row['backend']:>12} {used:>24} {row['images']:>6} {row['mismatched_faces']:>10} "
+                     f"{row['max_box_error']:>10.2f} {row['max_score_error']:>12.6f} {verdict:>4}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m backends", description="导出推理引擎并检查各后端的一致性")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="导出 YOLO 和颜值打分模型")
+    export.add_argument("--format", choices=["torchscript", "onnx", "all"], default="all", help="导出格式 (默认 all)")
+    export.add_argument("--only", choices=["yolo", "beauty"], help="只导出其中一个模型")
+    parity = commands.add_parser("parity", help="比较各后端的检测框和分数")
+    parity.add_argument("inputs", nargs="+", help="图片文件、目录或通配符")
+    parity.add_argument("-r", "--recursive", action="store_true", help="递归处理子目录")
+    parity.add_argument("--backends", default=",".join(BACKENDS), help="参与比较的后端 (默认 %(default)s)")
+    parity.add_argument("--box-tolerance", type=float, default=2.0, help="允许的最大框坐标误差 (像素)")
+    parity.add_argument("--score-tolerance", type=float, default=1e-3, help="允许的最大分数误差")
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        formats = ["torchscript", "onnx"] if args.format == "all" else [args.format]
+        failed = False
+        for backend in formats:
+            if args.only != "beauty":
+                try:
+                    print(f"YOLO {backend}: {export_yolo(config.resolve_yolo_model_path(), backend)}")
+                except Exception as e:
+                    print(f"YOLO {backend} 导出失败: {e}", file=sys.stderr)
+                    failed = True
+            if args.only != "yolo":
+                try:
+                    print(f"颜值打分 {backend}: {export_beauty(backend)}")
+                except Exception as e:
+                    print(f"颜值打分 {backend} 导出失败: {e}", file=sys.stderr)
+                    failed = True
+        return 1 if failed else 0
+
+    from image_io import iter_image_paths
+    backends = [name.strip() for name in args.backends.split(",") if name.strip()]
+    if "eager" not in backends:
+        backends.insert(0, "eager") # eager 是比较基准
+    rows = parity_report(iter_image_paths(args.inputs, args.recursive), backends,
+                         box_tolerance=args.box_tolerance, score_tolerance=args.score_tolerance)
+    print(format_parity_report(rows))
+    return 0 if all(row["ok"] for row in rows) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+# batch_score.py
+"""命令行批量打分 (无需 PyQt5)。
+
+用法示例:
+    python -m batch_score photos/ -o results.jsonl
+    python -m batch_score "photos/**/*.jpg" --format csv -o results.csv
+    python -m batch_score a.jpg b.png > results.jsonl
+    python -m batch_score photos/ --workers 8 -o results.jsonl
+    python -m batch_score photos/ --scaling-report 1,2,4,8
+    python -m batch_score photos/ --pipeline --detect-batch 8 --score-batch 64
+    python -m batch_score group_photos/ --detection tiled --tile-size 640 --tile-overlap 0.2
+    python -m batch_score photos/ -o results.jsonl --metrics metrics.prom
+    python -m batch_score bursts/ --dedup 4 -o results.jsonl
+    python -m batch_score photos/ -o results.jsonl --resume --parquet results_parquet/
+    python -m batch_score photos/ -o results.jsonl --latency-budget 2.5
+"""
+import argparse
+import contextlib
+import sys
+import time
+
+import config
+import metrics
+from dedup import Deduplicator
+from image_io import iter_image_paths
+from parallel import score_paths_parallel, scaling_report, format_scaling_report
+from pipeline import ScoringPipeline, format_stats
+from score_models import SCORE_MODELS, select_score_model
+from sinks import SINKS, open_sink, import_pyarrow, CheckpointedSink
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(prog="python -m batch_score", description="批量人脸检测与颜值打分")
+    parser.add_argument("inputs", nargs="+", help="图片文件、目录或通配符 (如 'photos/**/*.jpg')")
+    parser.add_argument("-o", "--output", help="结果输出文件，省略时写到标准输出")
+    parser.add_argument("-f", "--format", choices=sorted(SINKS), default="jsonl", help="输出格式 (默认 jsonl)")
+    parser.add_argument("--resume", action="store_true",
+                        help="断点续跑: 结果追加写入 -o 指定的文件，已提交的图片记录在 <输出文件>.ckpt 中，"
+                             "中断后用同样的命令重新运行会跳过这些图片")
+    parser.add_argument("--parquet", metavar="DIR", help="同时把结果按块写成 Parquet 分片 (需要 pyarrow)")
+    parser.add_argument("--commit-every", type=int, default=config.RESUME_CHUNK_SIZE,
+                        help="每多少条结果提交一次检查点 / 写一个 Parquet 分片 (默认 %(default)s)")
+    parser.add_argument("-r", "--recursive", action="store_true", help="递归处理子目录")
+    parser.add_argument("--cache", default=config.RESULT_CACHE_PATH if config.RESULT_CACHE_ENABLED else None,
+                        help="结果缓存数据库路径 (默认使用 config.RESULT_CACHE_PATH)")
+    parser.add_argument("--no-cache", dest="cache", action="store_const", const=None, help="不使用结果缓存")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="工作进程数 (默认 1，在当前进程内处理；大于 1 时使用进程池)")
+    parser.add_argument("--chunksize", type=int, default=8, help="每次分发给一个工作进程的图片数 (默认 8)")
+    parser.add_argument("--unordered", action="store_true", help="按完成顺序而不是输入顺序输出结果")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="使用 解码 → 检测 → 打分 分阶段流水线 (跨图片合并批次)，结束时输出各阶段统计")
+    parser.add_argument("--decode-threads", type=int, default=4, help="流水线解码线程数 (默认 4)")
+    parser.add_argument("--detect-batch", type=int, default=8, help="流水线中每次 YOLO 调用的最大图片数 (默认 8)")
+    parser.add_argument("--score-batch", type=int, default=64, help="流水线中每次打分模型调用的目标人脸数 (默认 64)")
+    parser.add_argument("--queue-size", type=int, default=16, help="流水线阶段之间队列的容量 (默认 16)")
+    parser.add_argument("--detection", choices=["single", "tiled"], default=config.DETECTION_MODE,
+                        help="检测模式: single 整图缩小后检测一次；tiled 按原始分辨率分块检测，适合人脸很多的大合影")
+    parser.add_argument("--tile-size", type=int, default=config.TILE_SIZE, help="分块边长 (默认 %(default)s)")
+    parser.add_argument("--tile-overlap", type=float, default=config.TILE_OVERLAP, help="相邻块重叠比例 (默认 %(default)s)")
+    parser.add_argument("--tile-batch", type=int, default=config.TILE_BATCH, help="每次 YOLO 调用的块数 (默认 %(default)s)")
+    parser.add_argument("--tile-memory-mb", type=int, default=config.TILE_MEMORY_LIMIT_MB,
+                        help="分块模式的内存上限 MB，超出时降采样解码 (默认 %(default)s)")
+    parser.add_argument("--backend", choices=["eager", "torchscript", "onnx"], default=config.INFERENCE_BACKEND,
+                        help="推理后端 (默认 %(default)s)，导出文件由 python -m backends export 生成")
+    parser.add_argument("--score-model", choices=sorted(SCORE_MODELS),
+                        help=f"打分模型 (默认 {config.SCORE_MODEL})，见 python -m score_models list")
+    parser.add_argument("--latency-budget", metavar="MS", type=float, default=config.SCORE_MODEL_LATENCY_BUDGET_MS,
+                        help="每张人脸的打分延迟预算 (毫秒)：启动时实测各打分模型，使用预算内最好的一个 (指定 --score-model 时忽略)")
+    parser.add_argument("--dedup", metavar="DISTANCE", nargs="?", type=int, const=config.DEDUP_MAX_DISTANCE,
+                        help="跳过近似重复的图片 (连拍、缩放副本、重新压缩)，沿用第一张的结果: "
+                             f"感知哈希的汉明距离不超过 DISTANCE (默认 {config.DEDUP_MAX_DISTANCE}) 视为重复")
+    parser.add_argument("--metrics", metavar="PATH",
+                        help="结束时把各阶段耗时、人脸数和缓存命中写入文件 (.prom / .txt 为 Prometheus 文本格式，其他为 JSON)")
+    parser.add_argument("--scaling-report", metavar="N,N,...",
+                        help="不输出结果，依次用给定的进程数处理输入并报告吞吐 (张/秒)，例如 1,2,4,8")
+    return parser
+
+
+def main(argv=None):
+    parser = build_arg_parser()
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error(f"--workers 必须不小于 1 (收到 {args.workers})")
+    image_paths = iter_image_paths(args.inputs, args.recursive)
+    engine_kwargs = {"detection_mode": args.detection, "tile_size": args.tile_size, "tile_overlap": args.tile_overlap,
+                     "tile_batch": args.tile_batch, "tile_memory_mb": args.tile_memory_mb,
+                     "backend": args.backend, "score_model": args.score_model,
+                     "latency_budget_ms": args.latency_budget}
+    if args.workers > 1 and args.score_model is None and args.latency_budget is not None:
+        # 在主进程里按每个工作进程分到的线程数实测一次，所有工作进程使用同一个打分模型
+        with contextlib.redirect_stdout(sys.stderr):
+            from parallel import threads_per_worker
+            engine_kwargs["score_model"] = select_score_model(args.latency_budget,
+                                                              threads=threads_per_worker(args.workers))[0]
+        if engine_kwargs["score_model"] is None:
+            print("错误: 没有可加载的打分模型。", file=sys.stderr)
+            return 1
+
+    if args.scaling_report:
+        worker_counts = [int(n) for n in args.scaling_report.split(",") if n.strip()]
+        # 吞吐测试不使用结果缓存，否则测到的是缓存命中速度
+        rows = scaling_report(image_paths, worker_counts, chunksize=args.chunksize,
+                              scorer_kwargs=dict(engine_kwargs, cache_path=None))
+        print(format_scaling_report(rows))
+        return 0
+
+    if args.workers > 1 and args.pipeline:
+        print("错误: --workers 与 --pipeline 不能同时使用。", file=sys.stderr)
+        return 2
+
+    # 断点续跑 / Parquet 输出: 在开始打分前打开输出，以便跳过已提交的图片
+    sink = None
+    if args.resume or args.parquet:
+        pyarrow = None
+        if args.parquet:
+            pyarrow = import_pyarrow()
+            if pyarrow is None:
+                return 2
+        try:
+            sink = CheckpointedSink(args.format, args.output, parquet_dir=args.parquet, chunk_size=args.commit_every,
+                                    resume=args.resume, pyarrow=pyarrow)
+        except ValueError as e:
+            print(f"错误: {e}", file=sys.stderr)
+            return 2
+        image_paths = sink.pending_paths(image_paths)
+
+    deduplicator = None
+    if args.dedup is not None:
+        deduplicator = Deduplicator(max_distance=args.dedup)
+        image_paths = deduplicator.filter(image_paths)
+
+    face_scorer = None
+    scoring_pipeline = None
+    if args.workers > 1:
+        results = score_paths_parallel(image_paths, args.workers, chunksize=args.chunksize,
+                                       ordered=not args.unordered,
+                                       scorer_kwargs=dict(engine_kwargs, cache_path=args.cache))
+    else:
+        # 模型加载信息输出到 stderr，避免污染写到 stdout 的结果
+        with contextlib.redirect_stdout(sys.stderr):
+            from scorer import FaceScorer
+            face_scorer = FaceScorer(cache_path=args.cache, **engine_kwargs)
+        status = face_scorer.models_loaded
+        if not status["yolo"] or not status["beauty"]:
+            print("错误: 模型加载失败，无法进行批量打分。", file=sys.stderr)
+            if sink is not None:
+                sink.close()
+            return 1
+        if args.pipeline:
+            scoring_pipeline = ScoringPipeline(face_scorer, decode_workers=args.decode_threads,
+                                               detect_batch=args.detect_batch, score_batch=args.score_batch,
+                                               queue_size=args.queue_size)
+            results = scoring_pipeline.run(image_paths, ordered=not args.unordered)
+        else:
+            results = face_scorer.score_paths(image_paths)
+
+    if deduplicator is not None:
+        results = deduplicator.expand(results)
+
+    if sink is None:
+        sink = open_sink(args.format, args.output)
+    count = 0
+    failed = 0
+    start = time.perf_counter()
+    try:
+        for result in results:
+            sink.write(result)
+            count += 1
+            if result["status"] == "error":
+                failed += 1
+    except KeyboardInterrupt:
+        print("已中断。", file=sys.stderr)
+    finally:
+        sink.close()
+
+    elapsed = time.perf_counter() - start
+    rate = count / elapsed if elapsed > 0 else 0.0
+    print(f"完成: {count} 张图片 ({failed} 张失败)，耗时 {elapsed:.1f}s，{rate:.2f} 张/秒", file=sys.stderr)
+    if scoring_pipeline is not None:
+        print(format_stats(scoring_pipeline.stats()), file=sys.stderr)
+    if isinstance(sink, CheckpointedSink) and sink.checkpoint is not None:
+        print(f"断点续跑: 跳过 {sink.checkpoint.skipped} 张此前已处理的图片", file=sys.stderr)
+    if deduplicator is not None:
+        dedup_stats = deduplicator.stats()
+        print(f"近似重复: {dedup_stats['duplicates']} 张沿用了代表图片的结果 (代表图片 {dedup_stats['representatives']} 张)",
+              file=sys.stderr)
+    if face_scorer is not None and face_scorer.cache is not None:
+        print(f"结果缓存: 命中 {face_scorer.cache.hits}，未命中 {face_scorer.cache.misses}", file=sys.stderr)
+    if args.metrics:
+        # --workers 大于 1 时模型在工作进程中运行，这里只有主进程的指标
+        print(f"运行指标已写入 {metrics.dump(args.metrics)}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+# bench_detect_proxy.py
+"""检测代理图基准: 对比整图解码与降采样解码 (JPEG DCT 域缩放) 生成检测输入的耗时和峰值内存。
+
+每种方式在独立子进程中运行，峰值内存为导入完成后子进程常驻内存峰值 (VmHWM) 的增量。
+
+用法: python benchmarks/bench_detect_proxy.py photo1.jpg [photo2.jpg ...] [--repeat 5]
+不给图片时生成一张 6000x4000 的测试 JPEG。
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MODES = {
+    "full": "整图解码 (旧)",
+    "proxy": "代理图 (无人脸)",
+    "proxy+full": "代理图 + 原图 (有人脸)",
+}
+
+
+def _rss_kb(field):
+    """读取 /proc/self/status 中的 VmRSS / VmHWM (KB)，不可用时退回 ru_maxrss"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_child(mode, image_path, repeat, max_side):
+    from image_io import read_image_bytes, decode_image_bytes, decode_detection_proxy
+    # 导入 torch 时的瞬时峰值会掩盖解码的内存占用: 先重置峰值 (Linux)，再以当前常驻内存为基线
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+    baseline = _rss_kb("VmRSS")
+    samples = []
+    for _ in range(repeat):
+        data = read_image_bytes(image_path)
+        start = time.perf_counter()
+        if mode == "full":
+            image = decode_image_bytes(data)
+        else:
+            proxy, image, _ = decode_detection_proxy(data, max_side)
+            if mode == "proxy+full" and image is None:
+                image = decode_image_bytes(data)
+        samples.append((time.perf_counter() - start) * 1000)
+        del data, image
+    peak_kb = _rss_kb("VmHWM") - baseline
+    print(json.dumps({"ms": statistics.median(samples), "peak_mb": peak_kb / 1024}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检测代理图解码基准")
+    parser.add_argument("images", nargs="*", help="测试图片")
+    parser.add_argument("--repeat", type=int, default=5, help="每项重复次数 (取中位数)")
+    parser.add_argument("--max-side", type=int, default=None, help="检测输入长边 (默认 config.YOLO_IMAGE_SIZE)")
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "IMAGE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child[0], args.child[1], args.repeat, args.max_side)
+        return
+
+    if args.max_side is None:
+        import config
+        args.max_side = config.YOLO_IMAGE_SIZE
+    images = args.images
+    if not images:
+        import cv2
+        import numpy as np
+        sample = os.path.join(tempfile.gettempdir(), "bench_detect_proxy_6000x4000.jpg")
+        if not os.path.exists(sample):
+            # 平滑的色块 + 轻微噪声，压缩率接近真实照片
+            blocks = np.random.default_rng(0).integers(0, 256, (40, 60, 3), dtype=np.uint8)
+            image = cv2.resize(blocks, (6000, 4000), interpolation=cv2.INTER_CUBIC)
+            image = cv2.add(image, np.random.default_rng(1).integers(0, 8, image.shape, dtype=np.uint8))
+            cv2.imwrite(sample, image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        images = [sample]
+
+    print(f"检测输入长边 {args.max_side}，每项重复 {args.repeat} 次 (耗时取中位数)")
+    for image_path in images:
+        print(os.path.basename(image_path))
+        for mode, label in MODES.items():
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", mode, image_path,
+                                     "--repeat", str(args.repeat), "--max-side", str(args.max_side)],
+                                    capture_output=True, text=True, check=True).stdout
+            row = json.loads(output.strip().splitlines()[-1])
+            print(f"  {label:<20} {row['ms']:>8.1f} ms   峰值内存 +{row['peak_mb']:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
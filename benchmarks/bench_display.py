@@ -0,0 +1,75 @@
+# bench_display.py
+"""cv_image_to_qpixmap 微基准: 对比旧的显示路径 (整图 cvtColor → 整图 QPixmap → Qt 平滑缩放)
+与当前实现 (先 INTER_AREA 缩小 → BGR888 直接建 QImage)，以及命中尺寸缓存时的耗时。
+
+用法: python benchmarks/bench_display.py [--sizes 2000x1500,6000x4000] [--repeat 10]
+没有显示器时设置 QT_QPA_PLATFORM=offscreen。
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+from PyQt5.QtCore import Qt, QSize
+from PyQt5.QtGui import QImage, QPixmap
+from PyQt5.QtWidgets import QApplication
+
+import utils
+
+
+def legacy_cv_image_to_qpixmap(cv_img, label_size):
+    """旧实现: 三次整图大小的分配后才缩放"""
+    height, width = cv_img.shape[:2]
+    rgb_image = cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB)
+    q_img = QImage(rgb_image.data, width, height, 3 * width, QImage.Format_RGB888)
+    pixmap = QPixmap.fromImage(q_img)
+    return pixmap.scaled(label_size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+
+def time_call(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="cv_image_to_qpixmap 微基准")
+    parser.add_argument("--sizes", default="1280x960,4000x3000,6000x4000", help="测试图片尺寸 (宽x高，逗号分隔)")
+    parser.add_argument("--label", default="550x450", help="标签尺寸 (宽x高)")
+    parser.add_argument("--repeat", type=int, default=10, help="每项重复次数 (取中位数)")
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    label_size = QSize(*[int(v) for v in args.label.split("x")])
+    rng = np.random.default_rng(0)
+
+    print(f"标签尺寸 {args.label}，每项重复 {args.repeat} 次，单位 ms (中位数)")
+    print(f"{'图片尺寸':>12} {'旧实现':>9} {'新实现':>9} {'缓存命中':>9} {'加速比':>7}")
+    for size in args.sizes.split(","):
+        width, height = (int(v) for v in size.split("x"))
+        cv_img = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+        legacy = time_call(lambda: legacy_cv_image_to_qpixmap(cv_img, label_size), args.repeat)
+
+        def uncached():
+            utils._pixmap_cache["image"] = None # 每次都重新转换
+            utils.cv_image_to_qpixmap(cv_img, label_size)
+        fast = time_call(uncached, args.repeat)
+
+        utils.cv_image_to_qpixmap(cv_img, label_size)
+        cached = time_call(lambda: utils.cv_image_to_qpixmap(cv_img, label_size), args.repeat)
+
+        print(f"{size:>12} {legacy:>9.2f} {fast:>9.2f} {cached:>9.3f} {legacy / fast:>7.1f}x")
+    del app
+
+
+if __name__ == "__main__":
+    main()
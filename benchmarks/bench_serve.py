@@ -0,0 +1,137 @@
+# bench_serve.py
+"""HTTP 打分服务压测: 多个并发客户端向本机服务上传图片，对比不同微批参数下的延迟、吞吐和被拒绝的请求数。
+
+默认在本进程内启动服务 (模型只加载一次，每组参数各起一个随机端口的服务)；
+给出 --url 时压测已运行的服务 (python -m serve)，只能是本机地址。
+
+用法:
+    python benchmarks/bench_serve.py                                   # 合成图片，对比 max_batch 1 / 8
+    python benchmarks/bench_serve.py --images photos/ --concurrency 32 --batches 1,4,16 --max-queue 16
+    python benchmarks/bench_serve.py --url http://127.0.0.1:8765 --images photos/ --json serve.json
+"""
+import argparse
+import contextlib
+import http.client
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+
+import config
+from image_io import iter_image_paths
+from serve import ScoringServer, is_loopback
+from bench_stages import generate_images
+
+
+def run_clients(url, payloads, concurrency, requests):
+    """concurrency 个客户端线程各自保持一个连接，共发送 requests 个请求，返回统计字典"""
+    parts = urlsplit(url)
+    latencies = []
+    codes = {}
+    batch_sizes = []
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def client():
+        connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=60)
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                break
+            body = payloads[index % len(payloads)]
+            start = time.perf_counter()
+            connection.request("POST", "/score", body=body, headers={"Content-Type": "application/octet-stream"})
+            response = connection.getresponse()
+            data = response.read()
+            elapsed = time.perf_counter() - start
+            with lock:
+                codes[response.status] = codes.get(response.status, 0) + 1
+                if response.status == 200:
+                    latencies.append(elapsed * 1000)
+                    batch_sizes.extend(result.get("batch_size", 0) for result in json.loads(data)["results"])
+        connection.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    values = np.array(latencies) if latencies else np.zeros(1)
+    return {"requests": requests, "concurrency": concurrency, "seconds": round(elapsed, 3),
+            "ok_per_sec": round(len(latencies) / elapsed, 2), "codes": codes,
+            "p50_ms": round(float(np.percentile(values, 50)), 1), "p95_ms": round(float(np.percentile(values, 95)), 1),
+            "p99_ms": round(float(np.percentile(values, 99)), 1),
+            "mean_batch": round(float(np.mean(batch_sizes)), 2) if batch_sizes else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP 打分服务压测")
+    parser.add_argument("--images", nargs="+", help="上传的图片 (文件、目录或通配符)，省略时使用合成图片")
+    parser.add_argument("--url", help="压测已运行的服务 (只允许本机地址)，不在本进程内启动")
+    parser.add_argument("--concurrency", type=int, default=16, help="并发客户端数")
+    parser.add_argument("--requests", type=int, default=200, help="总请求数")
+    parser.add_argument("--batches", default="1,8", help="依次测试的 max_batch (逗号分隔，仅本进程内启动时有效)")
+    parser.add_argument("--max-wait-ms", type=float, default=config.SERVE_MAX_WAIT_MS, help="凑批最长等待")
+    parser.add_argument("--max-queue", type=int, default=config.SERVE_MAX_QUEUE, help="队列上限")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench_serve_") as temp_dir:
+        if args.images:
+            paths = list(iter_image_paths(args.images, recursive=True))
+        else:
+            paths = [path for path, _ in generate_images([(1280, 960)], [4], 8, temp_dir)]
+        payloads = []
+        for path in paths:
+            with open(path, "rb") as f:
+                payloads.append(f.read())
+    if not payloads:
+        raise SystemExit("错误: 没有可用的图片。")
+
+    rows = []
+    if args.url:
+        if not is_loopback(urlsplit(args.url).hostname or ""):
+            raise SystemExit("错误: 只能压测本机上的服务。")
+        row = run_clients(args.url, payloads, args.concurrency, args.requests)
+        rows.append(dict(row, max_batch=None))
+    else:
+        from scorer import FaceScorer
+        with contextlib.redirect_stdout(sys.stderr):
+            face_scorer = FaceScorer(cache_path=None)
+            face_scorer.warm_up()
+        if not all(face_scorer.models_loaded.values()):
+            raise SystemExit("错误: 模型加载失败，无法运行基准。")
+        for max_batch in [int(n) for n in args.batches.split(",")]:
+            server = ScoringServer(("127.0.0.1", 0), face_scorer, max_batch=max_batch,
+                                   max_wait_ms=args.max_wait_ms, max_queue=args.max_queue)
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            try:
+                rows.append(dict(run_clients(server.url, payloads, args.concurrency, args.requests), max_batch=max_batch))
+            finally:
+                server.shutdown()
+                server.server_close()
+
+    print(f"{'max_batch':>9} {'成功/秒':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'平均批':>6}  状态码")
+    for row in rows:
+        print(f"{str(row['max_batch'] or '-'):>9} {row['ok_per_sec']:>8} {row['p50_ms']:>8} {row['p95_ms']:>8} "
+              f"{row['p99_ms']:>8} {row['mean_batch']:>6}  {row['codes']}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
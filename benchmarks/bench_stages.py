@@ -0,0 +1,306 @@
+# bench_stages.py
+"""分阶段延迟基准: 对每张图片分别计时 读取 → 解码 → YOLO 检测 → Detections 转换 → 筛选裁剪
+→ score_transform → 打分模型前向 → 绘制人脸框 → cv_image_to_qpixmap，
+输出各阶段 p50/p95/p99、吞吐和峰值内存，并可写出 JSON 供不同提交 / 配置之间对比。
+
+用法:
+    python benchmarks/bench_stages.py                                   # 合成图片 (默认尺寸和人脸数)
+    python benchmarks/bench_stages.py --sizes 1920x1080,6000x4000 --faces 1,8,32 --json run.json
+    python benchmarks/bench_stages.py --images photos/ --repeat 3 --json run.json
+    python benchmarks/bench_stages.py --compare before.json after.json
+
+合成图片上画的是简化的人脸图案，检测模型不一定能检测到；此时检测阶段照常计时，
+后续阶段改用已知的人脸框，保证裁剪和打分按指定的人脸数计时 (报告中记为 injected_faces)。
+没有显示器时设置 QT_QPA_PLATFORM=offscreen；未安装 PyQt5 时跳过 display 阶段。
+"""
+import argparse
+import contextlib
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import cv2
+import numpy as np
+import torch
+
+import config
+from image_io import read_image_bytes, decode_image_bytes, iter_image_paths, score_transform
+from precision import input_dtype
+
+STAGES = ["read", "decode", "decode_full", "detect", "convert", "crop", "transform", "forward", "draw", "display", "total"]
+
+
+# --- 合成图片 ---
+def draw_synthetic_face(image, box, rng):
+    """在 box 内画一个简化的人脸 (肤色椭圆 + 眼睛 + 嘴)"""
+    x_min, y_min, x_max, y_max = box
+    center = ((x_min + x_max) // 2, (y_min + y_max) // 2)
+    axes = ((x_max - x_min) // 2, (y_max - y_min) // 2)
+    skin = tuple(int(v) for v in rng.integers([120, 150, 190], [160, 190, 235]))
+    cv2.ellipse(image, center, axes, 0, 0, 360, skin, -1)
+    eye_y = y_min + (y_max - y_min) * 2 // 5
+    for eye_x in (x_min + (x_max - x_min) // 3, x_min + (x_max - x_min) * 2 // 3):
+        cv2.circle(image, (eye_x, eye_y), max(1, axes[0] // 6), (40, 30, 30), -1)
+    cv2.ellipse(image, (center[0], y_min + (y_max - y_min) * 3 // 4), (max(1, axes[0] // 3), max(1, axes[1] // 8)),
+                0, 0, 180, (60, 60, 150), max(1, axes[0] // 12))
+
+
+def generate_images(sizes, face_counts, count, output_dir, seed=0):
+    """生成 尺寸 × 人脸数 × count 张 JPEG，返回 [(路径, 已知人脸框), ...]"""
+    rng = np.random.default_rng(seed)
+    images = []
+    for width, height in sizes:
+        for faces in face_counts:
+            for index in range(count):
+                # 平滑的背景 + 轻微噪声，压缩率接近真实照片
+                background = rng.integers(0, 256, (6, 8, 3), dtype=np.uint8)
+                image = cv2.resize(background, (width, height), interpolation=cv2.INTER_CUBIC)
+                image = cv2.add(image, rng.integers(0, 12, image.shape, dtype=np.uint8))
+                # 人脸按网格排列，互不重叠
+                columns = math.ceil(math.sqrt(faces * width / height)) if faces else 1
+                rows = math.ceil(faces / columns) if faces else 1
+                cell_w, cell_h = width // columns, height // rows
+                boxes = []
+                for face in range(faces):
+                    cx, cy = (face % columns) * cell_w, (face // columns) * cell_h
+                    face_w = int(min(cell_w, cell_h / 1.3) * 0.7)
+                    face_h = int(face_w * 1.3)
+                    x_min, y_min = cx + (cell_w - face_w) // 2, cy + (cell_h - face_h) // 2
+                    box = [x_min, y_min, x_min + face_w, y_min + face_h]
+                    draw_synthetic_face(image, box, rng)
+                    boxes.append(box)
+                path = os.path.join(output_dir, f"synthetic_{width}x{height}_{faces}faces_{index}.jpg")
+                cv2.imwrite(path, image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+                images.append((path, boxes))
+    return images
+
+
+# --- 计时 ---
+class StageTimer:
+    def __init__(self):
+        self.samples = {stage: [] for stage in STAGES}
+
+    @contextlib.contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        yield
+        self.samples[stage].append((time.perf_counter() - start) * 1000)
+
+    def summary(self):
+        stages = {}
+        for stage, samples in self.samples.items():
+            if not samples:
+                continue
+            values = np.array(samples)
+            stages[stage] = {"count": len(values), "mean_ms": round(float(values.mean()), 3),
+                             "p50_ms": round(float(np.percentile(values, 50)), 3),
+                             "p95_ms": round(float(np.percentile(values, 95)), 3),
+                             "p99_ms": round(float(np.percentile(values, 99)), 3)}
+        return stages
+
+
+def bench_image(face_scorer, image_path, known_boxes, timer, to_pixmap, label_size):
+    """按实际处理顺序逐阶段计时一张图片，返回 (检测到的人脸数, 注入的人脸数)"""
+    import scorer
+    start = time.perf_counter()
+    with timer.time("read"):
+        data = read_image_bytes(image_path)
+    with timer.time("decode"):
+        proxy, cv_img, full_size = face_scorer.decode_for_detection(data)
+
+    if face_scorer.detection_mode == "tiled":
+        with timer.time("detect"): # 分块模式的检测和转换在 detect_tiled 内部交织，合并计时
+            detections = face_scorer.detect_tiled(proxy)
+    else:
+        with timer.time("detect"):
+            output = face_scorer.yolo_model([proxy], conf=face_scorer.conf_threshold,
+                                            imgsz=face_scorer.yolo_image_size, verbose=False)[0]
+        with timer.time("convert"):
+            detections = scorer.Detections.from_ultralytics(output)
+    detections = face_scorer.remap_detections(detections, proxy, full_size)
+
+    injected = 0
+    with timer.time("crop"):
+        selected = face_scorer.select_faces(detections, full_size)
+    detected = len(selected)
+    if not selected and known_boxes:
+        selected = [(box, 1.0) for box in known_boxes[:face_scorer.max_faces]]
+        injected = len(selected)
+
+    if selected:
+        if cv_img is None:
+            with timer.time("decode_full"):
+                cv_img = decode_image_bytes(data)
+        with timer.time("crop"):
+            crops = face_scorer.crop_selected(cv_img, selected, full_size)
+        scores = []
+        for offset in range(0, len(crops), face_scorer.score_batch_size):
+            with timer.time("transform"):
+                spec = face_scorer.score_model
+                batch = score_transform(crops[offset:offset + face_scorer.score_batch_size], spec.input_size, spec.mean, spec.std)
+                batch = batch.to(face_scorer.device, dtype=input_dtype(face_scorer.precision))
+            with timer.time("forward"):
+                with torch.no_grad():
+                    scores.extend(face_scorer.beauty_model(batch).float().view(-1).tolist())
+        faces = [{"box": box, "score": score} for (box, _), score in zip(selected, scores)]
+        with timer.time("draw"):
+            face_scorer.draw_faces(cv_img, faces)
+    elif cv_img is None:
+        cv_img = proxy
+
+    if to_pixmap is not None:
+        import utils
+        utils._pixmap_cache["image"] = None # 每次都真实转换，不命中显示缓存
+        with timer.time("display"):
+            to_pixmap(cv_img, label_size)
+    timer.samples["total"].append((time.perf_counter() - start) * 1000)
+    return detected, injected
+
+
+def peak_rss_mb():
+    # Linux 上 ru_maxrss 单位为 KB，macOS 上为字节
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    from scorer import FaceScorer
+    with contextlib.redirect_stdout(sys.stderr):
+        face_scorer = FaceScorer(cache_path=None, detection_mode=args.detection, backend=args.backend,
+                                 precision=args.precision)
+        face_scorer.warm_up()
+    if not all(face_scorer.models_loaded.values()):
+        raise SystemExit("错误: 模型加载失败，无法运行基准。")
+
+    to_pixmap = label_size = None
+    if not args.no_display:
+        try:
+            from PyQt5.QtCore import QSize
+            from PyQt5.QtWidgets import QApplication
+            from utils import cv_image_to_qpixmap
+            app = QApplication.instance() or QApplication([]) # QPixmap 需要 QApplication
+            to_pixmap, label_size = cv_image_to_qpixmap, QSize(config.IMAGE_MIN_WIDTH, config.IMAGE_MIN_HEIGHT)
+        except ImportError:
+            print("未安装 PyQt5，跳过 display 阶段。", file=sys.stderr)
+
+    with tempfile.TemporaryDirectory(prefix="bench_stages_") as temp_dir:
+        if args.images:
+            images = [(path, []) for path in iter_image_paths(args.images, recursive=True)]
+        else:
+            sizes = [tuple(int(v) for v in size.split("x")) for size in args.sizes.split(",")]
+            face_counts = [int(n) for n in args.faces.split(",")]
+            images = generate_images(sizes, face_counts, args.count, temp_dir, seed=args.seed)
+        if not images:
+            raise SystemExit("错误: 没有可用的图片。")
+
+        for _ in range(args.warmup):
+            for path, boxes in images:
+                bench_image(face_scorer, path, boxes, StageTimer(), to_pixmap, label_size)
+        timer = StageTimer()
+        detected = injected = 0
+        for _ in range(args.repeat):
+            for path, boxes in images:
+                found, added = bench_image(face_scorer, path, boxes, timer, to_pixmap, label_size)
+                detected += found
+                injected += added
+
+    total_seconds = sum(timer.samples["total"]) / 1000
+    processed = len(timer.samples["total"])
+    return {
+        "meta": {
+            "revision": git_revision(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(), "torch": torch.__version__, "platform": platform.platform(),
+            "cpus": os.cpu_count(), "torch_threads": torch.get_num_threads(), "device": str(face_scorer.device),
+            "detection_mode": face_scorer.detection_mode, "backends": face_scorer.backends_used,
+            "precision": face_scorer.precision, "source": "folder" if args.images else "synthetic",
+            "sizes": None if args.images else args.sizes, "faces": None if args.images else args.faces,
+            "images": len(images), "repeat": args.repeat,
+        },
+        "images_processed": processed,
+        "detected_faces": detected,
+        "injected_faces": injected,
+        "throughput_images_per_sec": round(processed / total_seconds, 3) if total_seconds > 0 else 0.0,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "stages": timer.summary(),
+    }
+
+
+def format_report(report):
+    meta = report["meta"]
+    lines = [f"版本 {meta['revision']} | {meta['detection_mode']} | 后端 {meta['backends']} | 精度 {meta['precision']} | "
+             f"{meta['images']} 张 × {meta['repeat']} 次",
+             f"吞吐 {report['throughput_images_per_sec']} 张/秒，峰值内存 {report['peak_rss_mb']} MB，"
+             f"检测到人脸 {report['detected_faces']}，注入人脸 {report['injected_faces']}",
+             f"{'阶段':<12} {'次数':>6} {'平均':>9} {'p50':>9} {'p95':>9} {'p99':>9}  (ms)"]
+    for stage, row in report["stages"].items():
+        lines.append(f"{stage:<12} {row['count']:>6} {row['mean_ms']:>9.2f} {row['p50_ms']:>9.2f} "
+                     f"{row['p95_ms']:>9.2f} {row['p99_ms']:>9.2f}")
+    return "\n".join(lines)
+
+
+def format_comparison(before, after):
+    """对比两次运行的 p50 (第二次相对第一次的变化)"""
+    lines = [f"{before['meta']['revision']} → {after['meta']['revision']}",
+             f"吞吐 {before['throughput_images_per_sec']} → {after['throughput_images_per_sec']} 张/秒，"
+             f"峰值内存 {before['peak_rss_mb']} → {after['peak_rss_mb']} MB",
+             f"{'阶段':<12} {'p50 前':>9} {'p50 后':>9} {'变化':>8}"]
+    for stage in STAGES:
+        if stage in before["stages"] and stage in after["stages"]:
+            old, new = before["stages"][stage]["p50_ms"], after["stages"][stage]["p50_ms"]
+            change = f"{(new - old) / old * 100:+.1f}%" if old > 0 else "n/a"
+            lines.append(f"{stage:<12} {old:>9.2f} {new:>9.2f} {change:>8}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分阶段延迟基准")
+    parser.add_argument("--images", nargs="+", help="使用本地图片 (文件、目录或通配符) 而不是合成图片")
+    parser.add_argument("--sizes", default="1280x960,4000x3000", help="合成图片尺寸 (宽x高，逗号分隔)")
+    parser.add_argument("--faces", default="1,8", help="合成图片的人脸数 (逗号分隔)")
+    parser.add_argument("--count", type=int, default=3, help="每种 尺寸 × 人脸数 生成的图片数")
+    parser.add_argument("--seed", type=int, default=0, help="合成图片的随机种子")
+    parser.add_argument("--repeat", type=int, default=5, help="整组图片的重复次数")
+    parser.add_argument("--warmup", type=int, default=1, help="不计入结果的预热轮数")
+    parser.add_argument("--detection", choices=["single", "tiled"], default=config.DETECTION_MODE, help="检测模式")
+    parser.add_argument("--backend", choices=["eager", "torchscript", "onnx"], default=config.INFERENCE_BACKEND, help="推理后端")
+    parser.add_argument("--precision", choices=["fp32", "int8", "bf16"], default=config.SCORE_PRECISION, help="打分精度")
+    parser.add_argument("--no-display", action="store_true", help="跳过 cv_image_to_qpixmap 阶段")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="对比两个 JSON 结果文件，不运行基准")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0], encoding="utf-8") as f:
+            before = json.load(f)
+        with open(args.compare[1], encoding="utf-8") as f:
+            after = json.load(f)
+        print(format_comparison(before, after))
+        return
+
+    report = run(args)
+    print(format_report(report))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# bench_weights_rss.py
+"""多进程部署的权重内存基准: 分别用 1 个和 8 个工作进程加载颜值打分模型，比较内存映射加载与复制加载
+每个进程新增的 RSS / PSS 以及加载耗时。
+
+RSS 会把共享的页重复计入每个进程，看不出共享的效果；PSS 把共享页按进程数平摊，
+N 个进程的 PSS 之和就是它们实际占用的物理内存。内存映射加载时权重页来自页缓存，
+PSS 之和应基本不随进程数增长；复制加载时每个进程各有一份私有副本。
+所有工作进程都加载完并跑过一次前向 (保证权重页已读入) 之后才同时采样，读取 /proc/self/smaps_rollup (仅 Linux)。
+
+用法:
+    python benchmarks/bench_weights_rss.py                        # 1 / 8 个进程，只加载颜值打分模型
+    python benchmarks/bench_weights_rss.py --workers 1,4,8 --full  # 加载完整的 FaceScorer (含 YOLO)
+    python benchmarks/bench_weights_rss.py --json rss.json
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MODES = {"copy": False, "mmap": True}
+
+
+def memory_kb():
+    """当前进程的 Rss / Pss / Shared_Clean / Private (KB)"""
+    fields = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return {"rss": fields.get("Rss", 0), "pss": fields.get("Pss", 0), "shared": fields.get("Shared_Clean", 0),
+            "private": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)}
+
+
+def _worker(mmap, full, barrier, results):
+    import torch
+    torch.set_num_threads(1)
+    with contextlib.redirect_stdout(sys.stderr):
+        import config
+        import scorer
+        config.BEAUTY_WEIGHTS_MMAP = mmap
+        before = memory_kb()
+        start = time.perf_counter()
+        if full:
+            face_scorer = scorer.FaceScorer(cache_path=None)
+            model = face_scorer.beauty_model
+        else:
+            model = scorer.load_beauty_model(device="cpu", mmap=mmap)
+        load_seconds = time.perf_counter() - start
+    height, width = config.SCORE_MODEL_INPUT_SIZE
+    start = time.perf_counter()
+    with torch.no_grad():
+        model(torch.zeros((1, 3, height, width)))
+    forward_seconds = time.perf_counter() - start
+    barrier.wait() # 所有进程都加载完再采样，PSS 才能反映共享
+    after = memory_kb()
+    results.put({"load_ms": load_seconds * 1000, "first_forward_ms": forward_seconds * 1000,
+                 **{f"{key}_kb": after[key] - before[key] for key in after}})
+    barrier.wait() # 采样完才退出，否则先退出的进程会让其他进程的 PSS 变大
+
+
+def measure(mode, workers, full):
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [context.Process(target=_worker, args=(MODES[mode], full, barrier, results)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    rows = [results.get(timeout=600) for _ in processes]
+    for process in processes:
+        process.join()
+
+    def mean(key):
+        return sum(row[key] for row in rows) / len(rows)
+
+    return {"mode": mode, "workers": workers, "load_ms": round(mean("load_ms"), 1),
+            "first_forward_ms": round(mean("first_forward_ms"), 1),
+            "rss_mb_per_worker": round(mean("rss_kb") / 1024, 1), "pss_mb_per_worker": round(mean("pss_kb") / 1024, 1),
+            "private_mb_per_worker": round(mean("private_kb") / 1024, 1),
+            "pss_mb_total": round(sum(row["pss_kb"] for row in rows) / 1024, 1)}
+
+
+def format_report(rows):
+    lines = [f"{'加载方式':<8} {'进程数':>6} {'加载ms':>8} {'首次前向ms':>10} {'RSS/进程':>9} {'PSS/进程':>9} "
+             f"{'私有/进程':>9} {'PSS合计':>9}  (MB，加载模型后的增量)"]
+    for row in rows:
+        lines.append(f"{row['mode']:<8} {row['workers']:>6} {row['load_ms']:>8} {row['first_forward_ms']:>10} "
+                     f"{row['rss_mb_per_worker']:>9} {row['pss_mb_per_worker']:>9} {row['private_mb_per_worker']:>9} "
+                     f"{row['pss_mb_total']:>9}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多进程权重内存基准 (内存映射加载 vs 复制加载)")
+    parser.add_argument("--workers", default="1,8", help="依次测试的进程数 (逗号分隔)")
+    parser.add_argument("--modes", default="copy,mmap", help="加载方式: copy / mmap (逗号分隔)")
+    parser.add_argument("--full", action="store_true", help="加载完整的 FaceScorer (含 YOLO)，而不只是颜值打分模型")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    args = parser.parse_args()
+    if not os.path.exists("/proc/self/smaps_rollup"):
+        raise SystemExit("错误: 需要 Linux 的 /proc/self/smaps_rollup。")
+
+    rows = []
+    for mode in args.modes.split(","):
+        for workers in [int(n) for n in args.workers.split(",")]:
+            rows.append(measure(mode, workers, args.full))
+    print(format_report(rows))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
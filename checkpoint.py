@@ -0,0 +1,111 @@
+# checkpoint.py
+"""批量打分的断点续跑检查点 (SQLite)。
+
+记录已写入结果文件的输入图片 (路径 + 文件大小 + 修改时间)，以及结果文件中已提交的长度。
+结果按块提交: 一块结果写进输出文件 (和 Parquet 分片) 并刷到磁盘之后，才在同一个事务里登记这些图片和新的提交位置。
+进程在任意时刻中断后重新运行:
+- 输出文件截断到最后一次提交的位置，未提交的 Parquet 分片删除 (半块结果丢弃，重新打分)；
+- 已登记且文件未变化的图片直接跳过，变化过的图片重新打分；
+- 登记状态为 error 的图片 (读取失败、模型出错等，可能只是暂时性的) 不算已处理，每次重新运行都再试一次，
+  新结果追加在输出文件中原来那条错误结果之后。
+登记表在磁盘上，内存占用与已处理的图片数无关。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CHECKPOINT_SUFFIX = ".ckpt"
+RETRY_STATUSES = ("error",) # 登记了这些状态的图片在续跑时重新处理
+
+
+def checkpoint_path(output_path):
+    """结果文件对应的检查点数据库路径"""
+    return output_path + CHECKPOINT_SUFFIX
+
+
+def file_stamp(path):
+    """(文件大小, 修改时间 ns)，文件不存在时为 (-1, -1)"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return -1, -1
+    return stat.st_size, stat.st_mtime_ns
+
+
+class Checkpoint:
+    """已处理图片的登记表 + 输出状态 (提交位置、下一个 Parquet 分片编号等)。
+
+    线程安全: 流水线和进程池在各自的线程里读取输入路径 (pending)，结果在主线程提交 (commit)。
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.skipped = 0
+        self._lock = threading.Lock()
+        # 检查点必须在输出文件刷盘之后才落盘，否则断电后会登记不存在的结果
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=FULL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS done ("
+                " path TEXT PRIMARY KEY,"
+                " size INTEGER NOT NULL,"
+                " mtime_ns INTEGER NOT NULL,"
+                " content_hash TEXT,"
+                " status TEXT NOT NULL,"
+                " committed_at REAL NOT NULL)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def get_state(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row is not None else default
+
+    def is_done(self, image_path):
+        """图片已登记、状态不是 error 且大小和修改时间都没变时返回 True"""
+        with self._lock:
+            row = self._conn.execute("SELECT size, mtime_ns, status FROM done WHERE path = ?", (image_path,)).fetchone()
+        return row is not None and row[2] not in RETRY_STATUSES and tuple(row[:2]) == file_stamp(image_path)
+
+    def entry(self, image_path):
+        """登记的 (文件大小, 修改时间 ns, 内容哈希, 状态)，未登记时返回 None"""
+        with self._lock:
+            row = self._conn.execute("SELECT size, mtime_ns, content_hash, status FROM done WHERE path = ?",
+                                     (image_path,)).fetchone()
+        return tuple(row) if row is not None else None
+
+    def pending(self, image_paths):
+        """跳过已处理的图片，逐个产出其余路径"""
+        for image_path in image_paths:
+            if self.is_done(image_path):
+                self.skipped += 1
+                continue
+            yield image_path
+
+    def commit(self, entries, **state):
+        """在一个事务里登记一块结果 [(路径, 内容哈希, 状态), ...] 并更新输出状态"""
+        now = time.time()
+        rows = [(image_path, *file_stamp(image_path), digest, status, now) for image_path, digest, status in entries]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO done (path, size, mtime_ns, content_hash, status, committed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._conn.executemany("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)",
+                                   [(key, json.dumps(value)) for key, value in state.items()])
+
+    def reset(self):
+        """清空登记表和输出状态 (输出文件被删除或重写时)"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM done")
+            self._conn.execute("DELETE FROM state")
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM done").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,43 +1,181 @@
 # config.py
 import torch
 import os
-from huggingface_hub import hf_hub_download
 
 # --- 模型和文件路径 ---
 YOLO_REPO_ID = "arnabdhar/YOLOv8-Face-Detection"
 YOLO_FILENAME = "model.pt"
-# 尝试从 Hugging Face Hub 下载/查找 YOLO 模型路径
-try:
-    print(f"正在查找/下载 {YOLO_FILENAME} 从 {YOLO_REPO_ID}...")
-    # 使用 cache_dir 参数可以指定缓存位置，默认为 ~/.cache/huggingface/hub
-    YOLO_MODEL_PATH = hf_hub_download(repo_id=YOLO_REPO_ID, filename=YOLO_FILENAME)
-    print(f"YOLO 模型路径: {YOLO_MODEL_PATH}")
-    if not os.path.exists(YOLO_MODEL_PATH):
-         print(f"警告: hf_hub_download 完成但文件 {YOLO_MODEL_PATH} 不存在?")
-         # 提供一个备用/默认本地路径 (如果下载失败或不可靠)
-         YOLO_MODEL_PATH = "model.pt" # 需要手动放置在此路径
-         print(f"将尝试使用本地路径: {YOLO_MODEL_PATH}")
+# YOLO 模型路径；保持为 None 时由 resolve_yolo_model_path() 在首次加载模型时解析
+YOLO_MODEL_PATH = None
+# 本地备用路径 (缓存和下载都不可用时，需要手动放置在此路径)
+YOLO_FALLBACK_PATH = "model.pt"
+
+
+def resolve_yolo_model_path():
+    """解析 YOLO 模型路径，优先离线:
 
-except Exception as e:
-    print(f"无法从 HuggingFace Hub 下载或查找 YOLO 模型: {e}")
-    # 提供一个备用/默认本地路径
-    YOLO_MODEL_PATH = "model.pt" # 需要手动放置在此路径
-    print(f"将尝试使用本地路径: {YOLO_MODEL_PATH}")
+    1. 已配置的 YOLO_MODEL_PATH
+    2. Hugging Face 本地缓存 (不访问网络)
+    3. 项目目录下的 YOLO_FALLBACK_PATH
+    4. 最后才从 Hugging Face Hub 下载 (设置 HF_HUB_OFFLINE=1 可禁止)
+    """
+    global YOLO_MODEL_PATH
+    if YOLO_MODEL_PATH:
+        return YOLO_MODEL_PATH
+    from metrics import event # metrics 导入时读取本模块的设置，只能在函数内导入
+
+    try:
+        from huggingface_hub import try_to_load_from_cache, hf_hub_download
+    except ImportError as e:
+        event("yolo_path_fallback", f"huggingface_hub 不可用 ({e})，将尝试使用本地路径: {YOLO_FALLBACK_PATH}",
+              level="warning", reason="no_hub", path=YOLO_FALLBACK_PATH)
+        YOLO_MODEL_PATH = YOLO_FALLBACK_PATH
+        return YOLO_MODEL_PATH
+
+    # 使用 cache_dir 参数可以指定缓存位置，默认为 ~/.cache/huggingface/hub
+    cached_path = try_to_load_from_cache(repo_id=YOLO_REPO_ID, filename=YOLO_FILENAME)
+    if isinstance(cached_path, str) and os.path.exists(cached_path):
+        YOLO_MODEL_PATH = cached_path
+    elif os.path.exists(YOLO_FALLBACK_PATH):
+        YOLO_MODEL_PATH = YOLO_FALLBACK_PATH
+    elif os.environ.get("HF_HUB_OFFLINE", "0").lower() in ("1", "true", "yes"):
+        event("yolo_path_fallback", f"离线模式且本地没有 {YOLO_FILENAME}，将尝试使用本地路径: {YOLO_FALLBACK_PATH}",
+              level="warning", reason="offline", path=YOLO_FALLBACK_PATH)
+        YOLO_MODEL_PATH = YOLO_FALLBACK_PATH
+    else:
+        try:
+            event("yolo_download", f"本地缓存中没有 {YOLO_FILENAME}，正在从 {YOLO_REPO_ID} 下载...", repo=YOLO_REPO_ID)
+            YOLO_MODEL_PATH = hf_hub_download(repo_id=YOLO_REPO_ID, filename=YOLO_FILENAME)
+        except Exception as e:
+            YOLO_MODEL_PATH = YOLO_FALLBACK_PATH
+            event("yolo_path_fallback", f"无法从 HuggingFace Hub 下载 YOLO 模型: {e}\n将尝试使用本地路径: {YOLO_MODEL_PATH}",
+                  level="warning", reason="download_failed", path=YOLO_MODEL_PATH)
+    event("yolo_path", f"YOLO 模型路径: {YOLO_MODEL_PATH}", path=YOLO_MODEL_PATH)
+    return YOLO_MODEL_PATH
 
 
 # 颜值打分模型权重文件路径 (相对于项目根目录)
 BEAUTY_MODEL_PATH = 'beauty_cnn_model.pth'
+# 打分精度: "fp32" (默认) / "int8" (动态量化，仅 CPU) / "bf16" (需要设备原生支持)，见 precision.py
+SCORE_PRECISION = "fp32"
+# 在 CPU 上以内存映射方式加载 fp32 权重 (torch.load(mmap=True))，权重直接使用页缓存而不复制一份:
+# 同一台机器上的多个工作进程共享同一份物理内存，加载几乎不耗时。False 时按原方式读入私有内存
+BEAUTY_WEIGHTS_MMAP = True
+# int8 权重文件 (由 python -m precision convert 生成；不存在时在加载时现场量化)
+BEAUTY_MODEL_INT8_PATH = 'beauty_cnn_model.int8.pth'
+
+# --- 打分模型选择 (score_models.py) ---
+# "cnn": CNNRegressionModel (默认，权重 BEAUTY_MODEL_PATH)；"resnet": ResNet-18 BeautyModel (权重 BEAUTY_RESNET_MODEL_PATH)
+SCORE_MODEL = "cnn"
+BEAUTY_RESNET_MODEL_PATH = 'beauty_resnet_model.pth'
+# 每张人脸的打分延迟预算 (毫秒)。设置后启动时在本机实测权重文件存在的各个打分模型，
+# 使用预算内质量最高的一个 (忽略 SCORE_MODEL)；None 时固定使用 SCORE_MODEL
+SCORE_MODEL_LATENCY_BUDGET_MS = None
+SCORE_MODEL_BENCH_BATCH = 8 # 实测延迟时的批大小
+SCORE_MODEL_BENCH_REPEAT = 5 # 实测次数 (取中位数)
+
+# --- 推理后端 ---
+# "eager": PyTorch 原生执行 (默认)；"torchscript" / "onnx": 使用 python -m backends export 生成的导出文件
+# (ONNX 通过 ONNX Runtime CPU 执行器运行)。导出文件缺失或与源权重不对应时自动退回 eager。
+# 导出文件均为 fp32，SCORE_PRECISION 不是 fp32 时颜值打分模型仍使用 eager。
+INFERENCE_BACKEND = "eager"
+BEAUTY_MODEL_TORCHSCRIPT_PATH = 'beauty_cnn_model.torchscript.pt'
+BEAUTY_MODEL_ONNX_PATH = 'beauty_cnn_model.onnx'
 
 # --- 设备配置 ---
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-print(f"使用的设备: {DEVICE}")
 
 # --- 图像处理参数 ---
 # 颜值打分模型期望的输入尺寸
 SCORE_MODEL_INPUT_SIZE = (128, 128) # (Height, Width)
+# YOLO 检测输入尺寸 (预热时也用这个尺寸做空跑)
+YOLO_IMAGE_SIZE = 640
+# 人脸筛选: 置信度低于阈值、边长小于最小尺寸的人脸在打分前丢弃
+DETECTION_CONF_THRESHOLD = 0.25 # 与 ultralytics 默认值一致
+MIN_FACE_SIZE = 20 # 像素，人脸框宽和高都不能小于该值
+MAX_FACES = 32 # 每张图片最多打分的人脸数 (按置信度从高到低)
+# 打分模型每次前向计算的最大人脸数 (人脸很多时分批，限制批次张量的内存)
+SCORE_BATCH_SIZE = 64
+
+# --- CPU 推理调优 (python -m autotune run 按本机实测生成调优配置，界面加载模型时自动应用并覆盖这些值) ---
+TORCH_THREADS = None # torch 算子内线程数 (None: torch 默认)
+TORCH_INTEROP_THREADS = None # torch 算子间线程数 (None: torch 默认)；只能在第一次并行计算之前设置
+CHANNELS_LAST = False # 模型卷积权重和打分输入使用 channels_last 内存布局
+INFERENCE_MODE = False # 打分时用 torch.inference_mode 代替 torch.no_grad
+# 本机调优配置文件；None 时为 ~/.cache/facial-beauty-scoring/autotune-<主机名>.json
+AUTOTUNE_PROFILE_PATH = None
+AUTOTUNE_APPLY = True # FaceScorer 加载模型时应用本机调优配置 (文件存在且与本机 CPU / torch 版本一致时)
+AUTOTUNE_LATENCY_CAP_MS = None # 调优时每张图片延迟 (检测 + 一批打分) 的上限；None 时只看吞吐
+
+# --- 分块检测 (人脸很多的大合影) ---
+# "single": 整图缩小到 YOLO_IMAGE_SIZE 后检测一次 (默认)
+# "tiled":  按原始分辨率切成互相重叠的小块，分批送入 YOLO，再跨块做 NMS 合并；小人脸不会因整图缩小而漏检
+DETECTION_MODE = "single"
+TILE_SIZE = 640 # 每块边长 (像素)，同时作为 YOLO 的输入尺寸
+TILE_OVERLAP = 0.2 # 相邻块的重叠比例，应大于最大人脸边长 / TILE_SIZE
+TILE_BATCH = 8 # 每次 YOLO 调用的块数
+TILE_NMS_THRESHOLD = 0.6 # 跨块合并: 两个框的交集占较小框面积的比例超过该值视为同一张人脸
+TILE_MAX_FACES = 512 # 分块模式下每张图片最多打分的人脸数
+TILE_MEMORY_LIMIT_MB = 1024 # 分块模式的内存上限: 解码后的图像 + 一批块的预处理缓冲区；超出时 JPEG 按 1/2、1/4、1/8 降采样解码
+# 支持的图片格式 (界面拖放和批量打分共用)
+SUPPORTED_FORMATS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+# --- 视频打分 (python -m video) ---
+VIDEO_DETECT_EVERY = 10 # 每隔多少帧运行一次 YOLO，其余帧用光流跟踪人脸框
+VIDEO_SCENE_THRESHOLD = 0.4 # 相邻帧灰度直方图的 Bhattacharyya 距离超过该值视为切换镜头，立即重新检测
+VIDEO_TRACK_IOU = 0.3 # 检测框与跟踪框的 IoU 超过该值视为同一张人脸
+VIDEO_MAX_MISSES = 1 # 跟踪的人脸连续多少次检测未匹配后结束
+VIDEO_RESCORE_THRESHOLD = 0.06 # 人脸外观 (16x16 灰度缩略图的平均差异，0~1) 变化超过该值时重新打分
+VIDEO_FLOW_WIDTH = 640 # 光流和镜头切换检测使用的缩小宽度
+
+# --- 结果缓存 ---
+# 按图片内容哈希 + 模型指纹缓存检测框和分数，重复提交的图片无需再跑模型
+RESULT_CACHE_ENABLED = True
+RESULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "face_rater", "results.sqlite")
+RESULT_CACHE_MAX_ENTRIES = 100000 # 超出后按最近访问时间淘汰
+
+# --- 断点续跑与 Parquet 输出 (python -m batch_score --resume / --parquet，见 sinks.py) ---
+RESUME_CHUNK_SIZE = 1000 # 每多少条结果提交一次检查点；Parquet 每块写一个分片 (一个行组)
+
+# --- 目录监视 (python -m watch) ---
+WATCH_DEBOUNCE = 1.0 # 文件大小和修改时间保持不变多少秒后才处理 (避免读到写了一半的文件)
+WATCH_POLL_INTERVAL = 2.0 # inotify 不可用时扫描目录的间隔 (秒)
+WATCH_MAX_BATCH = 256 # 同时就绪的图片每次最多交给流水线的张数
+
+# --- 近似重复跳过 (python -m batch_score --dedup，见 dedup.py) ---
+# 连拍、缩放副本、重新压缩的图片按感知哈希 (dHash) 识别，沿用第一张的结果而不再跑模型
+DEDUP_HASH_SIZE = 8 # 指纹为 DEDUP_HASH_SIZE² 位
+DEDUP_MAX_DISTANCE = 6 # 汉明距离不超过该值视为近似重复 (0 表示只跳过指纹完全相同的图片)
+
+# --- 运行指标与诊断 (见 metrics.py) ---
+# 记录各阶段耗时、人脸数、缓存命中和实际使用的后端 (环境变量 FACE_METRICS=0 关闭，诊断信息照常输出)
+METRICS_ENABLED = os.environ.get("FACE_METRICS", "1").lower() not in ("0", "false", "no")
+METRICS_WINDOW = 1024 # 每个直方图保留的最近样本数，分位数按这些样本计算
+METRICS_EVENT_HISTORY = 256 # 内存中保留的最近事件数
+# 退出时把指标写入该文件 (.prom / .txt 为 Prometheus 文本格式，其他为 JSON)，None 时不写
+METRICS_DUMP_PATH = os.environ.get("FACE_METRICS_DUMP") or None
+# 控制台输出格式: "text" (中文文本，默认) 或 "json" (每行一个结构化事件)
+LOG_FORMAT = os.environ.get("FACE_LOG_FORMAT", "text").lower()
+# 性能分析: None / "cprofile" / "torch"，结果写入 PROFILE_DIR；torch.profiler 最多保存 PROFILE_LIMIT 个 trace
+PROFILE_MODE = os.environ.get("FACE_PROFILE", "").lower() or None
+PROFILE_DIR = os.environ.get("FACE_PROFILE_DIR", "profiles")
+PROFILE_LIMIT = 20
+
+# --- 本地 HTTP 打分服务 (python -m serve) ---
+SERVE_HOST = "127.0.0.1" # 只监听本机
+SERVE_PORT = 8765
+SERVE_MAX_BATCH = 8 # 每次合并送入模型的最大图片数
+SERVE_MAX_WAIT_MS = 10 # 第一张图片到达后最多等待多久凑批
+SERVE_MAX_QUEUE = 32 # 已接收未完成的图片数上限 (含解码中)，超出时返回 503，同时限制了原图占用的内存
+SERVE_MAX_UPLOAD_MB = 50 # 单个请求体的大小上限
+SERVE_REQUEST_TIMEOUT = 30 # 等待结果的超时 (秒)，超时返回 504
 
 # --- UI 配置 (可选) ---
 WINDOW_WIDTH = 600
 WINDOW_HEIGHT = 650
 IMAGE_MIN_WIDTH = 550
-IMAGE_MIN_HEIGHT = 450
\ No newline at end of file
+IMAGE_MIN_HEIGHT = 450
+# 结果画廊: 缩略图边长 (像素)、内存中最多保留的缩略图数、画廊最小宽度
+THUMBNAIL_SIZE = 96
+THUMBNAIL_CACHE_SIZE = 300
+GALLERY_MIN_WIDTH = 260
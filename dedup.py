@@ -0,0 +1,188 @@
+# dedup.py
+"""批量打分中的近似重复图片跳过: 感知哈希 (dHash) + BK 树。
+
+连拍、缩放副本、重新压缩的图片字节不同，结果缓存的内容哈希认不出来，每张都会完整跑一遍 YOLO 和打分模型。
+这里为每张图片在很小的灰度缩略图上计算 dHash (相邻像素亮度比较得到的 64 位指纹)，
+存入按汉明距离组织的 BK 树，查找半径 r 以内的指纹只需访问树的一小部分。
+与已处理图片的距离不超过 max_distance 的图片不再打分，直接沿用该代表图片的结果
+(人脸框按两张图片的尺寸换算)，结果中用 dedup_of / dedup_distance 标明。
+
+用法:
+    deduplicator = Deduplicator(max_distance=6)
+    results = deduplicator.expand(face_scorer.score_paths(deduplicator.filter(image_paths)))
+"""
+import os
+import threading
+from collections import deque
+
+import cv2
+import numpy as np
+
+import config
+import metrics
+from image_io import read_image_bytes, is_jpeg, oriented_size
+from scorer import FaceScorer
+
+# 灰度降采样解码: 算指纹只需要几十像素宽的缩略图，JPEG 直接在解码器内缩小
+_REDUCED_GRAY_FLAGS = [(8, cv2.IMREAD_REDUCED_GRAYSCALE_8), (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+                       (2, cv2.IMREAD_REDUCED_GRAYSCALE_2)]
+
+
+def dhash(gray, hash_size=8):
+    """灰度图的差值哈希: 缩小到 (hash_size+1) x hash_size，每行相邻像素比较得到 hash_size² 位的整数"""
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits.flatten()).tobytes(), "big")
+
+
+def dhash_bytes(data, hash_size=8):
+    """由图片字节计算 dHash，返回 (指纹, 图片尺寸 (宽, 高))，解码失败时返回 (None, None)"""
+    size = oriented_size(data) if is_jpeg(data) else None
+    flags = cv2.IMREAD_GRAYSCALE
+    if size is not None:
+        for factor, reduced_flag in _REDUCED_GRAY_FLAGS:
+            if min(size) / factor >= 4 * hash_size:
+                flags = reduced_flag
+                break
+    gray = cv2.imdecode(data, flags)
+    if gray is None:
+        return None, None
+    if size is None:
+        size = (gray.shape[1], gray.shape[0])
+    return dhash(gray, hash_size), size
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """按汉明距离组织的 BK 树: 每个子节点按与父节点的距离挂在父节点下，
+    查找半径 r 时由三角不等式只需进入距离在 [d - r, d + r] 之间的子树"""
+
+    def __init__(self):
+        self.root = None # [指纹, 值, {距离: 子节点}]
+        self.size = 0
+
+    def add(self, key, value):
+        self.size += 1
+        if self.root is None:
+            self.root = [key, value, {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(key, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [key, value, {}]
+                return
+            node = child
+
+    def search(self, key, radius):
+        """返回距离不超过 radius 的 [(距离, 值), ...]，按距离从小到大排列"""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(key, node[0])
+            if distance <= radius:
+                found.append((distance, node[1]))
+            for child_distance, child in node[2].items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        found.sort(key=lambda item: item[0])
+        return found
+
+    def __len__(self):
+        return self.size
+
+
+class Deduplicator:
+    """批量打分的近似重复过滤 (线程安全，可用于顺序、流水线和进程池三种方式)。
+
+    filter(image_paths) 只产出需要打分的代表图片，近似重复的图片记在其代表图片名下；
+    expand(results) 原样产出打分结果，并在代表图片的结果之后补上它的重复图片的结果。
+    """
+
+    def __init__(self, max_distance=None, hash_size=None):
+        self.max_distance = config.DEDUP_MAX_DISTANCE if max_distance is None else max_distance
+        self.hash_size = hash_size or config.DEDUP_HASH_SIZE
+        self.index = BKTree()
+        self.sizes = {}     # 代表图片路径 -> 尺寸 (宽, 高)
+        self.finished = {}  # 已产出结果的代表图片路径 -> 生成重复图片结果所需的字段 (见 summarize)
+        self.waiting = {}   # 结果尚未产出的代表图片路径 -> [(重复图片路径, 距离, 尺寸), ...]
+        self.ready = deque() # 代表图片结果已知、等待产出的重复图片结果
+        self.duplicates = 0
+        self.unhashed = 0
+        self._lock = threading.Lock()
+
+    def filter(self, image_paths):
+        for image_path in image_paths:
+            data = read_image_bytes(image_path)
+            image_hash, size = dhash_bytes(data, self.hash_size) if data is not None else (None, None)
+            if image_hash is None: # 读不出来的图片交给打分流程报告错误
+                self.unhashed += 1
+                yield image_path
+                continue
+            with self._lock:
+                matches = self.index.search(image_hash, self.max_distance)
+                if matches:
+                    distance, representative = matches[0]
+                    duplicate = (image_path, distance, size)
+                    if representative in self.finished:
+                        self.ready.append(self.duplicate_result(self.finished[representative], duplicate))
+                    else:
+                        self.waiting.setdefault(representative, []).append(duplicate)
+                    self.duplicates += 1
+                    metrics.increment("dedup_images_total", result="duplicate")
+                    continue
+                self.index.add(image_hash, image_path)
+                self.sizes[image_path] = size
+            metrics.increment("dedup_images_total", result="unique")
+            yield image_path
+
+    def expand(self, results):
+        for result in results:
+            yield result
+            with self._lock:
+                image_path = result["path"]
+                if image_path in self.sizes:
+                    # 之后还可能有它的重复图片，整个运行期间都要保留，只存精简的元组而不是完整结果
+                    summary = self.finished[image_path] = self.summarize(result)
+                    for duplicate in self.waiting.pop(image_path, []):
+                        self.ready.append(self.duplicate_result(summary, duplicate))
+                pending = list(self.ready)
+                self.ready.clear()
+            yield from pending
+        with self._lock:
+            pending = list(self.ready)
+            self.ready.clear()
+        yield from pending
+
+    @staticmethod
+    def summarize(result):
+        """代表图片的结果精简为 (路径, 状态, 分数, ((框, 置信度, 分数), ...), 是否缓存命中, 指纹, 信息)，
+        状态为 ok 时信息由重复图片的路径重新生成，不保存"""
+        faces = tuple((face["box"], face.get("confidence"), face["score"]) for face in result["faces"])
+        message = None if result["status"] == "ok" else result["message"]
+        return (result["path"], result["status"], result["score"], faces, result["cached"],
+                result.get("fingerprint"), message)
+
+    def duplicate_result(self, representative, duplicate):
+        """由代表图片的精简结果 (summarize) 生成重复图片的结果，人脸框按两张图片的尺寸换算"""
+        image_path, distance, size = duplicate
+        representative_path, status, score, faces, cached, fingerprint, message = representative
+        boxes = FaceScorer.scale_boxes([face[0] for face in faces], self.sizes[representative_path], size)
+        faces = [{"box": box, "confidence": confidence, "score": face_score}
+                 for box, (_, confidence, face_score) in zip(boxes, faces)]
+        if status == "ok":
+            message = FaceScorer._done_message(image_path, len(faces))
+        message += f" (近似重复: 沿用 {os.path.basename(representative_path)} 的结果)"
+        result = FaceScorer.make_result(image_path, status, message, score=score, faces=faces, cached=cached)
+        result["fingerprint"] = fingerprint
+        result["dedup_of"] = representative_path
+        result["dedup_distance"] = distance
+        return result
+
+    def stats(self):
+        return {"representatives": len(self.index), "duplicates": self.duplicates, "unhashed": self.unhashed}
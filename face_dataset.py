@@ -0,0 +1,214 @@
+# face_dataset.py
+"""人脸裁剪数据集: 检测只运行一次，把每张标注图片中的人脸裁剪并缩放到打分模型的输入尺寸，
+写进一个内存映射的 uint8 数组。训练和评估 (train.py) 直接从中读取，每个 epoch 不再解码 JPEG、不再运行 YOLO。
+
+裁剪方式与打分时完全相同: 取置信度最高的人脸框 (select_faces 的第一个)，按框裁剪后用 resize_crops 缩放，
+读出时用 batch_to_tensor 转换，所以训练出的权重可以直接用于 FaceScorer。
+
+数据集目录:
+    crops.u8     [N, H, W, 3] BGR uint8，行主序连续存放 (np.memmap)
+    scores.npy   [N] float32 标注分数
+    index.jsonl  每行 {"path", "box", "confidence"}，与 crops 的行一一对应
+    meta.json    {"count", "height", "width", "labels", "skipped", ...}
+
+标注文件: 每行 "图片路径 分数" (空格或逗号分隔，例如 SCUT-FBP5500 的 train.txt / test.txt)，
+或表头为 path,score 的 CSV；相对路径相对于 --images-root (默认为标注文件所在目录)。
+
+用法:
+    python -m face_dataset build train.txt --images-root Images/ -o datasets/train
+    python -m face_dataset build train.txt --images-root Images/ -o datasets/train224 --score-model resnet   # 224x224 裁剪
+    python -m face_dataset info datasets/train
+"""
+import argparse
+import contextlib
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+import config
+import metrics
+from image_io import read_image_bytes, decode_image_bytes, resize_crops
+from score_models import SCORE_MODELS
+
+CROPS_FILE = "crops.u8"
+SCORES_FILE = "scores.npy"
+INDEX_FILE = "index.jsonl"
+META_FILE = "meta.json"
+
+
+def read_labels(labels_path, images_root=None):
+    """读取标注文件，返回 [(图片路径, 分数), ...]"""
+    images_root = images_root or os.path.dirname(os.path.abspath(labels_path))
+    labelled = []
+    with open(labels_path, encoding="utf-8", newline="") as f:
+        lines = [line.strip() for line in f if line.strip()]
+    if lines and lines[0].lower().replace(" ", "").startswith("path,"):
+        rows = [(row["path"], row["score"]) for row in csv.DictReader(lines)]
+    else:
+        rows = [line.replace(",", " ").split()[:2] for line in lines]
+    for name, score in rows:
+        labelled.append((name if os.path.isabs(name) else os.path.join(images_root, name), float(score)))
+    return labelled
+
+
+# --- 1. 生成数据集 ---
+def build_dataset(face_scorer, labelled, output_dir, detect_batch=8, decode_threads=4, input_size=None):
+    """对 labelled 中的每张图片检测一次人脸，把裁剪结果按 input_size (默认 config.SCORE_MODEL_INPUT_SIZE，
+    即 cnn 打分模型的输入尺寸) 写入 output_dir，返回 meta 字典。读取失败或没有可用人脸的图片跳过 (计入 meta["skipped"])。"""
+    os.makedirs(output_dir, exist_ok=True)
+    height, width = input_size or config.SCORE_MODEL_INPUT_SIZE
+    row_bytes = height * width * 3
+    crops_path = os.path.join(output_dir, CROPS_FILE)
+    # 先按标注数分配，结束时截断到实际写入的行数
+    crops = np.memmap(crops_path, dtype=np.uint8, mode="w+", shape=(max(1, len(labelled)), height, width, 3))
+    scores = []
+    skipped = {"unreadable": 0, "no_face": 0}
+    start = time.perf_counter()
+
+    def load(item):
+        data = read_image_bytes(item[0])
+        proxy, cv_img, full_size = face_scorer.decode_for_detection(data) if data is not None else (None, None, None)
+        return data, proxy, cv_img, full_size
+
+    def crop(job):
+        row, data, cv_img, full_size, box = job
+        if cv_img is None: # JPEG 只解码了检测用的缩小图，有人脸时才解码原图
+            cv_img = decode_image_bytes(data)
+        resize_crops(face_scorer.crop_selected(cv_img, [(box, 1.0)], full_size), (height, width), out=crops[row:row + 1])
+
+    with ThreadPoolExecutor(decode_threads) as pool, \
+            open(os.path.join(output_dir, INDEX_FILE), "w", encoding="utf-8") as index_file:
+        for chunk_start in range(0, len(labelled), detect_batch):
+            chunk = labelled[chunk_start:chunk_start + detect_batch]
+            loaded = list(pool.map(load, chunk))
+            readable = [(item, decoded) for item, decoded in zip(chunk, loaded) if decoded[1] is not None]
+            skipped["unreadable"] += len(chunk) - len(readable)
+            if not readable:
+                continue
+            detections = face_scorer.detect_images([decoded[1] for _, decoded in readable])
+            jobs = []
+            for ((image_path, score), (data, proxy, cv_img, full_size)), image_detections in zip(readable, detections):
+                image_detections = face_scorer.remap_detections(image_detections, proxy, full_size)
+                selected = face_scorer.select_faces(image_detections, full_size)
+                if not selected:
+                    skipped["no_face"] += 1
+                    continue
+                box, confidence = selected[0]
+                row = len(scores)
+                scores.append(score)
+                jobs.append((row, data, cv_img, full_size, box))
+                index_file.write(json.dumps({"path": image_path, "box": box, "confidence": round(confidence, 4)},
+                                            ensure_ascii=False) + "\n")
+            list(pool.map(crop, jobs))
+            done = chunk_start + len(chunk)
+            if done % (detect_batch * 50) < detect_batch or done == len(labelled):
+                metrics.event("dataset_progress", f"已处理 {done}/{len(labelled)} 张，得到 {len(scores)} 张人脸",
+                              level="debug", done=done, total=len(labelled), faces=len(scores))
+
+    crops.flush()
+    del crops
+    os.truncate(crops_path, len(scores) * row_bytes)
+    np.save(os.path.join(output_dir, SCORES_FILE), np.asarray(scores, dtype=np.float32))
+    meta = {"count": len(scores), "height": height, "width": width, "channels": 3, "dtype": "uint8",
+            "color": "bgr", "labels": len(labelled), "skipped": skipped, "seconds": round(time.perf_counter() - start, 1),
+            "yolo_image_size": face_scorer.yolo_image_size, "conf_threshold": face_scorer.conf_threshold,
+            "min_face_size": face_scorer.min_face_size}
+    with open(os.path.join(output_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return meta
+
+
+# --- 2. 读取数据集 ---
+def load_meta(directory):
+    with open(os.path.join(directory, META_FILE), encoding="utf-8") as f:
+        return json.load(f)
+
+
+class FaceCropDataset(torch.utils.data.Dataset):
+    """从内存映射的裁剪数组中按行读取 (uint8 [H,W,3] 张量, 分数)。
+
+    内存映射在每个 DataLoader 工作进程里首次读取时才打开 (不随数据集对象序列化)，
+    各进程读取的页都来自同一份页缓存。indices 给出时只使用其中的行 (训练 / 验证划分)。
+    """
+
+    def __init__(self, directory, indices=None):
+        self.directory = directory
+        self.meta = load_meta(directory)
+        self.scores = np.load(os.path.join(directory, SCORES_FILE))
+        self.indices = np.arange(self.meta["count"]) if indices is None else np.asarray(indices)
+        self._crops = None
+
+    @property
+    def crops(self):
+        if self._crops is None:
+            shape = (self.meta["count"], self.meta["height"], self.meta["width"], self.meta["channels"])
+            self._crops = np.memmap(os.path.join(self.directory, CROPS_FILE), dtype=np.uint8, mode="r", shape=shape)
+        return self._crops
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_crops"] = None
+        return state
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, item):
+        row = self.indices[item]
+        return torch.from_numpy(np.array(self.crops[row])), torch.tensor(self.scores[row])
+
+
+def split_indices(count, val_fraction, seed=0):
+    """按固定随机种子把 0..count-1 划分为 (训练行, 验证行)"""
+    order = np.random.default_rng(seed).permutation(count)
+    val_count = int(round(count * val_fraction))
+    return np.sort(order[val_count:]), np.sort(order[:val_count])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m face_dataset", description="人脸裁剪数据集 (训练 / 评估打分模型用)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="检测标注图片中的人脸，把裁剪结果写入内存映射数组")
+    build.add_argument("labels", help="标注文件 (每行 '图片路径 分数'，或表头为 path,score 的 CSV)")
+    build.add_argument("-o", "--output", required=True, help="数据集输出目录")
+    build.add_argument("--images-root", help="标注中相对路径的根目录 (默认为标注文件所在目录)")
+    build.add_argument("--score-model", choices=sorted(SCORE_MODELS), default=config.SCORE_MODEL,
+                       help="按该打分模型的输入尺寸裁剪 (默认 %(default)s)")
+    build.add_argument("--detect-batch", type=int, default=8, help="每次 YOLO 调用的图片数 (默认 %(default)s)")
+    build.add_argument("--decode-threads", type=int, default=4, help="解码线程数 (默认 %(default)s)")
+    info = sub.add_parser("info", help="显示数据集的大小和分数分布")
+    info.add_argument("dataset", help="数据集目录")
+    args = parser.parse_args(argv)
+
+    if args.command == "info":
+        meta = load_meta(args.dataset)
+        scores = np.load(os.path.join(args.dataset, SCORES_FILE))
+        print(json.dumps(meta, ensure_ascii=False, indent=2))
+        if len(scores):
+            print(f"分数: 最小 {scores.min():.3f}，最大 {scores.max():.3f}，平均 {scores.mean():.3f}，标准差 {scores.std():.3f}")
+        return 0
+
+    labelled = read_labels(args.labels, args.images_root)
+    with contextlib.redirect_stdout(sys.stderr):
+        from scorer import FaceScorer
+        # 每张标注图片只取一张人脸，与打分时 result["score"] 对应的人脸一致
+        face_scorer = FaceScorer(cache_path=None, detection_mode="single", max_faces=1)
+    if not face_scorer.models_loaded["yolo"]:
+        print("错误: YOLO 模型加载失败，无法生成数据集。", file=sys.stderr)
+        return 1
+    meta = build_dataset(face_scorer, labelled, args.output, detect_batch=args.detect_batch,
+                         decode_threads=args.decode_threads, input_size=SCORE_MODELS[args.score_model].input_size)
+    print(f"完成: {meta['labels']} 张标注图片，写入 {meta['count']} 张人脸裁剪 "
+          f"(跳过: 无法读取 {meta['skipped']['unreadable']}，无人脸 {meta['skipped']['no_face']})，耗时 {meta['seconds']}s",
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,245 @@
+# gallery.py
+"""结果画廊: 虚拟化的缩略图列表。
+
+- GalleryModel 只保存每张图片的路径、分数和人脸框，不保存图像；
+- QListView 只会为可见的行请求 DecorationRole，此时才把缩略图请求交给后台的 ThumbnailLoader；
+- 缩略图以有界 LRU 缓存，滚动离开后被淘汰的缩略图在再次可见时重新生成；
+- 点击某一行时由 ThumbnailLoader 在后台生成带人脸框的预览图。
+因此即使列表中有成千上万张图片，内存中也只有少量缩略图和一张预览图。
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import cv2
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QSize, QThread, QSortFilterProxyModel, pyqtSignal
+from PyQt5.QtGui import QImage, QPixmap, QColor
+from PyQt5.QtWidgets import QListView, QAbstractItemView
+
+import config
+import metrics
+from image_io import decode_thumbnail
+from scorer import FaceScorer
+
+ScoreRole = Qt.UserRole + 1 # 排序用: 未打分的图片排在最后
+OrderRole = Qt.UserRole + 2 # 排序用: 加入顺序
+PathRole = Qt.UserRole + 3
+
+STATUS_LABELS = {"queued": "排队中", "processing": "处理中", "no_face": "未检测到人脸",
+                 "error": "错误", "cancelled": "已取消"}
+
+
+def bgr_to_qimage(image):
+    """把 BGR 图像转换为自带内存的 QImage (可在非 GUI 线程中调用)"""
+    rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    height, width = rgb.shape[:2]
+    return QImage(rgb.data, width, height, 3 * width, QImage.Format_RGB888).copy()
+
+
+class ThumbnailLoader(QThread):
+    """后台生成缩略图和预览图。
+
+    缩略图请求按后进先出处理 (最近滚动到的行优先)，积压超过上限时丢弃最旧的请求；
+    预览图请求只保留最新的一个。
+    """
+    # Signal arguments: image_path, thumbnail
+    thumbnail_ready = pyqtSignal(str, QImage)
+    # Signal arguments: image_path, preview image (already scaled to the requested size)
+    preview_ready = pyqtSignal(str, QImage)
+
+    def __init__(self, thumbnail_size=None, max_pending=256):
+        super().__init__()
+        self.thumbnail_size = thumbnail_size or config.THUMBNAIL_SIZE
+        self.max_pending = max_pending
+        self._condition = threading.Condition()
+        self._thumbnail_requests = OrderedDict() # image_path -> faces
+        self._preview_request = None
+        self._stopped = False
+
+    def request_thumbnail(self, image_path, faces):
+        with self._condition:
+            self._thumbnail_requests.pop(image_path, None)
+            self._thumbnail_requests[image_path] = faces
+            while len(self._thumbnail_requests) > self.max_pending:
+                self._thumbnail_requests.popitem(last=False)
+            self._condition.notify()
+
+    def request_preview(self, image_path, faces, size):
+        with self._condition:
+            self._preview_request = (image_path, faces, size)
+            self._condition.notify()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while not self._stopped and self._preview_request is None and not self._thumbnail_requests:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                if self._preview_request is not None:
+                    request, self._preview_request = self._preview_request, None
+                    kind = "preview"
+                else:
+                    request = self._thumbnail_requests.popitem(last=True)
+                    kind = "thumbnail"
+            try:
+                if kind == "preview":
+                    image_path, faces, (width, height) = request
+                    image = self._render(image_path, faces, max(width, height))
+                    if image is not None:
+                        # 长边按请求尺寸解码后，再按宽高比缩放到不超过标签大小
+                        shrink = min(1.0, width / image.shape[1], height / image.shape[0])
+                        if shrink < 1.0:
+                            image = cv2.resize(image, (max(1, int(image.shape[1] * shrink)), max(1, int(image.shape[0] * shrink))),
+                                               interpolation=cv2.INTER_AREA)
+                        self.preview_ready.emit(image_path, bgr_to_qimage(image))
+                else:
+                    image_path, faces = request
+                    image = self._render(image_path, faces, self.thumbnail_size)
+                    if image is not None:
+                        self.thumbnail_ready.emit(image_path, bgr_to_qimage(image))
+            except Exception as e:
+                metrics.event("thumbnail_failed", f"生成缩略图失败 {request[0]}: {e}", level="warning",
+                              path=request[0], error=str(e))
+
+    @staticmethod
+    def _render(image_path, faces, max_side):
+        """按目标尺寸降采样解码，并把人脸框按比例画上去"""
+        image, scale = decode_thumbnail(image_path, max_side)
+        if image is None:
+            return None
+        if faces:
+            scaled_faces = [{"box": [int(v * scale) for v in face["box"]], "score": face["score"]} for face in faces]
+            FaceScorer.draw_faces(image, scaled_faces)
+        return image
+
+
+class GalleryModel(QAbstractListModel):
+    """画廊数据模型: 每行一张图片，结果随推理线程的输出逐步填入"""
+
+    def __init__(self, loader, parent=None):
+        super().__init__(parent)
+        self.loader = loader
+        self.loader.thumbnail_ready.connect(self.onThumbnailReady)
+        self.entries = []  # [{"path", "status", "score", "faces", "message"}, ...]
+        self.rows = {}     # image_path -> row
+        self.thumbnails = OrderedDict() # image_path -> QPixmap (LRU)
+        self.placeholder = QPixmap(config.THUMBNAIL_SIZE, config.THUMBNAIL_SIZE)
+        self.placeholder.fill(QColor("#3b4048"))
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.entries)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        entry = self.entries[index.row()]
+        if role == Qt.DisplayRole:
+            if entry["score"] is not None:
+                label = "{:.2f}".format(entry["score"])
+                if len(entry["faces"]) > 1:
+                    label += " ({} 张人脸)".format(len(entry["faces"]))
+            else:
+                label = STATUS_LABELS.get(entry["status"], entry["status"])
+            return "{}\n{}".format(os.path.basename(entry["path"]), label)
+        if role == Qt.DecorationRole:
+            # 只有可见的行会走到这里: 命中缓存直接返回，否则交给后台生成
+            pixmap = self.thumbnails.get(entry["path"])
+            if pixmap is not None:
+                self.thumbnails.move_to_end(entry["path"])
+                return pixmap
+            self.loader.request_thumbnail(entry["path"], entry["faces"])
+            return self.placeholder
+        if role == Qt.ToolTipRole:
+            return entry["message"] or entry["path"]
+        if role == ScoreRole:
+            return entry["score"] if entry["score"] is not None else float("-inf")
+        if role == OrderRole:
+            return index.row()
+        if role == PathRole:
+            return entry["path"]
+        return None
+
+    def entry(self, image_path):
+        row = self.rows.get(image_path)
+        return self.entries[row] if row is not None else None
+
+    def addPaths(self, image_paths):
+        """加入新图片 (状态为排队中)；已存在的图片重置为排队中"""
+        new_paths = []
+        for path in image_paths:
+            if path in self.rows:
+                self.updateEntry(path, status="queued", score=None, faces=[], message="")
+            elif path not in new_paths:
+                new_paths.append(path)
+        if not new_paths:
+            return
+        first = len(self.entries)
+        self.beginInsertRows(QModelIndex(), first, first + len(new_paths) - 1)
+        for row, path in enumerate(new_paths, start=first):
+            self.entries.append({"path": path, "status": "queued", "score": None, "faces": [], "message": ""})
+            self.rows[path] = row
+        self.endInsertRows()
+
+    def updateEntry(self, image_path, **fields):
+        row = self.rows.get(image_path)
+        if row is None:
+            return
+        self.entries[row].update(fields)
+        if "faces" in fields:
+            self.thumbnails.pop(image_path, None) # 重新生成带人脸框的缩略图
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+    def updateResult(self, result):
+        self.updateEntry(result["path"], status=result["status"], score=result["score"],
+                         faces=result["faces"], message=result["message"])
+
+    def onThumbnailReady(self, image_path, image):
+        row = self.rows.get(image_path)
+        if row is None:
+            return
+        self.thumbnails[image_path] = QPixmap.fromImage(image)
+        self.thumbnails.move_to_end(image_path)
+        while len(self.thumbnails) > config.THUMBNAIL_CACHE_SIZE:
+            self.thumbnails.popitem(last=False)
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+
+class GalleryProxyModel(QSortFilterProxyModel):
+    """排序代理: 按加入顺序或按分数排序，结果到达时自动调整位置"""
+
+    SORT_MODES = [("加入顺序", OrderRole, Qt.AscendingOrder),
+                  ("分数从高到低", ScoreRole, Qt.DescendingOrder),
+                  ("分数从低到高", ScoreRole, Qt.AscendingOrder)]
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setDynamicSortFilter(True)
+        self.setSortMode(0)
+
+    def setSortMode(self, mode):
+        _, role, order = self.SORT_MODES[mode]
+        self.setSortRole(role)
+        self.sort(0, order)
+
+
+def create_gallery_view(parent=None):
+    """创建只为可见行取数据的列表视图"""
+    view = QListView(parent)
+    view.setObjectName("galleryView")
+    view.setViewMode(QListView.ListMode)
+    view.setIconSize(QSize(config.THUMBNAIL_SIZE, config.THUMBNAIL_SIZE))
+    view.setUniformItemSizes(True)        # 行高固定，滚动时无需逐行测量
+    view.setLayoutMode(QListView.Batched) # 分批布局，大量行时界面不卡顿
+    view.setBatchSize(200)
+    view.setSelectionMode(QAbstractItemView.SingleSelection)
+    view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+    view.setMinimumWidth(config.GALLERY_MIN_WIDTH)
+    return view
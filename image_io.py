@@ -0,0 +1,223 @@
+# image_io.py
+"""图片读取与人脸预处理: 每张图片只解码一次，后续检测、裁剪、打分和显示都基于同一块 numpy 缓冲区。"""
+import glob
+import io
+import os
+import sys
+import numpy as np
+import cv2
+import torch
+from PIL import Image
+
+import config
+
+
+def iter_image_paths(inputs, recursive=False):
+    """把目录 / 通配符 / 文件路径展开为图片路径，按输入顺序逐个产出 (去重)"""
+    seen = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            if recursive:
+                candidates = (os.path.join(root, name)
+                              for root, _, names in sorted(os.walk(item))
+                              for name in sorted(names))
+            else:
+                candidates = (os.path.join(item, name) for name in sorted(os.listdir(item)))
+        elif glob.has_magic(item):
+            candidates = sorted(glob.iglob(item, recursive=True))
+        else:
+            candidates = [item]
+
+        for path in candidates:
+            if not path.lower().endswith(config.SUPPORTED_FORMATS) or path in seen:
+                continue
+            if not os.path.isfile(path):
+                print(f"警告: 文件不存在，已跳过: {path}", file=sys.stderr)
+                continue
+            seen.add(path)
+            yield path
+
+
+def read_image_bytes(image_path):
+    """读取图片文件的原始字节 (uint8 数组)，失败或文件为空时返回 None。
+
+    用 np.fromfile 而不是 cv2.imread，避免了 cv2.imread 在 Windows 上无法读取中文路径的问题；
+    同一块字节既用于解码，也用于计算结果缓存的内容哈希。
+    """
+    try:
+        data = np.fromfile(image_path, dtype=np.uint8)
+    except OSError:
+        return None
+    return data if data.size > 0 else None
+
+
+def decode_image_bytes(data):
+    """把图片字节解码为 BGR uint8 数组 (H, W, 3)，失败时返回 None"""
+    if data is None:
+        return None
+    return cv2.imdecode(data, cv2.IMREAD_COLOR)
+
+
+def decode_image(image_path):
+    """读取并解码图片为 BGR uint8 数组 (H, W, 3)，失败时返回 None"""
+    return decode_image_bytes(read_image_bytes(image_path))
+
+
+def image_size(image_path):
+    """只读取文件头获取图片尺寸 (宽, 高)，不解码像素；失败时返回 None"""
+    try:
+        with Image.open(image_path) as img:
+            return img.size
+    except (OSError, ValueError):
+        return None
+
+
+def oriented_size(data):
+    """只解析文件头，返回按 EXIF 方向旋转后的图片尺寸 (宽, 高)，与 cv2.imdecode 的解码结果一致；失败时返回 None"""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            width, height = img.size
+            orientation = img.getexif().get(0x0112, 1)
+    except (OSError, ValueError):
+        return None
+    if orientation in (5, 6, 7, 8): # 旋转 90° / 270°
+        width, height = height, width
+    return width, height
+
+
+def is_jpeg(data):
+    return data is not None and data.size >= 2 and data[0] == 0xFF and data[1] == 0xD8
+
+
+# cv2.imdecode 的降采样解码标志: JPEG 直接在解码器内按 1/2、1/4、1/8 缩小 (DCT 域缩放，
+# 与 PIL 的 draft 模式相同)，速度快、内存小；解码结果同样按 EXIF 方向旋转
+_REDUCED_FLAGS = [(8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)]
+
+
+def reduced_decode_flag(size, min_side):
+    """选择长边仍不小于 min_side 的最大降采样倍率，返回 (倍率, imdecode 标志)"""
+    for factor, reduced_flag in _REDUCED_FLAGS:
+        if max(size) / factor >= min_side:
+            return factor, reduced_flag
+    return 1, cv2.IMREAD_COLOR
+
+
+def make_detection_proxy(image, max_side):
+    """把已解码的图像缩小到长边 max_side 作为检测输入 (区域平均)，本身不大时直接返回原图"""
+    height, width = image.shape[:2]
+    shrink = max_side / max(height, width)
+    if shrink >= 1.0:
+        return image
+    return cv2.resize(image, (max(1, round(width * shrink)), max(1, round(height * shrink))),
+                      interpolation=cv2.INTER_AREA)
+
+
+def decode_detection_proxy(data, max_side):
+    """为人脸检测解码一张长边约为 max_side 的代理图，返回 (代理图, 原图, 原图尺寸 (宽, 高))。
+
+    JPEG 用解码器的降采样模式直接解码出小图，此时原图为 None，只有检测到人脸后才需要解码原图；
+    其他格式或本身不大的图片整图解码，原图即解码结果，代理图由原图缩小得到。
+    解码失败时返回 (None, None, None)。
+    """
+    size = oriented_size(data) if is_jpeg(data) else None
+    if size is not None:
+        factor, reduced_flag = reduced_decode_flag(size, max_side)
+        if factor > 1:
+            proxy = cv2.imdecode(data, reduced_flag)
+            if proxy is not None:
+                return proxy, None, size
+    image = decode_image_bytes(data)
+    if image is None:
+        return None, None, None
+    height, width = image.shape[:2]
+    return make_detection_proxy(image, max_side), image, (width, height)
+
+
+def decode_within_budget(data, max_bytes):
+    """解码一张不超过 max_bytes 的 BGR 图像，返回 (图像, 原图尺寸 (宽, 高))，失败时返回 (None, None)。
+
+    JPEG 超出上限时选用能放进上限的最小降采样倍率 (1/2、1/4、1/8) 直接解码，峰值内存不超过上限；
+    其他格式无法在解码器内缩小，只能整图解码后再缩小，之后的处理仍在上限之内。
+    """
+    size = oriented_size(data) if is_jpeg(data) else None
+    if size is not None:
+        full_bytes = size[0] * size[1] * 3
+        flags = cv2.IMREAD_REDUCED_COLOR_8
+        for factor, reduced_flag in [(1, cv2.IMREAD_COLOR)] + _REDUCED_FLAGS[::-1]:
+            if full_bytes / (factor * factor) <= max_bytes:
+                flags = reduced_flag
+                break
+        image = cv2.imdecode(data, flags)
+        return (image, size) if image is not None else (None, None)
+
+    image = decode_image_bytes(data)
+    if image is None:
+        return None, None
+    height, width = image.shape[:2]
+    shrink = (max_bytes / image.nbytes) ** 0.5
+    if shrink < 1.0:
+        image = cv2.resize(image, (max(1, int(width * shrink)), max(1, int(height * shrink))),
+                           interpolation=cv2.INTER_AREA)
+    return image, (width, height)
+
+
+def decode_thumbnail(image_path, max_side):
+    """解码一张长边不超过 max_side 的缩略图 (BGR)，返回 (缩略图, 相对原图的缩放比例)，失败时返回 (None, 1.0)"""
+    data = read_image_bytes(image_path)
+    if data is None:
+        return None, 1.0
+    size = image_size(image_path)
+    flags = reduced_decode_flag(size, max_side)[1] if size is not None else cv2.IMREAD_COLOR
+    image = cv2.imdecode(data, flags)
+    if image is None:
+        return None, 1.0
+    height, width = image.shape[:2]
+    shrink = min(1.0, max_side / max(height, width))
+    if shrink < 1.0:
+        image = cv2.resize(image, (max(1, round(width * shrink)), max(1, round(height * shrink))),
+                           interpolation=cv2.INTER_AREA)
+    # 用长边计算比例: 文件头里的尺寸未考虑 EXIF 旋转，而解码结果已按 EXIF 方向旋转
+    original_side = max(size) if size is not None else max(height, width)
+    return image, max(image.shape[:2]) / original_side
+
+
+def crop_faces(image, boxes):
+    """按 [x_min, y_min, x_max, y_max] 从图像中切出人脸，返回的是原缓冲区的视图 (不复制)"""
+    return [image[y_min:y_max, x_min:x_max] for x_min, y_min, x_max, y_max in boxes]
+
+
+def score_transform(face_crops, input_size=None, mean=None, std=None):
+    """把 BGR 人脸裁剪图缩放到打分模型输入尺寸，并转换为 [N,3,H,W] 的 RGB float 张量 (0~1)。
+    给出 mean / std 时再按通道归一化 (各打分模型声明的输入归一化，见 score_models.py)。
+
+    缩放结果直接写入一块预分配的 uint8 批次缓冲区，torch.from_numpy 与其共享内存，
+    BGR→RGB 与 uint8→float 在写入最终张量时一次完成。
+    """
+    return batch_to_tensor(resize_crops(face_crops, input_size), mean, std)
+
+
+def resize_crops(face_crops, input_size=None, out=None):
+    """把人脸裁剪图缩放到打分模型输入尺寸，写入 [N,H,W,3] 的 uint8 批次 (out 给出时直接写入 out，例如数据集的内存映射数组)"""
+    height, width = input_size or config.SCORE_MODEL_INPUT_SIZE
+    batch = np.empty((len(face_crops), height, width, 3), dtype=np.uint8) if out is None else out
+    for i, crop in enumerate(face_crops):
+        # 缩小用区域平均 (相当于抗锯齿)，放大用双线性
+        shrinking = crop.shape[0] > height or crop.shape[1] > width
+        interpolation = cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR
+        cv2.resize(crop, (width, height), dst=batch[i], interpolation=interpolation)
+    return batch
+
+
+def batch_to_tensor(batch, mean=None, std=None):
+    """把 [N,H,W,3] 的 BGR uint8 批次 (numpy 数组或张量) 转换为 [N,3,H,W] 的 RGB float 张量 (0~1)，
+    给出 mean / std (RGB 顺序，0~1 像素值) 时再按通道归一化。
+    打分时由 score_transform 调用，训练时直接作用于人脸裁剪数据集 (face_dataset.py) 的批次，两者预处理完全一致。"""
+    pixels = torch.from_numpy(batch) if isinstance(batch, np.ndarray) else batch # 零拷贝
+    count, height, width = pixels.shape[:3]
+    tensor = torch.empty((count, 3, height, width), dtype=torch.float32)
+    for channel in range(3):
+        tensor[:, channel] = pixels[..., 2 - channel] # BGR → RGB
+    tensor.div_(255.0)
+    if mean is not None: # 必须与模型训练时的归一化一致
+        tensor.sub_(torch.tensor(mean).view(1, 3, 1, 1)).div_(torch.tensor(std).view(1, 3, 1, 1))
+    return tensor
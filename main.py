@@ -1,29 +1,24 @@
 # main.py
 import sys
+import time
+
+_import_start = time.perf_counter()
 from PyQt5.QtWidgets import QApplication
 
-# 导入主窗口类
+# 导入主窗口类 (导入时不加载模型，模型在窗口显示后由后台线程加载和预热)
 from ui_main_window import FaceScoringApp
-# 导入模型状态检查（虽然窗口内部也会检查，这里可以提前在控制台输出信息）
-from processing import get_model_load_status
+from scorer import STARTUP_TIMINGS
+import metrics
+metrics.set_console_stream(sys.stdout) # 图形界面的事件仍像原来的 print 一样输出到标准输出
+STARTUP_TIMINGS["import_app"] = time.perf_counter() - _import_start
 
 if __name__ == '__main__':
-    # 检查模型加载状态（在创建UI前）
-    model_status = get_model_load_status()
-    print("-" * 30)
-    print("模型加载状态汇总:")
-    print(f"  - YOLOv8 检测模型: {'加载成功' if model_status['yolo'] else '加载失败'}")
-    print(f"  - 颜值打分模型: {'加载成功' if model_status['beauty'] else '加载失败'}")
-    print("-" * 30)
-
-    if not model_status['yolo'] or not model_status['beauty']:
-        print("警告：一个或多个模型未能加载，应用程序功能将受限。请查看之前的错误日志。")
-        # 可以选择在这里提示用户并退出，或者让窗口自己处理
-        # reply = QMessageBox.warning(None, "启动问题", "模型加载失败，是否继续？", QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
-        # if reply == QMessageBox.No:
-        #     sys.exit(1)
-
+    window_start = time.perf_counter()
     app = QApplication(sys.argv)
     mainWindow = FaceScoringApp()
     mainWindow.show()
-    sys.exit(app.exec_())
\ No newline at end of file
+    STARTUP_TIMINGS["window"] = time.perf_counter() - window_start
+    shown_ms = (time.perf_counter() - _import_start) * 1000
+    metrics.event("window_shown", f"窗口已显示 (启动后 {shown_ms:.0f} ms)，模型正在后台加载...", elapsed_ms=round(shown_ms))
+    # 模型加载完成后窗口会在控制台输出完整的启动耗时报告，并提示加载失败的模型
+    sys.exit(app.exec_())
@@ -0,0 +1,415 @@
+# metrics.py
+"""运行指标与诊断输出: 结构化事件、滚动直方图、计数器和可选的性能分析。
+
+- event():   代替散落在各模块中的 print。事件保存在内存中的最近事件列表里，同时按原来的中文文本输出到标准错误
+             (FACE_LOG_FORMAT=json 时每行输出一个 JSON 对象)；
+- observe() / timed() / stage_clock():  记录耗时等数值，每个 (指标名, 标签) 一个直方图，只保留最近
+             METRICS_WINDOW 个样本计算 p50/p95/p99，另外累计总次数和总和；
+- increment() / set_info():  计数器 (图片数、缓存命中) 和信息指标 (实际使用的推理后端)；
+- snapshot() / to_json() / to_prometheus() / dump():  导出当前指标；
+- profiled(): FACE_PROFILE=cprofile 或 torch 时对区段做性能分析，结果写入 PROFILE_DIR。
+
+FACE_METRICS=0 时记录函数直接返回，timed() / stage_clock() 返回空对象，热路径上几乎没有开销。
+多进程批量打分时每个工作进程各自记录。
+"""
+import atexit
+import contextlib
+import collections
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+import config
+
+PREFIX = "face_scoring_" # Prometheus 指标名前缀
+QUANTILES = (0.5, 0.95, 0.99)
+LEVELS = {"debug": logging.DEBUG, "info": logging.INFO, "warning": logging.WARNING, "error": logging.ERROR}
+
+enabled = config.METRICS_ENABLED
+logger = logging.getLogger("face_scoring")
+
+_lock = threading.Lock()
+_histograms = {} # (name, labels) -> _Histogram
+_counters = {}   # (name, labels) -> float
+_info = {}       # (name, labels) -> 1
+_events = collections.deque(maxlen=config.METRICS_EVENT_HISTORY)
+_started = time.time()
+_console_stream = None # None 表示调用时的 sys.stderr
+
+
+def set_enabled(value):
+    global enabled
+    enabled = bool(value)
+
+
+def set_console_stream(stream):
+    """事件的控制台输出位置: 默认 (None) 为 sys.stderr，图形界面可设为 sys.stdout 保持原来 print 的行为"""
+    global _console_stream
+    _console_stream = stream
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v).lower() if isinstance(v, bool) else str(v)) for k, v in labels.items()))
+
+
+# --- 1. 控制台输出 ---
+class _ConsoleHandler(logging.Handler):
+    """写到调用时的 sys.stderr (或 set_console_stream 指定的流)，不会混入命令行工具写到标准输出的结果"""
+
+    def emit(self, record):
+        try:
+            print(self.format(record), file=_console_stream or sys.stderr, flush=True)
+        except Exception:
+            self.handleError(record)
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {"time": round(record.created, 3), "level": record.levelname.lower(),
+                   "event": getattr(record, "event", record.name), "message": record.getMessage()}
+        payload.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            payload["exception"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+if not logger.handlers:
+    _handler = _ConsoleHandler()
+    _handler.setFormatter(_JsonFormatter() if config.LOG_FORMAT == "json" else logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+def event(name, message=None, level="info", exc_info=False, **fields):
+    """记录一条结构化事件并输出到控制台。
+
+    name 为机器可读的事件名，message 为给人看的文本 (省略时输出 name)，fields 为附加字段；
+    exc_info=True 时附带当前异常的堆栈。
+    """
+    if enabled:
+        record = {"time": round(time.time(), 3), "event": name, "level": level}
+        if message:
+            record["message"] = message
+        record.update(fields)
+        with _lock:
+            _events.append(record)
+            key = _key("events_total", {"event": name, "level": level})
+            _counters[key] = _counters.get(key, 0) + 1
+    logger.log(LEVELS[level], message or name, exc_info=exc_info, extra={"event": name, "fields": fields})
+
+
+# --- 2. 直方图与计数器 ---
+class _Histogram:
+    __slots__ = ("samples", "count", "total")
+
+    def __init__(self):
+        self.samples = collections.deque(maxlen=config.METRICS_WINDOW)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def summary(self):
+        ordered = sorted(self.samples)
+        row = {"count": self.count, "sum": self.total, "window": len(ordered),
+               "mean": sum(ordered) / len(ordered) if ordered else 0.0}
+        for q in QUANTILES:
+            # 最近秩法: 样本少时也总是返回真实出现过的值
+            row[f"p{int(q * 100)}"] = ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+        return row
+
+
+def observe(name, value, **labels):
+    """记录一个样本 (耗时统一用秒)"""
+    if not enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = _Histogram()
+        histogram.add(value)
+
+
+def increment(name, amount=1, **labels):
+    if not enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def set_info(name, **labels):
+    """信息指标 (值恒为 1)，例如 model_backend{model="yolo", backend="onnx"}；同名同 model 的旧值被替换"""
+    with _lock:
+        for key in [key for key in _info if key[0] == name and dict(key[1]).get("model") == labels.get("model")]:
+            del _info[key]
+        _info[_key(name, labels)] = 1
+
+
+class _Timer:
+    __slots__ = ("name", "labels", "start", "elapsed")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.elapsed = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        observe(self.name, self.elapsed, **self.labels)
+        return False
+
+
+_NULL = contextlib.nullcontext()
+
+
+def timed(name, **labels):
+    """计时上下文: with metrics.timed("stage_seconds", stage="detect"): ..."""
+    return _Timer(name, labels) if enabled else _NULL
+
+
+class _StageClock:
+    """按阶段边界计时: mark(name) 结束上一个阶段并开始下一个，stop() 结束最后一个阶段"""
+    __slots__ = ("name", "current", "start")
+
+    def __init__(self, name):
+        self.name = name
+        self.current = None
+        self.start = 0.0
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        if self.current is not None:
+            observe(self.name, now - self.start, stage=self.current)
+        self.current, self.start = stage, now
+
+    def stop(self):
+        self.mark(None)
+
+
+class _NullClock:
+    __slots__ = ()
+
+    def mark(self, stage):
+        pass
+
+    def stop(self):
+        pass
+
+
+_NULL_CLOCK = _NullClock()
+
+
+def stage_clock(name="stage_seconds"):
+    return _StageClock(name) if enabled else _NULL_CLOCK
+
+
+def summary(name, **labels):
+    """单个直方图的统计 (count/sum/mean/p50/p95/p99)，没有样本时返回 None"""
+    with _lock:
+        histogram = _histograms.get(_key(name, labels))
+        return histogram.summary() if histogram is not None and histogram.count else None
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+        _events.clear()
+
+
+# --- 3. 导出 ---
+def snapshot():
+    """当前所有指标和最近事件，可直接序列化为 JSON"""
+    with _lock:
+        histograms = [dict(name=name, labels=dict(labels), **histogram.summary())
+                      for (name, labels), histogram in sorted(_histograms.items())]
+        counters = [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in sorted(_counters.items())]
+        info = [{"name": name, "labels": dict(labels)} for name, labels in sorted(_info)]
+        events = list(_events)
+    return {"uptime_seconds": round(time.time() - _started, 3), "enabled": enabled,
+            "histograms": histograms, "counters": counters, "info": info, "events": events}
+
+
+def to_json(indent=2):
+    return json.dumps(snapshot(), ensure_ascii=False, indent=indent, default=str)
+
+
+def _format_labels(labels, **extra):
+    items = list(labels.items()) + list(extra.items())
+    if not items:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in items)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(items, escaped)) + "}"
+
+
+def to_prometheus():
+    """Prometheus 文本格式: 直方图导出为 summary (分位数按滚动窗口计算，_sum / _count 为累计值)"""
+    data = snapshot()
+    lines = []
+    declared = set()
+
+    def declare(name, kind):
+        if name not in declared:
+            declared.add(name)
+            lines.append(f"# TYPE {name} {kind}")
+
+    for row in data["histograms"]:
+        name = PREFIX + row["name"]
+        declare(name, "summary")
+        for q in QUANTILES:
+            lines.append(f"{name}{_format_labels(row['labels'], quantile=q)} {row[f'p{int(q * 100)}']:.6g}")
+        lines.append(f"{name}_sum{_format_labels(row['labels'])} {row['sum']:.6g}")
+        lines.append(f"{name}_count{_format_labels(row['labels'])} {row['count']}")
+    for row in data["counters"]:
+        name = PREFIX + row["name"]
+        declare(name, "counter")
+        lines.append(f"{name}{_format_labels(row['labels'])} {row['value']:.6g}")
+    for row in data["info"]:
+        name = PREFIX + row["name"] + "_info"
+        declare(name, "gauge")
+        lines.append(f"{name}{_format_labels(row['labels'])} 1")
+    lines.append(f"{PREFIX}uptime_seconds {data['uptime_seconds']}")
+    return "\n".join(lines) + "\n"
+
+
+def dump(path):
+    """写出指标: .prom / .txt 为 Prometheus 文本格式，其他扩展名为 JSON"""
+    text = to_prometheus() if path.endswith((".prom", ".txt")) else to_json()
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return path
+
+
+if config.METRICS_DUMP_PATH:
+    atexit.register(lambda: dump(config.METRICS_DUMP_PATH))
+
+
+# --- 4. 性能分析 ---
+_profile_lock = threading.Lock()
+_cprofile_state = threading.local() # 每个线程一个 cProfile.Profile (Python 3.11 及以前 cProfile 只分析启用它的线程)
+_cprofiles = []
+_torch_busy = False
+_torch_traces = 0
+
+
+class _CProfileSection:
+    __slots__ = ("active",)
+
+    def __enter__(self):
+        state = _cprofile_state
+        if getattr(state, "profile", None) is None:
+            import cProfile
+            state.profile, state.depth = cProfile.Profile(), 0
+            with _profile_lock:
+                _cprofiles.append(state.profile)
+        self.active = state.depth == 0
+        if self.active:
+            try:
+                state.profile.enable()
+            except ValueError: # Python 3.12+ 同一时间只能有一个 cProfile 在运行，其他线程正在分析
+                self.active = False
+                return self
+        state.depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        state = _cprofile_state
+        if state.depth > 0:
+            state.depth -= 1
+            if state.depth == 0:
+                state.profile.disable()
+        return False
+
+
+def _save_cprofile():
+    """退出时合并所有线程的结果，写入 PROFILE_DIR/cprofile_<pid>.prof (用 python -m pstats 或 snakeviz 查看)"""
+    import pstats
+    with _profile_lock:
+        profiles = list(_cprofiles)
+    stats = None
+    for profile in profiles:
+        try:
+            profile.create_stats()
+        except Exception:
+            continue
+        if not profile.stats:
+            continue
+        if stats is None:
+            stats = pstats.Stats(profile)
+        else:
+            stats.add(profile)
+    if stats is None:
+        return
+    os.makedirs(config.PROFILE_DIR, exist_ok=True)
+    path = os.path.join(config.PROFILE_DIR, f"cprofile_{os.getpid()}.prof")
+    stats.dump_stats(path)
+    event("profile_saved", f"cProfile 结果已保存到 {path}", path=path)
+
+
+class _TorchSection:
+    """torch.profiler 同一时间只能有一个在运行，正在分析其他区段或已达到 PROFILE_LIMIT 时不分析"""
+    __slots__ = ("name", "profiler", "index")
+
+    def __init__(self, name):
+        self.name = name
+        self.profiler = None
+
+    def __enter__(self):
+        global _torch_busy, _torch_traces
+        with _profile_lock:
+            if _torch_busy or _torch_traces >= config.PROFILE_LIMIT:
+                return self
+            _torch_busy = True
+            _torch_traces += 1
+            self.index = _torch_traces
+        import torch
+        from torch.profiler import profile, ProfilerActivity
+        activities = [ProfilerActivity.CPU] + ([ProfilerActivity.CUDA] if torch.cuda.is_available() else [])
+        self.profiler = profile(activities=activities, record_shapes=True)
+        self.profiler.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        global _torch_busy
+        if self.profiler is None:
+            return False
+        try:
+            self.profiler.__exit__(*exc)
+            os.makedirs(config.PROFILE_DIR, exist_ok=True)
+            path = os.path.join(config.PROFILE_DIR, f"torch_{self.name}_{os.getpid()}_{self.index}.json")
+            self.profiler.export_chrome_trace(path)
+            event("profile_saved", f"torch.profiler trace 已保存到 {path} (可在 chrome://tracing 或 Perfetto 中打开)",
+                  path=path, section=self.name)
+        finally:
+            with _profile_lock:
+                _torch_busy = False
+        return False
+
+
+if config.PROFILE_MODE not in (None, "cprofile", "torch"):
+    event("profile_mode_unknown", f"警告: 未知的 FACE_PROFILE={config.PROFILE_MODE} (可选 cprofile / torch)，不做性能分析。",
+          level="warning", mode=config.PROFILE_MODE)
+elif config.PROFILE_MODE == "cprofile":
+    atexit.register(_save_cprofile)
+
+
+def profiled(name):
+    """性能分析区段: 未设置 FACE_PROFILE 时返回空上下文"""
+    if config.PROFILE_MODE == "cprofile":
+        return _CProfileSection()
+    if config.PROFILE_MODE == "torch":
+        return _TorchSection(name)
+    return _NULL
@@ -5,10 +5,12 @@ import torch.nn as nn
 
 class BeautyModel(nn.Module):
 
-    def __init__(self, num_classes=3):
+    def __init__(self, num_classes=3, pretrained=False):
         super().__init__()
 
-        self.backbone = torchvision.models.resnet18(pretrained=True)
+        # 默认不下载 ImageNet 预训练权重: 打分时整个模型的权重都从本地文件加载 (见 score_models.py)
+        weights = torchvision.models.ResNet18_Weights.DEFAULT if pretrained else None
+        self.backbone = torchvision.models.resnet18(weights=weights)
 
         in_features = self.backbone.fc.in_features
 
@@ -49,7 +51,7 @@ class CNNRegressionModel(nn.Module):
         x = self.pool(self.relu(self.conv1(x)))
         x = self.pool(self.relu(self.conv2(x)))
         x = self.pool(self.relu(self.conv3(x)))
-        x = x.view(-1, 64 * 16 * 16)
+        x = x.reshape(-1, 64 * 16 * 16) # channels_last 布局的特征图不能直接 view
         x = self.relu(self.fc1(x))
         x = self.fc2(x)
         return x
\ No newline at end of file
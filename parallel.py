@@ -0,0 +1,102 @@
+# parallel.py
+"""多进程批量打分: 每个工作进程加载一次模型，按块领取图片路径，结果流式返回。
+
+每个进程的 torch 算子内线程数设为 CPU 核数 / 进程数，避免多个进程争抢同一批核心。
+"""
+import contextlib
+import multiprocessing
+import os
+import sys
+import time
+
+# 工作进程内常驻的打分引擎 (由 _init_worker 创建)
+_worker_scorer = None
+
+
+def available_cpus():
+    """当前进程可用的 CPU 核数 (容器内以 CPU 亲和性为准)"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def threads_per_worker(workers):
+    """每个工作进程分到的 torch 线程数"""
+    return max(1, available_cpus() // max(1, workers))
+
+
+def _init_worker(torch_threads, scorer_kwargs):
+    """工作进程初始化: 限制线程数并加载一次模型 (不应用本机调优配置，它是按单个进程占用全部核心测得的)"""
+    global _worker_scorer
+    import cv2
+    import torch
+    torch.set_num_threads(torch_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass # 已经启动过并行任务时不能再修改
+    cv2.setNumThreads(1)
+
+    # 模型加载信息输出到 stderr，避免污染主进程写到 stdout 的结果
+    with contextlib.redirect_stdout(sys.stderr):
+        from scorer import FaceScorer
+        _worker_scorer = FaceScorer(**dict(scorer_kwargs, autotune=False))
+
+
+def _score_one(image_path):
+    return _worker_scorer.score_image(image_path)
+
+
+def score_paths_parallel(image_paths, workers, chunksize=8, ordered=True, scorer_kwargs=None):
+    """用进程池批量打分，逐个产出结果字典。
+
+    ordered=True 时按输入顺序产出，否则按完成顺序产出 (吞吐更平稳)。
+    chunksize 为每次分发给一个工作进程的图片数。
+    """
+    # 使用 spawn 而不是 fork: torch 的线程池在 fork 后可能死锁
+    context = multiprocessing.get_context("spawn")
+    initargs = (threads_per_worker(workers), scorer_kwargs or {})
+    with context.Pool(processes=workers, initializer=_init_worker, initargs=initargs) as pool:
+        imap = pool.imap if ordered else pool.imap_unordered
+        for result in imap(_score_one, image_paths, chunksize=chunksize):
+            yield result
+
+
+def scaling_report(image_paths, worker_counts, chunksize=8, scorer_kwargs=None):
+    """分别用不同进程数处理同一批图片，返回
+    [{"workers", "images", "seconds", "startup_seconds", "images_per_sec", "speedup"}, ...]。
+
+    startup_seconds 为收到第一条结果前的耗时 (主要是工作进程加载模型)，
+    images_per_sec 按收到第一条结果之后的稳定阶段计算。
+    scorer_kwargs 默认关闭结果缓存，否则测到的是缓存命中速度。
+    """
+    image_paths = list(image_paths)
+    scorer_kwargs = scorer_kwargs or {"cache_path": None}
+    rows = []
+    for workers in worker_counts:
+        start = time.perf_counter()
+        first = None
+        count = 0
+        for _ in score_paths_parallel(image_paths, workers, chunksize=chunksize,
+                                      ordered=False, scorer_kwargs=scorer_kwargs):
+            count += 1
+            if first is None:
+                first = time.perf_counter()
+        end = time.perf_counter()
+        steady = end - first if first is not None else 0.0
+        rows.append({"workers": workers, "images": count, "seconds": end - start,
+                     "startup_seconds": (first or end) - start,
+                     "images_per_sec": (count - 1) / steady if steady > 0 else 0.0})
+    baseline = rows[0]["images_per_sec"] if rows else 0.0
+    for row in rows:
+        row["speedup"] = row["images_per_sec"] / baseline if baseline > 0 else 0.0
+    return rows
+
+
+def format_scaling_report(rows):
+    lines = [f"可用 CPU 核数: {available_cpus()}",
+             f"{'进程数':>6} {'图片数':>8} {'总耗时(s)':>10} {'启动(s)':>8} {'张/秒':>9} {'加速比':>7}"]
+    for row in rows:
+        lines.append(f"{row['workers']:>6} {row['images']:>8} {row['seconds']:>10.2f} {row['startup_seconds']:>8.2f} "
+                     f"{row['images_per_sec']:>9.2f} {row['speedup']:>7.2f}")
+    return "\n".join(lines)
@@ -0,0 +1,327 @@
+# pipeline.py
+"""分阶段流水线批量打分: 解码 → 检测 → 打分 三个阶段并行运行，阶段之间用有界队列连接。
+
+    路径队列 ──> 解码线程池 (I/O 密集) ──> 已解码队列 ──> 检测线程 (多张图片合并为一次 YOLO 调用)
+            ──> 已检测队列 ──> 打分线程 (跨图片合并人脸裁剪为一次 CNNRegressionModel 调用) ──> 结果
+
+队列有界，下游变慢时上游会阻塞 (背压)，内存占用不随输入数量增长。
+stats() 给出各阶段的处理量、忙碌时间、吞吐和当前队列深度，用于定位瓶颈；
+每个批次的耗时同时记录到 metrics (pipeline_stage_seconds)。
+"""
+import heapq
+import queue
+import threading
+import time
+
+import metrics
+from image_io import read_image_bytes
+from result_cache import content_hash
+
+_STOP = object() # 阶段结束标记
+
+
+class StageStats:
+    """单个阶段的计数器 (只由该阶段的线程写入)"""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0   # 处理的图片数
+        self.calls = 0   # 批次数 (解码阶段等于图片数)
+        self.busy = 0.0  # 实际工作耗时 (秒)，不含等待队列的时间
+
+    def as_dict(self, threads=1):
+        # 吞吐按每个线程的忙碌时间计算，反映该阶段满载时的处理能力
+        capacity = self.items * threads / self.busy if self.busy > 0 else 0.0
+        return {"items": self.items, "calls": self.calls, "busy_seconds": round(self.busy, 3),
+                "items_per_busy_sec": round(capacity, 2),
+                "avg_batch": round(self.items / self.calls, 2) if self.calls else 0.0}
+
+
+class ScoringPipeline:
+    """用一个常驻的 FaceScorer 驱动三阶段流水线"""
+
+    def __init__(self, face_scorer, decode_workers=4, detect_batch=8, score_batch=64, queue_size=16):
+        self.face_scorer = face_scorer
+        self.decode_workers = decode_workers
+        self.detect_batch = detect_batch
+        self.score_batch = score_batch
+        self.queue_size = queue_size
+        self._reset()
+
+    def _reset(self):
+        self.path_queue = queue.Queue(maxsize=self.queue_size)
+        self.decoded_queue = queue.Queue(maxsize=self.queue_size)
+        self.detected_queue = queue.Queue(maxsize=self.queue_size)
+        self.result_queue = queue.Queue(maxsize=self.queue_size)
+        self.stage_stats = {name: StageStats(name) for name in ("decode", "detect", "score")}
+        # 每次从队列取数据时采样队列深度: 长期积满说明下游是瓶颈，长期为空说明上游是瓶颈
+        self.depth_samples = {name: [0, 0, 0] for name in ("paths", "decoded", "detected", "results")} # 总和, 次数, 最大值
+        self.started_at = None
+        self.feed_error = None # 输入路径的迭代器抛出的异常，处理完已送入的图片后由 run() 重新抛出
+        self.finished_items = 0
+        self.inflight = {} # 输入序号 -> (开始解码的时间, 内容哈希)，结果完成时写入结果记录
+        self._stats_lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    # --- 队列操作 (消费者提前退出时能及时结束各线程) ---
+    def _put(self, target_queue, item):
+        while not self._stop_event.is_set():
+            try:
+                target_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, source_queue, name):
+        depth = source_queue.qsize()
+        samples = self.depth_samples[name]
+        samples[0] += depth
+        samples[1] += 1
+        samples[2] = max(samples[2], depth)
+        while not self._stop_event.is_set():
+            try:
+                return source_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _STOP
+
+    @staticmethod
+    def _drain(source_queue, limit):
+        """非阻塞地再取最多 limit 个条目，用于在有积压时凑批"""
+        items = []
+        while len(items) < limit:
+            try:
+                items.append(source_queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    # --- 各阶段 ---
+    def _feed(self, image_paths):
+        try:
+            for index, image_path in enumerate(image_paths):
+                if not self._put(self.path_queue, (index, image_path)):
+                    return
+        except BaseException as e: # 例如遍历目录时的 PermissionError
+            self.feed_error = e
+        finally:
+            # 无论输入是否出错，解码线程都要收到结束标记，否则 run() 会一直等待结果
+            for _ in range(self.decode_workers):
+                self._put(self.path_queue, _STOP)
+
+    def _decode_stage(self):
+        face_scorer = self.face_scorer
+        stats = self.stage_stats["decode"]
+        while True:
+            item = self._get(self.path_queue, "paths")
+            if item is _STOP:
+                self._put(self.decoded_queue, _STOP)
+                return
+            index, image_path = item
+            start = time.perf_counter()
+            try:
+                data = read_image_bytes(image_path)
+                digest = content_hash(data) if data is not None else None
+                self.inflight[index] = (start, digest)
+                cache_key = digest if face_scorer.cache is not None else None
+                cached = face_scorer.cache.get(cache_key) if cache_key else None
+                if cache_key:
+                    metrics.increment("cache_lookups_total", result="miss" if cached is None else "hit")
+                if cached is not None:
+                    # 缓存命中: 直接产出结果，跳过检测和打分
+                    payload = ("result", face_scorer.cached_result(image_path, cached), None)
+                else:
+                    # 原图要留给检测阶段裁剪，所以总是解码原图；检测用的缩小代理图也在解码线程池中生成，
+                    # 检测线程只需处理小图 (分块模式下两者是同一张图)
+                    proxy, cv_img, full_size = face_scorer.decode_for_detection(data, need_full=True) if data is not None else (None, None, None)
+                    if proxy is None:
+                        payload = ("result", face_scorer.unreadable_result(image_path), None)
+                    else:
+                        payload = ("image", cv_img, proxy, full_size, cache_key)
+            except Exception as e:
+                metrics.event("job_failed", f"解码 {image_path} 时发生错误: {e}", level="error", exc_info=True,
+                              path=image_path, stage="decode", error=str(e))
+                payload = ("result", face_scorer.error_result(image_path, e), None)
+            self._record(stats, start, 1)
+            self._put(self.decoded_queue, (index, image_path) + payload)
+
+    def _detect_stage(self):
+        face_scorer = self.face_scorer
+        stats = self.stage_stats["detect"]
+        running_decoders = self.decode_workers
+        while running_decoders > 0:
+            first = self._get(self.decoded_queue, "decoded")
+            batch = [first] + self._drain(self.decoded_queue, self.detect_batch - 1)
+            images = []
+            for item in batch:
+                if item is _STOP:
+                    running_decoders -= 1
+                elif item[2] == "result":
+                    self._put(self.detected_queue, item) # 已有结果 (缓存命中 / 读取失败)，直接往下传
+                else:
+                    images.append(item)
+            if not images:
+                continue
+
+            start = time.perf_counter()
+            try:
+                all_detections = face_scorer.detect_images([item[4] for item in images])
+                outputs = []
+                for (index, image_path, _, cv_img, proxy, full_size, cache_key), detections in zip(images, all_detections):
+                    detections = face_scorer.remap_detections(detections, proxy, full_size)
+                    selected = face_scorer.select_faces(detections, full_size)
+                    no_face = face_scorer.no_face_result(image_path, detections, selected)
+                    if no_face is not None:
+                        outputs.append((index, image_path, "result", no_face, cache_key))
+                    else:
+                        crops = face_scorer.crop_selected(cv_img, selected, full_size)
+                        outputs.append((index, image_path, "faces", selected, crops, cache_key))
+            except Exception as e:
+                metrics.event("batch_failed", f"检测 {len(images)} 张图片时发生错误: {e}", level="error", exc_info=True,
+                              stage="detect", images=len(images), error=str(e))
+                outputs = [(item[0], item[1], "result", face_scorer.error_result(item[1], e), None) for item in images]
+            self._record(stats, start, len(images))
+            for output in outputs:
+                self._put(self.detected_queue, output)
+        self._put(self.detected_queue, _STOP)
+
+    def _score_stage(self):
+        face_scorer = self.face_scorer
+        stats = self.stage_stats["score"]
+        finished = False
+        while not finished:
+            first = self._get(self.detected_queue, "detected")
+            batch = [first]
+            num_faces = len(first[4]) if first is not _STOP and first[2] == "faces" else 0
+            # 有积压时继续凑批，直到人脸数达到 score_batch
+            while first is not _STOP and num_faces < self.score_batch:
+                extra = self._drain(self.detected_queue, 1)
+                if not extra:
+                    break
+                batch.extend(extra)
+                if extra[0] is _STOP:
+                    break
+                if extra[0][2] == "faces":
+                    num_faces += len(extra[0][4])
+
+            to_score = []
+            for item in batch:
+                if item is _STOP:
+                    finished = True
+                elif item[2] == "result":
+                    self._finish(item[0], item[3], item[4])
+                else:
+                    to_score.append(item)
+            if not to_score:
+                continue
+
+            start = time.perf_counter()
+            try:
+                scores = face_scorer.score_faces([crop for item in to_score for crop in item[4]])
+                offset = 0
+                results = []
+                for index, image_path, _, selected, crops, cache_key in to_score:
+                    results.append((index, face_scorer.scored_result(image_path, selected, scores[offset:offset + len(crops)]), cache_key))
+                    offset += len(crops)
+            except Exception as e:
+                metrics.event("batch_failed", f"为 {len(to_score)} 张图片打分时发生错误: {e}", level="error", exc_info=True,
+                              stage="score", images=len(to_score), error=str(e))
+                results = [(item[0], face_scorer.error_result(item[1], e), None) for item in to_score]
+            self._record(stats, start, len(to_score))
+            for index, result, cache_key in results:
+                self._finish(index, result, cache_key)
+        self._put(self.result_queue, _STOP)
+
+    def _record(self, stats, start, items):
+        """记录一次批处理的耗时和图片数 (解码阶段有多个线程，需要加锁)"""
+        busy = time.perf_counter() - start
+        with self._stats_lock:
+            stats.items += items
+            stats.calls += 1
+            stats.busy += busy
+        metrics.observe("pipeline_stage_seconds", busy, stage=stats.name)
+        metrics.observe("pipeline_batch_size", items, stage=stats.name)
+
+    def _finish(self, index, result, cache_key):
+        if cache_key and result["status"] != "error":
+            self.face_scorer.cache.put(cache_key, result)
+        if result["status"] in ("ok", "no_face") and not result["cached"]:
+            metrics.observe("faces_per_image", len(result["faces"]))
+        metrics.increment("images_total", status=result["status"], cached=result["cached"])
+        # 耗时为从开始解码到打分完成的实际时长 (含在队列中等待的时间)
+        start, digest = self.inflight.pop(index, (None, None))
+        elapsed_ms = round((time.perf_counter() - start) * 1000, 1) if start is not None else None
+        result.update(content_hash=digest, elapsed_ms=elapsed_ms, fingerprint=self.face_scorer.fingerprint)
+        self._put(self.result_queue, (index, result))
+
+    # --- 对外接口 ---
+    def run(self, image_paths, ordered=False):
+        """处理一批图片，逐个产出结果字典 (默认按完成顺序，ordered=True 时按输入顺序)"""
+        self._reset()
+        self.started_at = time.perf_counter()
+        threads = [threading.Thread(target=self._feed, args=(image_paths,), name="pipeline-feed", daemon=True)]
+        threads += [threading.Thread(target=self._decode_stage, name=f"pipeline-decode-{i}", daemon=True)
+                    for i in range(self.decode_workers)]
+        threads += [threading.Thread(target=self._detect_stage, name="pipeline-detect", daemon=True),
+                    threading.Thread(target=self._score_stage, name="pipeline-score", daemon=True)]
+        for thread in threads:
+            thread.start()
+
+        pending = [] # ordered=True 时暂存提前完成的结果 (最小堆，按输入序号)
+        next_index = 0
+        try:
+            while True:
+                item = self._get(self.result_queue, "results")
+                if item is _STOP:
+                    break
+                self.finished_items += 1
+                if not ordered:
+                    yield item[1]
+                    continue
+                heapq.heappush(pending, (item[0], id(item[1]), item[1]))
+                while pending and pending[0][0] == next_index:
+                    yield heapq.heappop(pending)[2]
+                    next_index += 1
+            while pending:
+                yield heapq.heappop(pending)[2]
+            if self.feed_error is not None:
+                raise self.feed_error
+        finally:
+            # 各线程最多再处理完手头的一个批次就会退出
+            self._stop_event.set()
+            for thread in threads:
+                thread.join()
+
+    def stats(self):
+        """各阶段吞吐与当前队列深度"""
+        elapsed = time.perf_counter() - self.started_at if self.started_at else 0.0
+        stages = {name: stats.as_dict(self.decode_workers if name == "decode" else 1)
+                  for name, stats in self.stage_stats.items()}
+        # 忙碌比例最高的阶段即瓶颈
+        bottleneck = max(stages, key=lambda name: self.stage_stats[name].busy
+                         / (self.decode_workers if name == "decode" else 1)) if elapsed > 0 else None
+        return {
+            "elapsed_seconds": round(elapsed, 3),
+            "finished": self.finished_items,
+            "images_per_sec": round(self.finished_items / elapsed, 2) if elapsed > 0 else 0.0,
+            "queue_size": self.queue_size,
+            "queue_depths": {"paths": self.path_queue.qsize(), "decoded": self.decoded_queue.qsize(),
+                             "detected": self.detected_queue.qsize(), "results": self.result_queue.qsize()},
+            "queue_depth_avg": {name: round(total / count, 2) if count else 0.0
+                                for name, (total, count, _) in self.depth_samples.items()},
+            "queue_depth_max": {name: samples[2] for name, samples in self.depth_samples.items()},
+            "stages": stages,
+            "bottleneck": bottleneck,
+        }
+
+
+def format_stats(stats):
+    lines = [f"流水线: {stats['finished']} 张，{stats['elapsed_seconds']:.1f}s，{stats['images_per_sec']:.2f} 张/秒，"
+             f"瓶颈阶段: {stats['bottleneck']}",
+             f"队列平均深度 (上限 {stats['queue_size']}): "
+             + ", ".join(f"{name}={depth}" for name, depth in stats["queue_depth_avg"].items())]
+    for name, stage in stats["stages"].items():
+        lines.append(f"  - {name:<6} 处理 {stage['items']} 张 / {stage['calls']} 批 (平均每批 {stage['avg_batch']})，"
+                     f"忙碌 {stage['busy_seconds']}s，满载吞吐 {stage['items_per_busy_sec']} 张/秒")
+    return "\n".join(lines)
@@ -0,0 +1,227 @@
+# precision.py
+"""颜值打分模型的推理精度: fp32 (默认)、int8 (动态量化) 和 bf16。
+
+CNNRegressionModel 的 fc1 (16384×512) 占了约 8.4M 参数，CPU 上打分的耗时和权重内存主要花在这一层。
+int8 模式对所有 Linear 层做动态量化 (权重 int8，激活在运行时量化)，只支持 CPU；
+bf16 模式把整个模型转换为 bfloat16，只在 CPU 原生支持 bf16 (AVX512-BF16 / AMX) 或 GPU 支持时启用。
+
+用法:
+    python -m precision convert                       # 由 beauty_cnn_model.pth 生成 int8 权重文件
+    python -m precision report photos/ --tolerance 0.05  # 各精度相对 fp32 的分数误差与耗时
+"""
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+import config
+import metrics
+from result_cache import file_digest
+
+PRECISIONS = ("fp32", "int8", "bf16")
+
+
+def bf16_supported(device=None):
+    """当前设备是否原生支持 bf16 计算 (不支持时 bf16 虽能运行但比 fp32 更慢)"""
+    device = torch.device(device or config.DEVICE)
+    if device.type == "cuda":
+        return torch.cuda.is_available() and torch.cuda.is_bf16_supported()
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = set(f.read().split())
+    except OSError:
+        return False
+    return bool(flags & {"avx512_bf16", "amx_bf16"})
+
+
+def resolve_precision(precision, device=None):
+    """检查精度模式在当前设备上是否可用，不可用时打印原因并退回 fp32"""
+    device = torch.device(device or config.DEVICE)
+    if precision not in PRECISIONS:
+        raise ValueError(f"未知的打分精度: {precision} (可选: {', '.join(PRECISIONS)})")
+    if precision == "int8" and device.type != "cpu":
+        metrics.event("precision_fallback", f"警告: int8 动态量化只支持 CPU，当前设备为 {device}，将使用 fp32。",
+                      level="warning", precision=precision, device=str(device))
+        return "fp32"
+    if precision == "bf16" and not bf16_supported(device):
+        metrics.event("precision_fallback", "警告: 当前设备不支持原生 bf16 计算，将使用 fp32。",
+                      level="warning", precision=precision, device=str(device))
+        return "fp32"
+    return precision
+
+
+def input_dtype(precision):
+    """模型输入张量的 dtype"""
+    return torch.bfloat16 if precision == "bf16" else torch.float32
+
+
+def quantize_int8(model):
+    """对 Linear 层做动态 int8 量化 (返回新模型，原模型不变)"""
+    from torch.ao.quantization import quantize_dynamic
+    return quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def convert_int8(source_path=None, output_path=None):
+    """由 fp32 权重生成 int8 权重文件，同时记录源文件摘要，源权重更新后加载时会自动重新量化"""
+    from models import CNNRegressionModel
+    source_path = source_path or config.BEAUTY_MODEL_PATH
+    output_path = output_path or config.BEAUTY_MODEL_INT8_PATH
+    model = CNNRegressionModel()
+    model.load_state_dict(torch.load(source_path, map_location="cpu"))
+    model.eval()
+    quantized = quantize_int8(model)
+    torch.save({"source_digest": file_digest(source_path), "state_dict": quantized.state_dict()}, output_path)
+    return output_path
+
+
+def load_int8_artifact(model, source_path, artifact_path):
+    """读取 convert_int8 生成的 int8 权重；文件不存在或与 fp32 权重不对应时返回 None"""
+    if not artifact_path or not os.path.exists(artifact_path):
+        return None
+    try:
+        artifact = torch.load(artifact_path, map_location="cpu", weights_only=False)
+        if artifact.get("source_digest") != file_digest(source_path):
+            metrics.event("int8_artifact_stale", f"警告: int8 权重 '{artifact_path}' 与 '{source_path}' 不对应，将在加载时重新量化。",
+                          level="warning", path=artifact_path)
+            return None
+        quantized = quantize_int8(model)
+        quantized.load_state_dict(artifact["state_dict"])
+        return quantized
+    except Exception as e:
+        metrics.event("int8_artifact_failed", f"读取 int8 权重 '{artifact_path}' 失败: {e}，将在加载时重新量化。",
+                      level="warning", path=artifact_path, error=str(e))
+        return None
+
+
+def apply_precision(model, precision, source_path=None, artifact_path=None):
+    """把已加载 fp32 权重的模型转换为指定精度 (int8 优先使用预先生成的量化权重)"""
+    if precision == "int8":
+        # artifact_path 为空字符串时不使用预先生成的量化权重 (只有 cnn 打分模型有 int8 权重文件)
+        quantized = load_int8_artifact(model, source_path or config.BEAUTY_MODEL_PATH,
+                                       config.BEAUTY_MODEL_INT8_PATH if artifact_path is None else artifact_path)
+        return (quantized if quantized is not None else quantize_int8(model)).eval()
+    if precision == "bf16":
+        return model.to(torch.bfloat16).eval()
+    return model
+
+
+def weights_size_mb(model):
+    """序列化后的权重大小 (MB)"""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / (1024 * 1024)
+
+
+# --- 精度 / 耗时对比报告 ---
+def collect_face_crops(face_scorer, image_paths):
+    """用 fp32 流程检测每张图片，返回所有人脸裁剪图 (复制，不保留整图)"""
+    from image_io import read_image_bytes
+    crops = []
+    for image_path in image_paths:
+        data = read_image_bytes(image_path)
+        if data is None:
+            continue
+        proxy, cv_img, full_size = face_scorer.decode_for_detection(data, need_full=True)
+        if proxy is None:
+            continue
+        detections = face_scorer.remap_detections(face_scorer.detect(proxy), proxy, full_size)
+        selected = face_scorer.select_faces(detections, full_size)
+        crops.extend(crop.copy() for crop in face_scorer.crop_selected(cv_img, selected, full_size))
+    return crops
+
+
+def precision_report(image_paths, precisions=PRECISIONS, repeat=5, tolerance=0.05):
+    """对同一批人脸分别用各精度打分，返回
+    [{"precision", "faces", "ms_per_face", "speedup", "max_abs_error", "mean_abs_error", "weights_mb", "within_tolerance"}, ...]。
+    """
+    from scorer import FaceScorer, load_beauty_model
+    with contextlib.redirect_stdout(sys.stderr):
+        baseline_scorer = FaceScorer(cache_path=None, precision="fp32")
+    crops = collect_face_crops(baseline_scorer, image_paths)
+    if not crops:
+        return []
+    baseline = np.array(baseline_scorer.score_faces(crops))
+
+    rows = []
+    for precision in precisions:
+        with contextlib.redirect_stdout(sys.stderr):
+            if resolve_precision(precision, baseline_scorer.device) != precision:
+                continue
+            beauty_model = baseline_scorer.beauty_model if precision == "fp32" else \
+                load_beauty_model(device=baseline_scorer.device, precision=precision)
+        face_scorer = FaceScorer(yolo_model=baseline_scorer.yolo_model, beauty_model=beauty_model,
+                                 device=baseline_scorer.device, precision=precision, cache_path=None)
+        face_scorer.score_faces(crops[:config.SCORE_BATCH_SIZE]) # 预热
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            scores = face_scorer.score_faces(crops)
+            samples.append(time.perf_counter() - start)
+        errors = np.abs(np.array(scores) - baseline)
+        rows.append({"precision": precision, "faces": len(crops),
+                     "ms_per_face": statistics.median(samples) * 1000 / len(crops),
+                     "max_abs_error": float(errors.max()), "mean_abs_error": float(errors.mean()),
+                     "weights_mb": weights_size_mb(beauty_model),
+                     "within_tolerance": bool(errors.max() <= tolerance)})
+    base_latency = rows[0]["ms_per_face"] if rows and rows[0]["precision"] == "fp32" else None
+    for row in rows:
+        row["speedup"] = base_latency / row["ms_per_face"] if base_latency else 0.0
+    return rows
+
+
+def recommend_precision(rows):
+    """在误差不超过容差的精度中选最快的一个"""
+    candidates = [row for row in rows if row["within_tolerance"]]
+    return min(candidates, key=lambda row: row["ms_per_face"])["precision"] if candidates else "fp32"
+
+
+def format_precision_report(rows, tolerance):
+    if not rows:
+        return "没有检测到可用于对比的人脸。"
+    lines = [f"共 {rows[0]['faces']} 张人脸，容差 {tolerance}",
+             f"{'精度':>6} {'ms/张':>8} {'加速比':>7} {'最大误差':>10} {'平均误差':>10} {'权重MB':>8} {'达标':>4}"]
+    for row in rows:
+        lines.append(f"{row['precision']:>6} {row['ms_per_face']:>8.3f} {row['speedup']:>7.2f} "
+                     f"{row['max_abs_error']:>10.5f} {row['mean_abs_error']:>10.5f} {row['weights_mb']:>8.2f} "
+                     f"{'是' if row['within_tolerance'] else '否':>4}")
+    lines.append(f"推荐: SCORE_PRECISION = \"{recommend_precision(rows)}\"")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m precision", description="颜值打分模型的精度转换与对比")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert = commands.add_parser("convert", help="由 fp32 权重生成 int8 动态量化权重")
+    convert.add_argument("--source", default=config.BEAUTY_MODEL_PATH, help="fp32 权重 (默认 %(default)s)")
+    convert.add_argument("-o", "--output", default=config.BEAUTY_MODEL_INT8_PATH, help="输出文件 (默认 %(default)s)")
+    report = commands.add_parser("report", help="各精度相对 fp32 的分数误差与打分耗时")
+    report.add_argument("inputs", nargs="+", help="图片文件、目录或通配符")
+    report.add_argument("-r", "--recursive", action="store_true", help="递归处理子目录")
+    report.add_argument("--precisions", default=",".join(PRECISIONS), help="参与对比的精度 (默认 %(default)s)")
+    report.add_argument("--tolerance", type=float, default=0.05, help="允许的最大分数误差 (默认 %(default)s)")
+    report.add_argument("--repeat", type=int, default=5, help="计时重复次数 (取中位数)")
+    args = parser.parse_args(argv)
+
+    if args.command == "convert":
+        output_path = convert_int8(args.source, args.output)
+        print(f"int8 权重已保存到 {output_path} ({os.path.getsize(output_path) / (1024 * 1024):.2f} MB，"
+              f"原始 {os.path.getsize(args.source) / (1024 * 1024):.2f} MB)")
+        return 0
+
+    from image_io import iter_image_paths
+    image_paths = list(iter_image_paths(args.inputs, args.recursive))
+    precisions = [name.strip() for name in args.precisions.split(",") if name.strip()]
+    rows = precision_report(image_paths, precisions, repeat=args.repeat, tolerance=args.tolerance)
+    print(format_precision_report(rows, args.tolerance))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,164 +1,134 @@
 # processing.py
-import os
-import traceback
-import numpy as np
-import cv2
-from PIL import Image
-import torch
-from torchvision import transforms
+import itertools
+import queue
+import threading
+import time
+
 from PyQt5.QtCore import QThread, pyqtSignal
 
 # 从项目文件中导入
-import config # 导入配置
-from models import CNNRegressionModel # 导入模型定义
-
-# 尝试导入必要的库
-try:
-    from ultralytics import YOLO
-    from supervision import Detections
-except ImportError as e:
-    print(f"错误: 缺少必要的库: {e}. 请运行 'pip install ultralytics supervision'")
-    YOLO = None # 标记库不可用
-    Detections = None
-
-
-# --- 1. 图像预处理 (用于颜值打分模型) ---
-score_transform = transforms.Compose([
-    transforms.Resize(config.SCORE_MODEL_INPUT_SIZE), # 使用配置文件中的尺寸
-    transforms.ToTensor(),
-    # 如果训练时用了 normalization，这里也要加上
-    # transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-])
-
-# --- 2. 模型加载 ---
-yolo_model = None
-beauty_model = None
-models_loaded = {"yolo": False, "beauty": False}
-
-# 加载 YOLOv8
-if YOLO is not None: # 仅在库成功导入时尝试加载
-    if os.path.exists(config.YOLO_MODEL_PATH):
-        try:
-            yolo_model = YOLO(config.YOLO_MODEL_PATH)
-            print("YOLOv8 人脸检测模型加载成功。")
-            models_loaded["yolo"] = True
-        except Exception as e:
-            print(f"加载 YOLOv8 模型 '{config.YOLO_MODEL_PATH}' 时出错: {e}")
-            traceback.print_exc()
-    else:
-        print(f"错误：YOLOv8 模型文件未找到于 '{config.YOLO_MODEL_PATH}'")
-else:
-     print("错误：ultralytics 或 supervision 库未安装，无法加载 YOLOv8 模型。")
-
-
-# 加载颜值打分模型
-if os.path.exists(config.BEAUTY_MODEL_PATH):
-    try:
-        beauty_model = CNNRegressionModel() # 实例化模型类
-        # 加载权重，映射到正确设备
-        beauty_model.load_state_dict(torch.load(config.BEAUTY_MODEL_PATH, map_location=config.DEVICE))
-        beauty_model.to(config.DEVICE) # 移动模型到设备
-        beauty_model.eval()          # 设置为评估模式
-        print(f"颜值打分模型从 '{config.BEAUTY_MODEL_PATH}' 加载成功。")
-        models_loaded["beauty"] = True
-    except FileNotFoundError:
-        print(f"错误：颜值打分模型文件未找到于 '{config.BEAUTY_MODEL_PATH}'")
-    except Exception as e:
-        print(f"加载颜值打分模型 '{config.BEAUTY_MODEL_PATH}' 时出错: {e}")
-        traceback.print_exc()
-else:
-    print(f"错误：颜值打分模型文件未找到于 '{config.BEAUTY_MODEL_PATH}'")
-
-
-# --- 3. 后台处理线程 ---
-class ProcessingThread(QThread):
-    # Signal arguments: cv_img (for display), score_text, status_message
-    finished = pyqtSignal(object, str, str)
-
-    def __init__(self, image_path):
+import config
+from scorer import FaceScorer # 不依赖 Qt 的检测 + 打分引擎
+
+# --- 1. 模型加载 ---
+# 模块导入时只创建打分引擎，不加载模型；模型由 InferenceWorker 在窗口显示后于后台加载
+face_scorer = FaceScorer(lazy=True, cache_path=config.RESULT_CACHE_PATH if config.RESULT_CACHE_ENABLED else None)
+
+# 各阶段在界面上的显示名称
+STAGE_NAMES = {"read": "读取", "decode": "解码", "detect": "人脸检测", "score": "颜值打分", "draw": "绘制结果"}
+
+
+def format_score_text(result):
+    """把结果字典转换为分数标签上显示的文本"""
+    if result["score"] is not None:
+        return f"{result['score']:.2f}" # 格式化分数
+    if result["status"] == "error" and result["message"].startswith("错误: 处理失败"):
+        return "错误"
+    return "N/A"
+
+
+# --- 2. 常驻推理线程 ---
+class InferenceWorker(QThread):
+    """常驻后台的推理线程: 启动时加载并预热模型，之后依次处理任务队列中的图片。
+
+    界面线程通过 submit() 随时追加任务，通过 cancel() 取消排队中和正在处理的任务
+    (正在处理的任务在下一个阶段边界处停止)。
+    """
+    # Signal arguments: model_status dict ({"yolo": bool, "beauty": bool})
+    models_ready = pyqtSignal(dict)
+    # Signal arguments: job_id, image_path
+    job_started = pyqtSignal(int, str)
+    # Signal arguments: job_id, percent, stage display name
+    job_progress = pyqtSignal(int, int, str)
+    # Signal arguments: job_id, cv_img (for display), score_text, status_message, result dict
+    job_finished = pyqtSignal(int, object, str, str, dict)
+    # Signal arguments: number of queued (not yet started) jobs
+    queue_changed = pyqtSignal(int)
+
+    def __init__(self, scorer=None):
         super().__init__()
-        self.image_path = image_path
-        # 注意：线程不直接持有模型，而是使用本模块全局加载的模型
-        # 这假设模型是线程安全的（PyTorch 模型通常在 eval 模式下是）
+        self.face_scorer = scorer or face_scorer
+        self._jobs = queue.Queue()
+        self._job_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._queued = {}          # job_id -> image_path，尚未开始的任务
+        self._cancelled = set()    # 已请求取消的任务
+        self.current_job = None    # 正在处理的任务 id
+
+    # --- 界面线程调用 ---
+    def submit(self, image_path, annotate=True):
+        """加入一张图片，返回任务 id。
+
+        annotate=False 时不返回标注后的整图 (批量加入时由画廊按需生成缩略图和预览，避免在信号中传递大图)
+        """
+        with self._lock:
+            job_id = next(self._job_ids)
+            self._queued[job_id] = image_path
+            pending = len(self._queued)
+        self._jobs.put((job_id, image_path, annotate))
+        self.queue_changed.emit(pending)
+        return job_id
+
+    def cancel(self, job_id=None):
+        """取消指定任务；不指定时取消所有排队中的任务和正在处理的任务"""
+        with self._lock:
+            if job_id is None:
+                targets = list(self._queued)
+                if self.current_job is not None:
+                    targets.append(self.current_job)
+            else:
+                targets = [job_id]
+            self._cancelled.update(targets)
+
+    def pending_count(self):
+        """排队中 (尚未开始) 的任务数"""
+        with self._lock:
+            return len(self._queued)
+
+    def stop(self):
+        """关闭窗口时调用: 取消全部任务并让线程退出"""
+        self.cancel()
+        self.requestInterruption()
+        self._jobs.put(None)
+
+    # --- 工作线程 ---
+    def _is_cancelled(self, job_id):
+        return job_id in self._cancelled or self.isInterruptionRequested()
 
     def run(self):
-        """在后台线程中执行检测和打分"""
-        # 检查模型是否已加载
-        if not models_loaded["yolo"]:
-            self.finished.emit(None, "N/A", "错误: YOLO 模型未加载")
-            return
-        if not models_loaded["beauty"]:
-            self.finished.emit(None, "N/A", "错误: 颜值打分模型未加载")
-            return
-
-        cv_img = None # 初始化以防早期错误
-        try:
-            # 1. 加载图片
-            print(f"线程：正在加载图片 {self.image_path}")
-            cv_img = cv2.imread(self.image_path)
-            if cv_img is None:
-                self.finished.emit(None, "N/A", f"错误: 无法读取图片 {os.path.basename(self.image_path)}")
-                return
-            pil_img = Image.open(self.image_path).convert("RGB") # 用于 YOLO 和裁剪
-
-            # 2. 人脸检测 (YOLOv8)
-            print("线程：开始人脸检测...")
-            yolo_output = yolo_model(pil_img, verbose=False) # verbose=False 减少控制台输出
-            print("线程：人脸检测完成.")
-
-            if Detections is None: # 再次检查 supervision 是否可用
-                 self.finished.emit(cv_img, "N/A", "错误: supervision 库不可用")
-                 return
-
-            results = Detections.from_ultralytics(yolo_output[0])
-
-            if len(results) == 0:
-                print("线程：未检测到人脸。")
-                self.finished.emit(cv_img, "N/A", "未检测到人脸")
-                return
-
-            print(f"线程：检测到 {len(results)} 张人脸。处理第一张...")
-            # 获取第一个检测到的人脸边界框
-            x_min, y_min, x_max, y_max = map(int, results.xyxy[0])
-
-            # 坐标有效性检查
-            h_img, w_img = cv_img.shape[:2]
-            x_min = max(0, x_min)
-            y_min = max(0, y_min)
-            x_max = min(w_img - 1, x_max)
-            y_max = min(h_img - 1, y_max)
-
-            if x_min >= x_max or y_min >= y_max:
-                 self.finished.emit(cv_img, "N/A", "检测到无效的人脸框")
-                 return
-
-            # 3. 裁剪人脸区域 (从 PIL Image)
-            face_pil = pil_img.crop((x_min, y_min, x_max, y_max))
-
-            # 4. 颜值打分
-            print("线程：开始颜值打分...")
-            face_tensor = score_transform(face_pil).unsqueeze(0) # 预处理并加 batch 维度
-            face_tensor = face_tensor.to(config.DEVICE)       # 移动到设备
-
-            with torch.no_grad():
-                score_output = beauty_model(face_tensor)
-            score = score_output.item()
-            score_text = f"{score:.2f}" # 格式化分数
-            print(f"线程：颜值打分完成，分数: {score_text}")
-
-            # 5. 在 OpenCV 图像上绘制边界框
-            cv2.rectangle(cv_img, (x_min, y_min), (x_max, y_max), (0, 255, 0), 2)
-
-            # 6. 发送成功结果信号
-            self.finished.emit(cv_img, score_text, f"处理完成: {os.path.basename(self.image_path)}")
-
-        except Exception as e:
-            print(f"线程：处理过程中发生错误: {e}")
-            traceback.print_exc()
-            # 尝试返回原始（或部分处理的）图片和错误信息
-            error_message = f"错误: 处理失败 - {e}"
-            self.finished.emit(cv_img, "错误", error_message)
+        status = self.face_scorer.load()
+        self.face_scorer.warm_up()
+        self.models_ready.emit(status)
+
+        while not self.isInterruptionRequested():
+            job = self._jobs.get()
+            if job is None:
+                break
+            job_id, image_path, annotate = job
+            with self._lock:
+                self._queued.pop(job_id, None)
+                pending = len(self._queued)
+                self.current_job = job_id
+            self.queue_changed.emit(pending)
+
+            started = time.perf_counter()
+            if self._is_cancelled(job_id):
+                result = self.face_scorer.make_result(image_path, "cancelled", "已取消")
+            else:
+                self.job_started.emit(job_id, image_path)
+                result = self.face_scorer.score_image(
+                    image_path, annotate=annotate,
+                    progress=lambda stage, percent: self.job_progress.emit(job_id, percent, STAGE_NAMES.get(stage, stage)),
+                    should_cancel=lambda: self._is_cancelled(job_id))
+
+            with self._lock:
+                self.current_job = None
+                self._cancelled.discard(job_id)
+            # 界面状态栏显示的实测耗时 (含排队后的取消检查等)；elapsed_ms 保留引擎记录的处理耗时
+            result["worker_ms"] = (time.perf_counter() - started) * 1000
+            image = result.pop("image", None)
+            self.job_finished.emit(job_id, image, format_score_text(result), result["message"], result)
 
 def get_model_load_status():
-    """返回模型加载状态"""
-    return models_loaded
\ No newline at end of file
+    """返回模型加载状态 (后台加载完成前均为 False)"""
+    return face_scorer.models_loaded
@@ -0,0 +1,121 @@
+# result_cache.py
+"""基于 SQLite 的持久化结果缓存。
+
+键 = 图片内容的 SHA-256 + 模型指纹 (两个模型文件的摘要和筛选参数)，
+值 = 人脸框和分数。重复提交的图片无需再跑模型；任一模型文件变化后指纹改变，旧结果不再命中。
+界面、批量打分、HTTP 服务等不同配置 (指纹) 共用同一个缓存库，打开缓存时不删除其他指纹的结果，
+缓存条目数超过上限时按最近访问时间统一淘汰 (LRU)。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# 每写入这么多条新结果重新统计一次总条数 (其他进程也在写同一个缓存库)
+RECOUNT_EVERY = 1000
+
+
+def content_hash(data):
+    """计算图片原始字节 (bytes 或 numpy uint8 数组) 的 SHA-256"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """分块计算文件的 SHA-256，文件不存在时返回 "missing" """
+    if not path or not os.path.exists(path):
+        return "missing"
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def model_fingerprint(yolo_path, beauty_path, extra=None):
+    """由 YOLO 路径、两个模型文件的内容摘要以及影响结果的参数生成模型指纹"""
+    parts = [os.path.abspath(yolo_path) if yolo_path else "", file_digest(yolo_path), file_digest(beauty_path)]
+    if extra:
+        parts.append(json.dumps(extra, sort_keys=True))
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()[:32]
+
+
+class ResultCache:
+    """线程安全的 SQLite 结果缓存 (GUI 工作线程与批量处理可共用)"""
+
+    def __init__(self, db_path, fingerprint, max_entries=100000):
+        self.db_path = os.path.expanduser(db_path)
+        self.fingerprint = fingerprint
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        # 多个工作进程可能同时写入同一个缓存库，等待写锁而不是立即报错
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " content_hash TEXT NOT NULL,"
+                " fingerprint TEXT NOT NULL,"
+                " payload TEXT NOT NULL,"
+                " last_access REAL NOT NULL,"
+                " PRIMARY KEY (content_hash, fingerprint))")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_last_access ON results (last_access)")
+            # 其他指纹下的结果不会被当前指纹命中，留给 LRU 淘汰
+            self._count = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        self._inserted = 0
+
+    def get(self, key):
+        """查询缓存，命中时返回 {"status", "score", "faces", "message"}，否则返回 None"""
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT payload FROM results WHERE content_hash = ? AND fingerprint = ?",
+                (key, self.fingerprint)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE results SET last_access = ? WHERE content_hash = ? AND fingerprint = ?",
+                (time.time(), key, self.fingerprint))
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, result):
+        """写入一条结果 (只保存框、分数和状态)，超过上限时淘汰最久未访问的条目"""
+        payload = json.dumps({field: result[field] for field in ("status", "score", "faces", "message")},
+                             ensure_ascii=False)
+        with self._lock, self._conn:
+            exists = self._conn.execute(
+                "SELECT 1 FROM results WHERE content_hash = ? AND fingerprint = ?",
+                (key, self.fingerprint)).fetchone() is not None
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (content_hash, fingerprint, payload, last_access) VALUES (?, ?, ?, ?)",
+                (key, self.fingerprint, payload, time.time()))
+            if not exists:
+                self._count += 1
+                self._inserted += 1
+            # 本进程的计数不含其他进程写入的条目: 可能超限或定期时重新统计
+            if self._count > self.max_entries or self._inserted >= RECOUNT_EVERY:
+                self._count = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+                self._inserted = 0
+            overflow = self._count - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM results WHERE rowid IN "
+                    "(SELECT rowid FROM results ORDER BY last_access ASC LIMIT ?)", (overflow,))
+                self._count -= overflow
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,222 @@
+# score_models.py
+"""颜值打分模型注册表: 每种模型结构声明自己的构造方式、本地权重文件、输入尺寸和输入归一化。
+
+FaceScorer 按名称 (config.SCORE_MODEL) 选用打分模型。设置了每张人脸的延迟预算
+(config.SCORE_MODEL_LATENCY_BUDGET_MS) 时，启动时在本机实测权重文件存在的各个模型，
+选出预算内质量最高的一个；全部超出预算时使用最快的。所有模型都只从本地权重文件加载，不访问网络。
+
+已注册:
+    cnn     CNNRegressionModel，128x128 输入，像素值 0~1 不做归一化 (beauty_cnn_model.pth 的训练方式)
+    resnet  ResNet-18 BeautyModel，224x224 输入，ImageNet 均值 / 标准差归一化。
+            回归头 (1 个输出) 直接输出分数；分类头 (例如 3 类) 输出各类概率对 score_range 内等距分数的期望
+
+用法:
+    python -m score_models list                 # 已注册的模型及权重文件是否存在
+    python -m score_models bench --budget 2.5   # 实测每张人脸的打分延迟，显示预算内会选中的模型
+"""
+import argparse
+import contextlib
+import os
+import statistics
+import sys
+import time
+
+import torch
+import torch.nn as nn
+
+import config
+import metrics
+from models import BeautyModel, CNNRegressionModel
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+class ScoreModelSpec:
+    """一种打分模型结构的声明。
+
+    build(outputs, pretrained=False) 创建未加载权重的模型，outputs 为输出头的维数 (由权重文件中 head 键的形状得到)。
+    weights_setting / int8_setting 是 config 中权重路径的变量名，运行时读取 (可被命令行或测试覆盖)。
+    mean / std 为 RGB 0~1 像素值的归一化参数，None 表示不归一化。quality 越大，延迟预算选择时越优先。
+    """
+
+    def __init__(self, name, build, weights_setting, input_size, head, mean=None, std=None,
+                 int8_setting=None, quality=0, score_range=(1.0, 5.0), description=""):
+        self.name = name
+        self.build = build
+        self.weights_setting = weights_setting
+        self.int8_setting = int8_setting
+        self.input_size = tuple(input_size) # (Height, Width)
+        self.head = head
+        self.mean = mean
+        self.std = std
+        self.quality = quality
+        self.score_range = score_range
+        self.description = description
+
+    @property
+    def weights_path(self):
+        return getattr(config, self.weights_setting)
+
+    @property
+    def int8_path(self):
+        """预先生成的 int8 权重路径，没有时为空字符串 (加载时现场量化)"""
+        return getattr(config, self.int8_setting) if self.int8_setting else ""
+
+    def outputs(self, state_dict):
+        return state_dict[self.head].shape[0]
+
+    def wrap(self, model, outputs):
+        """多输出 (分类头) 的模型包装为直接输出期望分数，与回归模型一样返回 [N,1]"""
+        if outputs == 1:
+            return model
+        return ExpectedScore(model, torch.linspace(*self.score_range, outputs))
+
+
+class ExpectedScore(nn.Module):
+    """分类头的输出经 softmax 后对各类对应的分数求期望"""
+
+    def __init__(self, model, values):
+        super().__init__()
+        self.model = model
+        self.register_buffer("values", values)
+
+    def forward(self, x):
+        probabilities = torch.softmax(self.model(x), dim=1)
+        return (probabilities * self.values.to(probabilities.dtype)).sum(dim=1, keepdim=True)
+
+
+# --- 1. 注册表 ---
+SCORE_MODELS = {}
+
+
+def register_score_model(spec):
+    SCORE_MODELS[spec.name] = spec
+    return spec
+
+
+def get_score_model(name):
+    if name not in SCORE_MODELS:
+        raise ValueError(f"未知的打分模型: {name} (可选: {', '.join(SCORE_MODELS)})")
+    return SCORE_MODELS[name]
+
+
+register_score_model(ScoreModelSpec(
+    "cnn", lambda outputs=1, pretrained=False: CNNRegressionModel(), "BEAUTY_MODEL_PATH",
+    config.SCORE_MODEL_INPUT_SIZE, head="fc2.weight", int8_setting="BEAUTY_MODEL_INT8_PATH", quality=0,
+    description="三层卷积 + 全连接回归 (CNNRegressionModel)"))
+register_score_model(ScoreModelSpec(
+    "resnet", lambda outputs=1, pretrained=False: BeautyModel(num_classes=outputs, pretrained=pretrained),
+    "BEAUTY_RESNET_MODEL_PATH", (224, 224), head="logit.weight", mean=IMAGENET_MEAN, std=IMAGENET_STD, quality=1,
+    description="ResNet-18 (BeautyModel)"))
+
+
+# --- 2. 延迟实测与按预算选择 ---
+def measure_latency(model, spec, device=None, dtype=torch.float32, batch_size=None, repeat=None):
+    """用 batch_size 张空白人脸实测前向耗时，返回每张人脸的毫秒数 (repeat 次的中位数，先空跑一次)"""
+    device = torch.device(device or config.DEVICE)
+    batch_size = batch_size or config.SCORE_MODEL_BENCH_BATCH
+    repeat = repeat or config.SCORE_MODEL_BENCH_REPEAT
+    batch = torch.zeros((batch_size, 3, *spec.input_size), device=device, dtype=dtype)
+    timings = []
+    with torch.no_grad():
+        model(batch)
+        for _ in range(repeat):
+            start = time.perf_counter()
+            model(batch)
+            if device.type == "cuda":
+                torch.cuda.synchronize(device)
+            timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000 / batch_size
+
+
+def choose(rows, budget_ms):
+    """rows 为实测结果 [{"name", "quality", "ms_per_face"}, ...]：返回预算内质量最高的模型名，全部超出时返回最快的"""
+    if not rows:
+        return None
+    fitting = [row for row in rows if row["ms_per_face"] <= budget_ms]
+    if fitting:
+        return max(fitting, key=lambda row: (row["quality"], -row["ms_per_face"]))["name"]
+    return min(rows, key=lambda row: row["ms_per_face"])["name"]
+
+
+def select_score_model(budget_ms, device=None, precision=None, threads=None):
+    """按质量从高到低加载并实测权重文件存在的打分模型，第一个不超出预算的即被选中 (之后的不再加载)。
+    返回 (模型名, 已加载的模型, 实测结果)；没有可加载的模型时模型名为 None。
+    threads 给出时按该线程数实测 (例如每个工作进程分到的线程数)，结束后恢复。"""
+    from scorer import load_beauty_model
+    from precision import input_dtype, resolve_precision
+    device = device or config.DEVICE
+    precision = resolve_precision(precision or config.SCORE_PRECISION, device)
+    previous_threads = torch.get_num_threads()
+    if threads:
+        torch.set_num_threads(threads)
+    rows, models = [], {}
+    try:
+        for spec in sorted(SCORE_MODELS.values(), key=lambda spec: -spec.quality):
+            if not os.path.exists(spec.weights_path):
+                continue
+            model = load_beauty_model(device=device, precision=precision, score_model=spec.name)
+            if model is None:
+                continue
+            latency = measure_latency(model, spec, device, input_dtype(precision))
+            rows.append({"name": spec.name, "quality": spec.quality, "ms_per_face": round(latency, 3)})
+            models[spec.name] = model
+            if latency <= budget_ms:
+                break
+    finally:
+        torch.set_num_threads(previous_threads)
+    name = choose(rows, budget_ms)
+    if name is None:
+        metrics.event("score_model_unavailable", "错误: 没有可加载的打分模型权重文件。", level="error")
+        return None, None, rows
+    measured = "，".join(f"{row['name']} {row['ms_per_face']:.2f}ms" for row in rows)
+    fits = next(row for row in rows if row["name"] == name)["ms_per_face"] <= budget_ms
+    metrics.event("score_model_selected",
+                  f"打分模型: {name} (每张人脸延迟预算 {budget_ms}ms，实测 {measured})"
+                  + ("" if fits else "，全部超出预算，使用最快的"),
+                  level="info" if fits else "warning", score_model=name, budget_ms=budget_ms, measured=rows)
+    return name, models[name], rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m score_models", description="颜值打分模型注册表")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="列出已注册的打分模型及其权重文件")
+    bench = sub.add_parser("bench", help="实测各打分模型每张人脸的延迟")
+    bench.add_argument("--budget", type=float, default=config.SCORE_MODEL_LATENCY_BUDGET_MS,
+                       help="每张人脸的延迟预算 (毫秒)，显示会选中的模型")
+    bench.add_argument("--precision", choices=["fp32", "int8", "bf16"], default=config.SCORE_PRECISION,
+                       help="打分精度 (默认 %(default)s)")
+    bench.add_argument("--batch", type=int, default=config.SCORE_MODEL_BENCH_BATCH, help="实测时的批大小 (默认 %(default)s)")
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        for spec in SCORE_MODELS.values():
+            height, width = spec.input_size
+            state = "存在" if os.path.exists(spec.weights_path) else "缺失"
+            normalize = "ImageNet 归一化" if spec.mean is not None else "不归一化"
+            print(f"{spec.name:<8} {spec.description}，输入 {height}x{width}，{normalize}，权重 {spec.weights_path} ({state})")
+        return 0
+
+    from scorer import load_beauty_model
+    from precision import input_dtype, resolve_precision
+    precision = resolve_precision(args.precision, config.DEVICE)
+    rows = []
+    for spec in SCORE_MODELS.values():
+        with contextlib.redirect_stdout(sys.stderr):
+            model = load_beauty_model(precision=precision, score_model=spec.name) \
+                if os.path.exists(spec.weights_path) else None
+        if model is None:
+            print(f"{spec.name:<8} 权重文件不可用 ({spec.weights_path})，跳过")
+            continue
+        latency = measure_latency(model, spec, dtype=input_dtype(precision), batch_size=args.batch)
+        rows.append({"name": spec.name, "quality": spec.quality, "ms_per_face": latency})
+        print(f"{spec.name:<8} {latency:.3f} ms/张人脸 (批大小 {args.batch}，{precision}，设备 {config.DEVICE})")
+    if args.budget is not None and rows:
+        print(f"延迟预算 {args.budget}ms → {choose(rows, args.budget)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,659 @@
+# scorer.py
+"""不依赖 Qt 的人脸检测 + 颜值打分引擎。
+
+模型只加载一次并常驻内存，既可供 GUI 的后台线程调用，
+也可在服务器 / 定时任务中批量处理成千上万张图片。
+"""
+import os
+import time
+import zipfile
+import numpy as np
+import cv2
+import torch
+
+# 从项目文件中导入
+import config # 导入配置
+import metrics # 结构化事件与运行指标
+from score_models import SCORE_MODELS, get_score_model, select_score_model # 打分模型注册表
+from image_io import (read_image_bytes, decode_image_bytes, decode_detection_proxy, make_detection_proxy,
+                      decode_within_budget, crop_faces, score_transform) # 单次解码的图片读取与预处理
+from tiling import tile_grid, touches_inner_edge, merge_tile_detections, tile_batch_bytes # 分块检测
+from precision import resolve_precision, apply_precision, input_dtype # fp32 / int8 / bf16 打分精度
+from backends import BACKENDS, resolve_yolo_path, load_beauty_backend # TorchScript / ONNX Runtime 导出引擎
+from result_cache import ResultCache, content_hash, model_fingerprint # 持久化结果缓存
+from autotune import apply_profile # 本机 CPU 推理调优配置
+
+# ultralytics / supervision 导入很慢，延迟到首次加载模型时再导入
+YOLO = None
+Detections = None
+
+# 启动耗时记录 (秒)，键: import_app / import_libs / resolve / load / warmup
+STARTUP_TIMINGS = {}
+
+
+def import_detection_libs():
+    """导入检测相关的库，成功返回 True (重复调用无额外开销)"""
+    global YOLO, Detections
+    if YOLO is not None and Detections is not None:
+        return True
+    try:
+        from ultralytics import YOLO as _YOLO
+        from supervision import Detections as _Detections
+    except ImportError as e:
+        metrics.event("import_failed", f"错误: 缺少必要的库: {e}. 请运行 'pip install ultralytics supervision'",
+                      level="error", error=str(e))
+        return False
+    YOLO, Detections = _YOLO, _Detections
+    return True
+
+
+def format_startup_report(timings=None):
+    """把启动耗时整理成多行文本"""
+    timings = STARTUP_TIMINGS if timings is None else timings
+    labels = [("import_app", "导入应用模块"), ("import_libs", "导入检测库"), ("resolve", "解析模型路径"),
+              ("load", "加载模型权重"), ("warmup", "模型预热"), ("window", "窗口显示")]
+    lines = ["启动耗时:"]
+    for key, label in labels:
+        if key in timings:
+            lines.append(f"  - {label}: {timings[key] * 1000:.0f} ms")
+    return "\n".join(lines)
+
+
+class JobCancelled(Exception):
+    """处理在阶段边界被取消 (参数为即将开始的阶段名)"""
+
+
+def _no_stage(name, percent):
+    pass
+
+
+# --- 1. 模型加载 ---
+def load_yolo_model(model_path=None):
+    """加载 YOLOv8 人脸检测模型，失败时返回 None"""
+    if not import_detection_libs(): # 仅在库成功导入时尝试加载
+        metrics.event("model_load_failed", "错误：ultralytics 或 supervision 库未安装，无法加载 YOLOv8 模型。",
+                      level="error", model="yolo", reason="missing_libs")
+        return None
+    model_path = model_path or config.resolve_yolo_model_path()
+    if not os.path.exists(model_path):
+        metrics.event("model_load_failed", f"错误：YOLOv8 模型文件未找到于 '{model_path}'",
+                      level="error", model="yolo", reason="not_found", path=model_path)
+        return None
+    try:
+        model = YOLO(model_path, task="detect") # 导出文件 (.torchscript / .onnx) 无法自动推断任务类型
+        metrics.event("model_loaded", "YOLOv8 人脸检测模型加载成功。", model="yolo", path=model_path)
+        return model
+    except Exception as e:
+        metrics.event("model_load_failed", f"加载 YOLOv8 模型 '{model_path}' 时出错: {e}", level="error",
+                      exc_info=True, model="yolo", reason="exception", path=model_path)
+        return None
+
+
+def load_beauty_weights(model_path, device, mmap=None, spec=None):
+    """按注册表中的声明 spec (默认 cnn) 创建打分模型并加载权重文件，输出头的维数由权重文件决定。
+
+    mmap=True (默认取 config.BEAUTY_WEIGHTS_MMAP) 且在 CPU 上运行时，权重文件按内存映射方式打开，
+    模型先在 meta 设备上创建 (不分配内存)，再用 assign=True 直接采用映射出来的张量作为参数:
+    参数页由页缓存提供，多个进程只读地共享同一份物理内存 (fc1 的 16384x512 矩阵占 32 MB)。
+    旧版 (非 zip) 格式的权重文件不能映射，按原方式加载。
+    """
+    mmap = config.BEAUTY_WEIGHTS_MMAP if mmap is None else mmap
+    spec = spec or SCORE_MODELS["cnn"]
+    if mmap and torch.device(device).type == "cpu" and zipfile.is_zipfile(model_path):
+        state_dict = torch.load(model_path, map_location="cpu", mmap=True, weights_only=True)
+        with torch.device("meta"):
+            model = spec.build(spec.outputs(state_dict))
+        model.load_state_dict(state_dict, assign=True)
+        return spec.wrap(model, spec.outputs(state_dict))
+    # 加载权重，映射到正确设备
+    state_dict = torch.load(model_path, map_location=device)
+    model = spec.build(spec.outputs(state_dict)) # 实例化模型类
+    model.load_state_dict(state_dict)
+    return spec.wrap(model, spec.outputs(state_dict))
+
+
+def load_beauty_model(model_path=None, device=None, precision=None, mmap=None, score_model=None):
+    """加载颜值打分模型 (score_model 为注册表中的名称，默认 config.SCORE_MODEL) 并转换为指定精度，失败时返回 None"""
+    spec = get_score_model(score_model or config.SCORE_MODEL)
+    model_path = model_path or spec.weights_path
+    device = device or config.DEVICE
+    precision = resolve_precision(precision or config.SCORE_PRECISION, device)
+    if not os.path.exists(model_path):
+        metrics.event("model_load_failed", f"错误：颜值打分模型文件未找到于 '{model_path}'",
+                      level="error", model="beauty", reason="not_found", path=model_path)
+        return None
+    try:
+        model = load_beauty_weights(model_path, device, mmap=mmap, spec=spec)
+        model.to(device) # 移动模型到设备
+        model.eval()     # 设置为评估模式
+        model = apply_precision(model, precision, source_path=model_path, artifact_path=spec.int8_path)
+        metrics.event("model_loaded", f"颜值打分模型 {spec.name} 从 '{model_path}' 加载成功 (精度: {precision})。",
+                      model="beauty", path=model_path, precision=precision, score_model=spec.name)
+        return model
+    except FileNotFoundError:
+        metrics.event("model_load_failed", f"错误：颜值打分模型文件未找到于 '{model_path}'",
+                      level="error", model="beauty", reason="not_found", path=model_path)
+    except Exception as e:
+        metrics.event("model_load_failed", f"加载颜值打分模型 '{model_path}' 时出错: {e}", level="error",
+                      exc_info=True, model="beauty", reason="exception", path=model_path)
+    return None
+
+
+# --- 2. 打分引擎 ---
+class FaceScorer:
+    """检测 → 裁剪 → 打分 的完整流程，模型在实例生命周期内常驻。
+
+    score_image() 返回一个可直接序列化为 JSON 的结果字典:
+        path     图片路径
+        status   "ok" / "no_face" / "error" / "cancelled"
+        score    置信度最高的人脸的颜值分数 (无结果时为 None)
+        faces    [{"box": [x_min, y_min, x_max, y_max], "confidence": float, "score": float}, ...]
+                 按检测置信度从高到低排列
+        message  供界面显示的状态信息
+        cached   结果是否来自结果缓存
+        content_hash / elapsed_ms / fingerprint  图片内容的 SHA-256、处理耗时和模型指纹 (写入结果文件时使用)
+    annotate=True 时额外带有 "image" 键 (绘制了所有人脸框和分数的 OpenCV 图像)。
+
+    lazy=True 时构造函数不加载模型，之后调用 load() (通常在后台线程中) 再加载。
+    给出 cache_path 时在模型加载后打开结果缓存，重复的图片 (按内容哈希) 不再运行模型。
+    detection_mode="tiled" 时按原始分辨率分块检测 (见 tiling.py)，参数默认取自 config.TILE_*。
+    score_model 选择注册表中的打分模型 (见 score_models.py)；未指定模型而设置了 latency_budget_ms
+    (默认 config.SCORE_MODEL_LATENCY_BUDGET_MS) 时，load() 实测各模型的每张人脸延迟后选用预算内最好的一个。
+    autotune=True (默认 config.AUTOTUNE_APPLY) 时第一次 load() 先应用本机调优配置 (见 autotune.py)；
+    自行设置线程数的多进程工作进程和调优测量子进程传入 False。
+    """
+
+    def __init__(self, yolo_model=None, beauty_model=None, device=None,
+                 max_faces=None, min_face_size=None, conf_threshold=None, lazy=False,
+                 cache_path=None, cache_max_entries=None, detection_mode=None,
+                 tile_size=None, tile_overlap=None, tile_batch=None, tile_memory_mb=None, precision=None,
+                 backend=None, score_model=None, latency_budget_ms=None, autotune=None):
+        self.device = device or config.DEVICE
+        self.precision = resolve_precision(precision or config.SCORE_PRECISION, self.device)
+        self.backend = backend or config.INFERENCE_BACKEND
+        if self.backend not in BACKENDS:
+            raise ValueError(f"未知的推理后端: {self.backend} (可选: {', '.join(BACKENDS)})")
+        # 两个模型实际使用的后端 (导出文件缺失时退回 eager)
+        self.backends_used = {"yolo": "eager" if yolo_model is not None else None,
+                              "beauty": "eager" if beauty_model is not None else None}
+        self.score_model = get_score_model(score_model or config.SCORE_MODEL)
+        if latency_budget_ms is None:
+            latency_budget_ms = config.SCORE_MODEL_LATENCY_BUDGET_MS
+        # 显式指定了打分模型 (或直接传入了模型) 时不按延迟预算选择
+        self.latency_budget_ms = None if score_model is not None or beauty_model is not None else latency_budget_ms
+        self.score_model_latency = [] # 按预算选择时各模型的实测延迟
+        self.detection_mode = detection_mode or config.DETECTION_MODE
+        if self.detection_mode not in ("single", "tiled"):
+            raise ValueError(f"未知的检测模式: {self.detection_mode}")
+        self.tile_size = tile_size or config.TILE_SIZE
+        self.tile_overlap = config.TILE_OVERLAP if tile_overlap is None else tile_overlap
+        self.tile_batch = tile_batch or config.TILE_BATCH
+        self.tile_memory_mb = tile_memory_mb or config.TILE_MEMORY_LIMIT_MB
+        if max_faces is None:
+            max_faces = config.TILE_MAX_FACES if self.detection_mode == "tiled" else config.MAX_FACES
+        self.max_faces = max_faces
+        self.min_face_size = config.MIN_FACE_SIZE if min_face_size is None else min_face_size
+        self.conf_threshold = config.DETECTION_CONF_THRESHOLD if conf_threshold is None else conf_threshold
+        self.yolo_image_size = config.YOLO_IMAGE_SIZE
+        # CPU 推理调优 (autotune=True 时由 autotune.apply_profile 在第一次 load() 开始时覆盖)
+        self.score_batch_size = config.SCORE_BATCH_SIZE
+        self.channels_last = config.CHANNELS_LAST
+        self.inference_mode = config.INFERENCE_MODE
+        self.autotune = config.AUTOTUNE_APPLY if autotune is None else autotune
+        self._autotuned = False
+        self.yolo_model = yolo_model
+        self.beauty_model = beauty_model
+        self.yolo_path = config.YOLO_MODEL_PATH
+        self.cache_path = cache_path
+        self.cache_max_entries = config.RESULT_CACHE_MAX_ENTRIES if cache_max_entries is None else cache_max_entries
+        self.cache = None
+        self._fingerprint = None
+        # 未显式传入模型时从配置路径加载
+        if not lazy:
+            self.load()
+
+    @property
+    def models_loaded(self):
+        """返回模型加载状态"""
+        return {"yolo": self.yolo_model is not None, "beauty": self.beauty_model is not None}
+
+    def load(self):
+        """加载尚未加载的模型，并把各步骤耗时记录到 STARTUP_TIMINGS"""
+        if self.autotune and not self._autotuned:
+            self._autotuned = True
+            apply_profile(self) # 线程数、内存布局等须在加载模型之前设置
+        if self.yolo_model is None or self.beauty_model is None:
+            metrics.event("device", f"使用的设备: {self.device}", device=str(self.device))
+        if self.yolo_model is None:
+            start = time.perf_counter()
+            import_detection_libs()
+            STARTUP_TIMINGS["import_libs"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            self.yolo_path = config.resolve_yolo_model_path()
+            STARTUP_TIMINGS["resolve"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            yolo_path, self.backends_used["yolo"] = resolve_yolo_path(self.yolo_path, self.backend)
+            self.yolo_model = load_yolo_model(yolo_path)
+            STARTUP_TIMINGS["load"] = time.perf_counter() - start
+        if self.beauty_model is None and self.latency_budget_ms is not None:
+            start = time.perf_counter()
+            name, self.beauty_model, self.score_model_latency = select_score_model(
+                self.latency_budget_ms, self.device, self.precision)
+            if name is not None:
+                self.score_model = SCORE_MODELS[name]
+            self.backends_used["beauty"] = "eager"
+            STARTUP_TIMINGS["load"] = STARTUP_TIMINGS.get("load", 0.0) + time.perf_counter() - start
+        if self.beauty_model is None:
+            start = time.perf_counter()
+            self.beauty_model = self._load_beauty_backend()
+            self.backends_used["beauty"] = self.backend if self.beauty_model is not None else "eager"
+            if self.beauty_model is None:
+                self.beauty_model = load_beauty_model(device=self.device, precision=self.precision,
+                                                      score_model=self.score_model.name)
+            STARTUP_TIMINGS["load"] = STARTUP_TIMINGS.get("load", 0.0) + time.perf_counter() - start
+        if self.channels_last:
+            self.use_channels_last()
+        self._fingerprint = None # 模型路径和实际使用的后端已确定，指纹需重新计算
+        if self.cache_path and self.cache is None and self.yolo_model is not None and self.beauty_model is not None:
+            self.cache = self.open_cache(self.cache_path)
+        for model, backend in self.backends_used.items():
+            if backend is not None:
+                metrics.set_info("model_backend", model=model, backend=backend)
+        metrics.set_info("score_precision", model="beauty", precision=self.precision)
+        metrics.set_info("score_model", model="beauty", score_model=self.score_model.name)
+        return self.models_loaded
+
+    def use_channels_last(self):
+        """把模型的卷积权重转换为 channels_last 布局。YOLO 只能在首次推理之后转换
+        (ultralytics 在首次推理时才融合卷积和 BN，融合会生成新的权重)，所以 warm_up() 之后还会再调用一次。"""
+        if isinstance(self.beauty_model, torch.nn.Module):
+            self.beauty_model.to(memory_format=torch.channels_last)
+        predictor = getattr(self.yolo_model, "predictor", None)
+        fused = getattr(getattr(predictor, "model", None), "model", None)
+        if isinstance(fused, torch.nn.Module):
+            fused.to(memory_format=torch.channels_last)
+
+    def _inference_context(self):
+        return torch.inference_mode() if self.inference_mode else torch.no_grad()
+
+    def _to_model_input(self, batch):
+        """把预处理好的批次移到设备上，转换为模型的输入精度 (和 channels_last 布局)"""
+        if self.channels_last and isinstance(self.beauty_model, torch.nn.Module):
+            return batch.to(self.device, dtype=input_dtype(self.precision), memory_format=torch.channels_last)
+        return batch.to(self.device, dtype=input_dtype(self.precision))
+
+    def _load_beauty_backend(self):
+        """按配置加载导出的颜值打分模型，不使用或不可用时返回 None"""
+        if self.backend == "eager":
+            return None
+        if self.score_model.name != "cnn":
+            metrics.event("backend_fallback", f"警告: 只有 cnn 打分模型支持 {self.backend} 导出，{self.score_model.name} 使用 eager PyTorch。",
+                          level="warning", model="beauty", backend=self.backend, score_model=self.score_model.name)
+            return None
+        if self.precision != "fp32":
+            metrics.event("backend_fallback", f"警告: {self.backend} 导出文件为 fp32，打分精度 {self.precision} 需使用 eager PyTorch。",
+                          level="warning", model="beauty", backend=self.backend, precision=self.precision)
+            return None
+        return load_beauty_backend(self.backend, self.device)
+
+    @property
+    def fingerprint(self):
+        """模型指纹: 覆盖两个模型文件的内容以及影响结果的筛选参数 (结果缓存和结果记录共用，首次访问时计算)"""
+        if self._fingerprint is None:
+            self._fingerprint = self._model_fingerprint()
+        return self._fingerprint
+
+    def _model_fingerprint(self):
+        extra = {"conf_threshold": self.conf_threshold, "min_face_size": self.min_face_size,
+                 "max_faces": self.max_faces, "yolo_image_size": self.yolo_image_size,
+                 "input_size": list(self.score_model.input_size)}
+        if self.score_model.name != "cnn": # cnn 保持原有指纹，已有的缓存结果继续有效
+            extra["score_model"] = self.score_model.name
+        if self.precision != "fp32": # 降低精度后分数略有差异，单独缓存
+            extra["precision"] = self.precision
+        if any(used not in (None, "eager") for used in self.backends_used.values()): # 导出引擎的数值误差同理
+            extra["backends"] = self.backends_used
+        if self.detection_mode == "tiled": # 整图模式保持原有指纹，已有的缓存结果继续有效
+            extra.update({"detection_mode": "tiled", "tile_size": self.tile_size, "tile_overlap": self.tile_overlap,
+                          "tile_nms": config.TILE_NMS_THRESHOLD, "tile_memory_mb": self.tile_memory_mb})
+        return model_fingerprint(self.yolo_path, self.score_model.weights_path, extra=extra)
+
+    def open_cache(self, cache_path):
+        """打开结果缓存，键中的模型指纹变化后旧结果自动失效"""
+        try:
+            return ResultCache(cache_path, self.fingerprint, max_entries=self.cache_max_entries)
+        except Exception as e:
+            metrics.event("cache_open_failed", f"无法打开结果缓存 '{cache_path}': {e}，将不使用缓存。",
+                          level="warning", path=cache_path, error=str(e))
+            return None
+
+    def warm_up(self):
+        """用真实输入尺寸各做一次空跑，让首张图片不再承担算子初始化和内存分配的开销"""
+        start = time.perf_counter()
+        if self.yolo_model is not None:
+            size = self.tile_size if self.detection_mode == "tiled" else self.yolo_image_size
+            dummy_image = np.zeros((size, size, 3), dtype=np.uint8)
+            self.yolo_model(dummy_image, imgsz=size, verbose=False)
+            if self.channels_last:
+                self.use_channels_last()
+        if self.beauty_model is not None:
+            height, width = self.score_model.input_size
+            with self._inference_context():
+                self.beauty_model(self._to_model_input(torch.zeros((1, 3, height, width))))
+        STARTUP_TIMINGS["warmup"] = time.perf_counter() - start
+
+    @staticmethod
+    def make_result(image_path, status, message, score=None, faces=None, cached=False):
+        return {"path": image_path, "status": status, "score": score,
+                "faces": faces or [], "message": message, "cached": cached}
+
+    @staticmethod
+    def _done_message(image_path, num_faces):
+        message = f"处理完成: {os.path.basename(image_path)}"
+        if num_faces > 1:
+            message += f" ({num_faces} 张人脸)"
+        return message
+
+    # --- 各处理阶段 (供 score_image 以及批量流水线复用) ---
+    def detect(self, image):
+        """人脸检测 (YOLOv8)，image 为 BGR numpy 数组，返回 supervision.Detections"""
+        if self.detection_mode == "tiled":
+            return self.detect_tiled(image)
+        return self.detect_batch([image])[0]
+
+    def detect_images(self, images):
+        """检测多张图片: 整图模式合并为一次 YOLO 调用，分块模式逐张分块检测"""
+        if self.detection_mode == "tiled":
+            return [self.detect_tiled(image) for image in images]
+        return self.detect_batch(images)
+
+    def detect_batch(self, images):
+        """一次 YOLO 调用检测多张图片，返回与 images 一一对应的 Detections 列表"""
+        # verbose=False 减少控制台输出；conf 让 YOLO 在 NMS 前就丢弃低置信度框
+        yolo_output = self.yolo_model(list(images), conf=self.conf_threshold, imgsz=self.yolo_image_size, verbose=False)
+        return [Detections.from_ultralytics(output) for output in yolo_output]
+
+    def tile_budget(self):
+        """分块模式的内存分配: 返回 (每批块数, 解码图像可用的字节数)，两者之和不超过 tile_memory_mb"""
+        limit = self.tile_memory_mb * 1024 * 1024
+        batch = self.tile_batch
+        # 一批块的预处理缓冲区最多占一半上限，放不下时减小批次
+        while batch > 1 and tile_batch_bytes(self.tile_size, batch) > limit // 2:
+            batch //= 2
+        return batch, max(limit - tile_batch_bytes(self.tile_size, batch), self.tile_size * self.tile_size * 3)
+
+    def detect_tiled(self, image):
+        """把图像切成重叠的块，按批送入 YOLO (输入尺寸 = 块大小，不再缩小)，坐标移回整图后跨块 NMS 合并"""
+        h_img, w_img = image.shape[:2]
+        batch, _ = self.tile_budget()
+        tiles = tile_grid(w_img, h_img, self.tile_size, self.tile_overlap)
+        boxes, confidences, on_edge = [], [], []
+        for start in range(0, len(tiles), batch):
+            chunk = tiles[start:start + batch]
+            # 块是原图缓冲区的切片视图，不复制
+            outputs = self.yolo_model([image[y0:y1, x0:x1] for x0, y0, x1, y1 in chunk],
+                                      conf=self.conf_threshold, imgsz=self.tile_size, verbose=False)
+            for tile, output in zip(chunk, outputs):
+                detections = Detections.from_ultralytics(output)
+                if len(detections) == 0:
+                    continue
+                local = detections.xyxy.astype(np.float32)
+                on_edge.append(touches_inner_edge(local, tile, (w_img, h_img)))
+                boxes.append(local + np.array([tile[0], tile[1], tile[0], tile[1]], dtype=np.float32))
+                confidences.append(detections.confidence if detections.confidence is not None
+                                   else np.ones(len(detections), dtype=np.float32))
+        if not boxes:
+            return Detections.empty()
+        xyxy = np.concatenate(boxes)
+        confidence = np.concatenate(confidences).astype(np.float32)
+        keep = merge_tile_detections(xyxy, confidence, np.concatenate(on_edge), config.TILE_NMS_THRESHOLD)
+        return Detections(xyxy=xyxy[keep], confidence=confidence[keep], class_id=np.zeros(len(keep), dtype=int))
+
+    def decode_for_detection(self, data, need_full=False):
+        """解码图片字节，返回 (检测输入, 裁剪用图像, 原图尺寸 (宽, 高))，失败时返回 (None, None, None)。
+
+        整图模式: 检测输入为缩小的代理图；裁剪用图像为 None 时表示尚未解码原图 (need_full=True 时总是解码)。
+        分块模式: 两者是同一张图，在内存上限内尽量保持原始分辨率。
+        """
+        if self.detection_mode == "tiled":
+            image, full_size = decode_within_budget(data, self.tile_budget()[1])
+            return image, image, full_size
+        if need_full:
+            cv_img = decode_image_bytes(data)
+            if cv_img is None:
+                return None, None, None
+            h_img, w_img = cv_img.shape[:2]
+            return make_detection_proxy(cv_img, self.yolo_image_size), cv_img, (w_img, h_img)
+        return decode_detection_proxy(data, self.yolo_image_size)
+
+    @staticmethod
+    def scale_boxes(boxes, from_size, to_size):
+        """把 from_size 坐标系下的框换算到 to_size (宽, 高)，尺寸相同时原样返回"""
+        if tuple(from_size) == tuple(to_size):
+            return boxes
+        sx, sy = to_size[0] / from_size[0], to_size[1] / from_size[1]
+        return [[int(x_min * sx), int(y_min * sy), int(x_max * sx), int(y_max * sy)]
+                for x_min, y_min, x_max, y_max in boxes]
+
+    def crop_selected(self, cv_img, selected, full_size):
+        """按原图坐标的人脸框从 cv_img 裁剪 (cv_img 因内存上限被缩小时按比例换算)"""
+        h_img, w_img = cv_img.shape[:2]
+        return crop_faces(cv_img, self.scale_boxes([box for box, _ in selected], full_size, (w_img, h_img)))
+
+    @staticmethod
+    def remap_detections(detections, proxy, full_size):
+        """把在缩小的代理图上得到的检测框按比例映射回原图坐标 (原地修改并返回)，full_size 为 (宽, 高)"""
+        h_proxy, w_proxy = proxy.shape[:2]
+        w_img, h_img = full_size
+        if (w_proxy, h_proxy) != (w_img, h_img) and len(detections) > 0:
+            scale = np.array([w_img / w_proxy, h_img / h_proxy] * 2, dtype=np.float32)
+            detections.xyxy = detections.xyxy * scale
+        return detections
+
+    def select_faces(self, detections, image_size):
+        """筛选需要打分的人脸: 裁剪到图像范围内，丢弃低置信度 / 过小的框，最多保留 max_faces 个。
+
+        image_size 为 (宽, 高)，返回 [(box, confidence), ...]，按置信度从高到低排列。
+        """
+        w_img, h_img = image_size
+        if detections.confidence is None:
+            confidences = [1.0] * len(detections)
+        else:
+            confidences = [float(c) for c in detections.confidence]
+
+        faces = []
+        for xyxy, confidence in sorted(zip(detections.xyxy, confidences), key=lambda item: -item[1]):
+            if confidence < self.conf_threshold:
+                continue
+            x_min, y_min, x_max, y_max = map(int, xyxy)
+            # 坐标有效性检查
+            x_min = max(0, x_min)
+            y_min = max(0, y_min)
+            x_max = min(w_img - 1, x_max)
+            y_max = min(h_img - 1, y_max)
+            if x_max - x_min < self.min_face_size or y_max - y_min < self.min_face_size:
+                continue
+            faces.append(([x_min, y_min, x_max, y_max], confidence))
+            if len(faces) >= self.max_faces:
+                break
+        return faces
+
+    def score_faces(self, face_crops):
+        """把人脸裁剪图 (BGR numpy) 组成 [N,3,H,W] 批次做前向计算，每批最多 score_batch_size 张"""
+        scores = []
+        for start in range(0, len(face_crops), self.score_batch_size):
+            batch = score_transform(face_crops[start:start + self.score_batch_size], self.score_model.input_size,
+                                    self.score_model.mean, self.score_model.std)
+            batch = self._to_model_input(batch)
+            with self._inference_context():
+                scores.extend(self.beauty_model(batch).float().view(-1).tolist())
+        return scores
+
+    @staticmethod
+    def draw_faces(cv_img, faces):
+        """在 OpenCV 图像上绘制所有人脸框及其分数"""
+        for face in faces:
+            x_min, y_min, x_max, y_max = face["box"]
+            cv2.rectangle(cv_img, (x_min, y_min), (x_max, y_max), (0, 255, 0), 2)
+            cv2.putText(cv_img, f"{face['score']:.2f}", (x_min, max(y_min - 6, 12)),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2, cv2.LINE_AA)
+        return cv_img
+
+    def score_decoded(self, image_path, cv_img, stage=None):
+        """对已解码的 BGR 图像执行 检测 → 筛选 → 裁剪 → 批量打分，不绘制人脸框。
+
+        stage(name, percent) 在每个阶段开始前调用，可抛出 JobCancelled 中止处理。
+        """
+        h_img, w_img = cv_img.shape[:2]
+        proxy = cv_img if self.detection_mode == "tiled" else make_detection_proxy(cv_img, self.yolo_image_size)
+        return self._score(image_path, proxy, (w_img, h_img), lambda: cv_img, stage or _no_stage)
+
+    def _score(self, image_path, proxy, full_size, full_image, stage):
+        """在代理图上检测，框映射回原图后从原图裁剪人脸打分。
+
+        full_image() 返回裁剪用图像，只在有人脸需要裁剪时调用 (JPEG 代理图由降采样解码得到时才真正解码原图)。
+        """
+        stage("detect", 30)
+        detections = self.remap_detections(self.detect(proxy), proxy, full_size)
+        selected = self.select_faces(detections, full_size)
+
+        no_face = self.no_face_result(image_path, detections, selected)
+        if no_face is not None:
+            return no_face
+
+        # 从原图裁剪所有人脸区域 (缓冲区视图) 并批量打分，打分输入不受检测代理图分辨率影响
+        stage("score", 75)
+        cv_img = full_image()
+        if cv_img is None:
+            raise ValueError("无法解码原图")
+        scores = self.score_faces(self.crop_selected(cv_img, selected, full_size))
+        return self.scored_result(image_path, selected, scores)
+
+    def no_face_result(self, image_path, detections, selected):
+        """没有可打分的人脸时返回对应的结果字典，否则返回 None"""
+        if len(detections) == 0:
+            return self.make_result(image_path, "no_face", "未检测到人脸")
+        if not selected:
+            return self.make_result(image_path, "no_face", "检测到的人脸过小或置信度过低")
+        return None
+
+    def unreadable_result(self, image_path):
+        return self.make_result(image_path, "error", f"错误: 无法读取图片 {os.path.basename(image_path)}")
+
+    def error_result(self, image_path, error):
+        return self.make_result(image_path, "error", f"错误: 处理失败 - {error}")
+
+    def scored_result(self, image_path, selected, scores):
+        """把 select_faces() 的结果和对应分数组装成结果字典"""
+        faces = [{"box": box, "confidence": confidence, "score": score}
+                 for (box, confidence), score in zip(selected, scores)]
+        return self.make_result(image_path, "ok", self._done_message(image_path, len(faces)),
+                                score=faces[0]["score"], faces=faces)
+
+    def cached_result(self, image_path, cached):
+        """把结果缓存中的记录还原为结果字典"""
+        message = cached["message"]
+        if cached["status"] == "ok":
+            message = self._done_message(image_path, len(cached["faces"])) + " (缓存)"
+        return self.make_result(image_path, cached["status"], message,
+                                score=cached["score"], faces=cached["faces"], cached=True)
+
+    def score_image(self, image_path, annotate=False, progress=None, should_cancel=None):
+        """对单张图片执行检测和打分，任何错误都记录在结果中而不会抛出。
+
+        progress(stage, percent) 在每个阶段开始时回调 (stage 为 read/decode/detect/score/draw)；
+        should_cancel() 在阶段之间检查，返回 True 时放弃处理并返回 status 为 "cancelled" 的结果。
+        各阶段耗时、人脸数和缓存命中记录到 metrics。
+        """
+        clock = metrics.stage_clock()
+
+        def stage(name, percent):
+            if should_cancel is not None and should_cancel():
+                raise JobCancelled(name)
+            clock.mark(name)
+            if progress is not None:
+                progress(name, percent)
+
+        # 检查模型是否已加载
+        if self.yolo_model is None:
+            return self.make_result(image_path, "error", "错误: YOLO 模型未加载")
+        if self.beauty_model is None:
+            return self.make_result(image_path, "error", "错误: 颜值打分模型未加载")
+        if Detections is None:
+            return self.make_result(image_path, "error", "错误: supervision 库不可用")
+
+        cv_img = None # 初始化以防早期错误
+        full_size = None
+        digest = None
+        result = None
+        started = time.perf_counter()
+        try:
+            # 1. 读取图片字节，先查结果缓存 (命中时不运行模型)
+            stage("read", 5)
+            data = read_image_bytes(image_path)
+            # 内容哈希既是缓存的键，也写入结果记录 (断点续跑、追溯结果对应的图片内容)
+            digest = content_hash(data) if data is not None else None
+            cache_key = digest if self.cache is not None else None
+            cached = self.cache.get(cache_key) if cache_key else None
+            if cache_key:
+                metrics.increment("cache_lookups_total", result="miss" if cached is None else "hit")
+
+            # 原图最多解码一次，裁剪、打分、显示共用这块缓冲区；只在需要时才解码
+            def full_image():
+                nonlocal cv_img, full_size
+                if cv_img is None:
+                    if self.detection_mode == "tiled": # 分块模式下显示用的图同样受内存上限约束
+                        cv_img, full_size = decode_within_budget(data, self.tile_budget()[1])
+                    else:
+                        cv_img = decode_image_bytes(data)
+                return cv_img
+
+            # 2+3. 检测用缩小的代理图 (JPEG 直接降采样解码)，有人脸时才解码原图裁剪打分；或直接使用缓存结果
+            if cached is not None:
+                result = self.cached_result(image_path, cached)
+            else:
+                stage("decode", 15)
+                proxy, cv_img, full_size = self.decode_for_detection(data) if data is not None else (None, None, None)
+                if proxy is None:
+                    return self.unreadable_result(image_path)
+                with metrics.profiled("score_image"):
+                    result = self._score(image_path, proxy, full_size, full_image, stage)
+                metrics.observe("faces_per_image", len(result["faces"]))
+                proxy = None # 代理图不再需要，先释放再解码显示用的原图
+                if cache_key:
+                    self.cache.put(cache_key, result)
+
+            # 4. 在原图缓冲区上绘制所有人脸框 (裁剪图已在打分前缩放复制，不受影响)
+            if annotate and full_image() is not None:
+                stage("draw", 95)
+                faces = result["faces"]
+                if full_size is not None and (cv_img.shape[1], cv_img.shape[0]) != tuple(full_size):
+                    # 分块模式超出内存上限时显示的是缩小后的图，框按比例换算
+                    boxes = self.scale_boxes([face["box"] for face in faces], full_size, (cv_img.shape[1], cv_img.shape[0]))
+                    faces = [dict(face, box=box) for face, box in zip(faces, boxes)]
+                self.draw_faces(cv_img, faces)
+
+        except JobCancelled as cancelled:
+            result = self.make_result(image_path, "cancelled", f"已取消: {os.path.basename(image_path)}")
+            metrics.event("job_cancelled", f"已在 {cancelled} 阶段前取消处理 {image_path}",
+                          path=image_path, stage=str(cancelled))
+        except Exception as e:
+            metrics.event("job_failed", f"处理 {image_path} 时发生错误: {e}", level="error", exc_info=True,
+                          path=image_path, error=str(e))
+            result = self.error_result(image_path, e)
+
+        clock.stop()
+        elapsed = time.perf_counter() - started
+        metrics.observe("job_seconds", elapsed, status=result["status"])
+        metrics.increment("images_total", status=result["status"], cached=result["cached"])
+        result.update(content_hash=digest, elapsed_ms=round(elapsed * 1000, 1), fingerprint=self.fingerprint)
+        if annotate:
+            result["image"] = cv_img
+        return result
+
+    def score_paths(self, image_paths, annotate=False):
+        """依次处理多张图片，逐个产出结果 (生成器，便于流式写出)"""
+        for image_path in image_paths:
+            yield self.score_image(image_path, annotate=annotate)
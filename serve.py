@@ -0,0 +1,439 @@
+# serve.py
+"""本地 HTTP 打分服务: 上传图片或给出本机路径，返回每张人脸的框和分数 (JSON)。
+
+并发到达的请求由 MicroBatcher 合并: 第一张图片到达后最多等待 max_wait_ms，或凑满 max_batch 张，
+然后一次 YOLO 调用检测整批图片，再把所有人脸裁剪合并为一次 CNNRegressionModel 调用。
+图片在请求线程中读取和解码 (cv2 解码不占用 GIL)，批处理线程只跑模型。
+已接收未完成的图片数超过 max_queue 时直接返回 503 (Retry-After)，不再读取路径和解码，内存占用有上限；
+单个请求的图片数本身超过 max_queue 时返回 413 (重试也不会成功)。
+
+用法:
+    python -m serve                                   # 监听 127.0.0.1:8765
+    python -m serve --max-batch 16 --max-wait-ms 20 --max-queue 64 --allow-paths ~/photos
+
+    curl --data-binary @a.jpg -H "Content-Type: image/jpeg" http://127.0.0.1:8765/score
+    curl -F image=@a.jpg -F image=@b.jpg http://127.0.0.1:8765/score
+    curl -d '{"paths": ["/home/me/photos/a.jpg"]}' -H "Content-Type: application/json" http://127.0.0.1:8765/score
+    curl http://127.0.0.1:8765/health
+    curl http://127.0.0.1:8765/metrics                # Prometheus 文本格式
+
+/score 总是返回 {"results": [...]}，每项与 batch_score 输出的结果相同，另有 batch_size (所在模型批次的图片数)
+和 queue_ms (等待凑批的时间)。按路径打分默认关闭，需用 --allow-paths 指定允许读取的目录。
+"""
+import argparse
+import collections
+import contextlib
+import email.parser
+import email.policy
+import ipaddress
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import config
+import metrics
+from image_io import read_image_bytes
+from result_cache import content_hash
+from score_models import SCORE_MODELS
+from sinks import serializable
+
+
+class Overloaded(Exception):
+    """未完成的图片数已达上限，请求被拒绝 (HTTP 503)"""
+
+
+# --- 1. 动态微批 ---
+class MicroBatcher:
+    """把并发提交的条目合并成批，交给 process_batch(items) -> results 处理 (单个后台线程)。
+
+    admit(n) 在请求开始时预留名额，未完成的条目 (解码中、排队中、处理中) 不超过 max_queue；超出时抛出 Overloaded。
+    提交的条目在处理完成 (Future 完成) 时归还名额，请求超时返回后仍在排队或处理的条目继续占用名额；
+    没有提交的条目 (缓存命中、无法读取) 由请求线程调用 release(n) 归还。
+    """
+
+    def __init__(self, process_batch, max_batch=8, max_wait=0.01, max_queue=32):
+        self.process_batch = process_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self._queue = collections.deque() # (到达时间, 条目, Future)
+        self._cond = threading.Condition()
+        self._admitted = 0
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="serve-batcher", daemon=True)
+        self._thread.start()
+
+    def admit(self, count):
+        with self._cond:
+            if self._stopped or self._admitted + count > self.max_queue:
+                metrics.increment("serve_shed_total", count)
+                raise Overloaded(f"队列已满 ({self._admitted}/{self.max_queue})")
+            self._admitted += count
+
+    def release(self, count):
+        with self._cond:
+            self._admitted -= count
+
+    def pending(self):
+        """(已接收未完成的图片数, 排队等待批处理的图片数)"""
+        with self._cond:
+            return self._admitted, len(self._queue)
+
+    def submit(self, items):
+        """提交一组条目，返回对应的 Future 列表 (每个 Future 完成时归还一个名额)"""
+        futures = [Future() for _ in items]
+        for future in futures:
+            future.add_done_callback(lambda _: self.release(1))
+        now = time.perf_counter()
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("服务正在关闭")
+            self._queue.extend((now, item, future) for item, future in zip(items, futures))
+            self._cond.notify()
+        return futures
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue and not self._stopped:
+                self._cond.wait()
+            if not self._queue:
+                return None
+            # 等待时间从最早的条目到达时算起，排在后面的条目不会延长它的等待
+            deadline = self._queue[0][0] + self.max_wait
+            while len(self._queue) < self.max_batch and not self._stopped:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return [self._queue.popleft() for _ in range(min(self.max_batch, len(self._queue)))]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            started = time.perf_counter()
+            for arrived, _, _ in batch:
+                metrics.observe("serve_queue_seconds", started - arrived)
+            metrics.observe("serve_batch_size", len(batch))
+            try:
+                with metrics.timed("serve_batch_seconds"):
+                    results = self.process_batch([item for _, item, _ in batch])
+            except Exception as e:
+                metrics.event("batch_failed", f"批处理 {len(batch)} 张图片时发生错误: {e}", level="error",
+                              exc_info=True, stage="serve", images=len(batch), error=str(e))
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (arrived, _, future), result in zip(batch, results):
+                future.set_result(dict(result, batch_size=len(batch), queue_ms=round((started - arrived) * 1000, 2)))
+
+
+# --- 2. 打分 ---
+class BatchScorer:
+    """用一个常驻的 FaceScorer 处理一批已解码的图片 (与流水线的检测 / 打分阶段相同)"""
+
+    def __init__(self, face_scorer):
+        self.face_scorer = face_scorer
+
+    def finish(self, result, digest, started):
+        """补上 score_image 写入结果的字段: 内容哈希、处理耗时 (从请求线程开始处理该图片算起) 和模型指纹"""
+        result.update(content_hash=digest, elapsed_ms=round((time.perf_counter() - started) * 1000, 1),
+                      fingerprint=self.face_scorer.fingerprint)
+        return result
+
+    def prepare(self, name, data):
+        """在请求线程中查缓存并解码，返回 (结果, None) 或 (None, 待批处理条目)"""
+        face_scorer = self.face_scorer
+        started = time.perf_counter()
+        if isinstance(data, bytes):
+            data = np.frombuffer(data, dtype=np.uint8) if data else None # 与 read_image_bytes 的返回值一致，不复制
+        if data is None:
+            return self.finish(face_scorer.unreadable_result(name), None, started), None
+        digest = content_hash(data)
+        cache_key = digest if face_scorer.cache is not None else None
+        cached = face_scorer.cache.get(cache_key) if cache_key else None
+        if cache_key:
+            metrics.increment("cache_lookups_total", result="miss" if cached is None else "hit")
+        if cached is not None:
+            return self.finish(face_scorer.cached_result(name, cached), digest, started), None
+        proxy, cv_img, full_size = face_scorer.decode_for_detection(data, need_full=True)
+        if proxy is None:
+            return self.finish(face_scorer.unreadable_result(name), digest, started), None
+        return None, (name, proxy, cv_img, full_size, digest, started)
+
+    def __call__(self, items):
+        face_scorer = self.face_scorer
+        results = [None] * len(items)
+        to_score = [] # (下标, 人脸框, 裁剪数)
+        crops = []
+        all_detections = face_scorer.detect_images([proxy for _, proxy, _, _, _, _ in items])
+        for index, ((name, proxy, cv_img, full_size, _, _), detections) in enumerate(zip(items, all_detections)):
+            detections = face_scorer.remap_detections(detections, proxy, full_size)
+            selected = face_scorer.select_faces(detections, full_size)
+            no_face = face_scorer.no_face_result(name, detections, selected)
+            if no_face is not None:
+                results[index] = no_face
+                continue
+            face_crops = face_scorer.crop_selected(cv_img, selected, full_size)
+            to_score.append((index, selected, len(face_crops)))
+            crops.extend(face_crops)
+        # 整批图片的所有人脸一起打分 (score_faces 内部按 score_batch_size 分块)
+        scores = face_scorer.score_faces(crops) if crops else []
+        offset = 0
+        for index, selected, count in to_score:
+            results[index] = face_scorer.scored_result(items[index][0], selected, scores[offset:offset + count])
+            offset += count
+        for (_, _, _, _, digest, started), result in zip(items, results):
+            if face_scorer.cache is not None:
+                face_scorer.cache.put(digest, result)
+            metrics.observe("faces_per_image", len(result["faces"]))
+            metrics.increment("images_total", status=result["status"], cached=False)
+            self.finish(result, digest, started)
+        return results
+
+
+# --- 3. HTTP ---
+def parse_multipart(body, content_type):
+    """解析 multipart/form-data: 带文件名的部分视为上传的图片，名为 path 的字段视为路径。返回 (uploads, paths)"""
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body)
+    uploads, paths = [], []
+    for part in message.iter_parts():
+        filename = part.get_filename()
+        if filename is not None:
+            uploads.append((filename, part.get_payload(decode=True)))
+        elif part.get_param("name", header="content-disposition") == "path":
+            paths.append(part.get_content().strip())
+    return uploads, paths
+
+
+class RequestError(Exception):
+    """请求本身有误，args 为 (HTTP 状态码, 信息)"""
+
+
+class ScoringRequestHandler(BaseHTTPRequestHandler):
+    server_version = "FaceRater/1.0"
+    protocol_version = "HTTP/1.1" # 支持 keep-alive，压测客户端可复用连接
+
+    def log_message(self, format, *args):
+        pass # 每个请求都输出一行会淹没其他诊断信息；请求数和状态码见 /metrics 的 serve_requests_total
+
+    def _send(self, status, body, content_type="application/json; charset=utf-8", headers=None):
+        data = body if isinstance(body, bytes) else json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+        metrics.increment("serve_requests_total", path=self.path.split("?")[0], code=status)
+
+    def do_GET(self):
+        server = self.server
+        if self.path == "/health":
+            admitted, queued = server.batcher.pending()
+            self._send(200, {"status": "ok", "models": server.face_scorer.models_loaded,
+                             "backends": server.face_scorer.backends_used, "detection_mode": server.face_scorer.detection_mode,
+                             "in_flight": admitted, "queued": queued, "max_queue": server.batcher.max_queue,
+                             "max_batch": server.batcher.max_batch, "max_wait_ms": server.batcher.max_wait * 1000})
+        elif self.path == "/metrics":
+            self._send(200, metrics.to_prometheus().encode("utf-8"), content_type="text/plain; version=0.0.4")
+        else:
+            self._send(404, {"error": f"未知的路径: {self.path}"})
+
+    def do_POST(self):
+        if self.path.split("?")[0] != "/score":
+            self._send(404, {"error": f"未知的路径: {self.path}"})
+            return
+        started = time.perf_counter()
+        try:
+            status, body, headers = 200, {"results": self._score()}, None
+        except RequestError as e:
+            status, body, headers = e.args[0], {"error": e.args[1]}, None
+        except Overloaded as e:
+            status, body, headers = 503, {"error": f"服务繁忙: {e}"}, {"Retry-After": "1"}
+        except FutureTimeout:
+            status, body, headers = 504, {"error": "处理超时"}, None
+        except Exception as e:
+            metrics.event("serve_request_failed", f"处理请求时发生错误: {e}", level="error", exc_info=True, error=str(e))
+            status, body, headers = 500, {"error": f"处理失败: {e}"}, None
+        metrics.observe("serve_request_seconds", time.perf_counter() - started, code=status)
+        self._send(status, body, headers=headers)
+
+    def _read_body(self):
+        if "chunked" in self.headers.get("Transfer-Encoding", "").lower():
+            raise RequestError(411, "需要 Content-Length (不支持分块传输)")
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0:
+            raise RequestError(400, "请求体为空")
+        if length > self.server.max_upload_bytes:
+            raise RequestError(413, f"请求体超过 {self.server.max_upload_bytes // (1024 * 1024)} MB")
+        return self.rfile.read(length)
+
+    def _parse(self):
+        """返回 [(名称, 上传的图片字节或要读取的本机路径), ...]；路径在这里只做检查，名额预留之后才读取"""
+        content_type = self.headers.get("Content-Type", "application/octet-stream")
+        body = self._read_body()
+        uploads, paths = [], []
+        if content_type.startswith("application/json"):
+            try:
+                request = json.loads(body)
+            except ValueError as e:
+                raise RequestError(400, f"JSON 无效: {e}")
+            if not isinstance(request, dict):
+                raise RequestError(400, "JSON 请求体应为对象: {\"path\": ...} 或 {\"paths\": [...]}")
+            paths = request.get("paths") or ([request["path"]] if request.get("path") else [])
+            if not isinstance(paths, list) or not all(isinstance(path, str) for path in paths):
+                raise RequestError(400, "paths 应为字符串列表")
+        elif content_type.startswith("multipart/form-data"):
+            uploads, paths = parse_multipart(body, content_type)
+        else:
+            uploads = [(self.headers.get("X-Filename", "upload"), body)]
+        if not uploads and not paths:
+            raise RequestError(400, "请求中没有图片或路径")
+        return uploads + [(path, self._resolve_path(path)) for path in paths]
+
+    def _resolve_path(self, path):
+        """检查路径在允许的目录内且文件存在，返回实际路径"""
+        root = self.server.path_root
+        if root is None:
+            raise RequestError(403, "服务未允许按路径打分 (启动时使用 --allow-paths 指定目录)")
+        real = os.path.realpath(os.path.expanduser(path))
+        if os.path.commonpath([real, root]) != root:
+            raise RequestError(403, f"路径不在允许的目录 {root} 内: {path}")
+        if not os.path.isfile(real):
+            raise RequestError(404, f"文件不存在: {path}")
+        return real
+
+    def _score(self):
+        server = self.server
+        items = self._parse()
+        if len(items) > server.batcher.max_queue:
+            raise RequestError(413, f"一次请求最多 {server.batcher.max_queue} 张图片 (收到 {len(items)} 张)，请分成多个请求")
+        server.batcher.admit(len(items)) # 超出上限时在读取路径和解码之前就拒绝
+        unsubmitted = len(items) # 提交后的条目在处理完成时由 MicroBatcher 归还名额
+        try:
+            results = [None] * len(items)
+            pending = []
+            for index, (name, data) in enumerate(items):
+                if isinstance(data, str): # 按路径打分: 预留名额之后才读取，一次只持有一张图片的字节
+                    data = read_image_bytes(data)
+                result, item = server.scorer.prepare(name, data)
+                if item is None:
+                    results[index] = result
+                else:
+                    pending.append((index, item))
+            items = None # 原始字节已解码，尽早释放
+            futures = server.batcher.submit([item for _, item in pending])
+            unsubmitted -= len(futures)
+            pending = [index for index, _ in pending] # 解码后的图像由批处理线程持有，请求线程不再引用
+            deadline = time.perf_counter() + server.request_timeout
+            for index, future in zip(pending, futures):
+                results[index] = future.result(timeout=max(0.0, deadline - time.perf_counter()))
+        finally:
+            server.batcher.release(unsubmitted)
+        return [serializable(result) for result in results]
+
+
+class ScoringServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, face_scorer, max_batch=None, max_wait_ms=None, max_queue=None,
+                 max_upload_mb=None, request_timeout=None, path_root=None):
+        super().__init__(address, ScoringRequestHandler)
+        self.face_scorer = face_scorer
+        self.scorer = BatchScorer(face_scorer)
+        self.batcher = MicroBatcher(self.scorer, max_batch=max_batch or config.SERVE_MAX_BATCH,
+                                    max_wait=(config.SERVE_MAX_WAIT_MS if max_wait_ms is None else max_wait_ms) / 1000,
+                                    max_queue=max_queue or config.SERVE_MAX_QUEUE)
+        self.max_upload_bytes = (max_upload_mb or config.SERVE_MAX_UPLOAD_MB) * 1024 * 1024
+        self.request_timeout = request_timeout or config.SERVE_REQUEST_TIMEOUT
+        self.path_root = os.path.realpath(os.path.expanduser(path_root)) if path_root else None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def server_close(self):
+        super().server_close()
+        self.batcher.stop()
+
+
+def is_loopback(host):
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == "localhost"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m serve", description="本地 HTTP 人脸检测与颜值打分服务")
+    parser.add_argument("--host", default=config.SERVE_HOST, help="监听地址 (默认 %(default)s，只接受本机请求)")
+    parser.add_argument("--port", type=int, default=config.SERVE_PORT, help="端口 (默认 %(default)s，0 表示随机)")
+    parser.add_argument("--max-batch", type=int, default=config.SERVE_MAX_BATCH, help="每批最多图片数 (默认 %(default)s)")
+    parser.add_argument("--max-wait-ms", type=float, default=config.SERVE_MAX_WAIT_MS,
+                        help="第一张图片到达后最多等待多久凑批 (默认 %(default)s ms)")
+    parser.add_argument("--max-queue", type=int, default=config.SERVE_MAX_QUEUE,
+                        help="已接收未完成的图片数上限，超出返回 503 (默认 %(default)s)")
+    parser.add_argument("--max-upload-mb", type=int, default=config.SERVE_MAX_UPLOAD_MB, help="请求体大小上限 (默认 %(default)s MB)")
+    parser.add_argument("--timeout", type=float, default=config.SERVE_REQUEST_TIMEOUT, help="等待结果的超时秒数 (默认 %(default)s)")
+    parser.add_argument("--allow-paths", metavar="DIR", help="允许按路径打分，路径必须位于该目录内")
+    parser.add_argument("--allow-remote", action="store_true", help="允许监听非本机地址 (服务没有认证，谨慎使用)")
+    parser.add_argument("--cache", default=config.RESULT_CACHE_PATH if config.RESULT_CACHE_ENABLED else None,
+                        help="结果缓存数据库路径 (默认使用 config.RESULT_CACHE_PATH)")
+    parser.add_argument("--no-cache", dest="cache", action="store_const", const=None, help="不使用结果缓存")
+    parser.add_argument("--detection", choices=["single", "tiled"], default=config.DETECTION_MODE, help="检测模式")
+    parser.add_argument("--backend", choices=["eager", "torchscript", "onnx"], default=config.INFERENCE_BACKEND, help="推理后端")
+    parser.add_argument("--score-model", choices=sorted(SCORE_MODELS), help=f"打分模型 (默认 {config.SCORE_MODEL})，见 python -m score_models list")
+    parser.add_argument("--latency-budget", metavar="MS", type=float, default=config.SCORE_MODEL_LATENCY_BUDGET_MS,
+                        help="每张人脸的打分延迟预算 (毫秒)，启动时实测后选用预算内最好的打分模型")
+    args = parser.parse_args(argv)
+
+    if not is_loopback(args.host) and not args.allow_remote:
+        print(f"错误: {args.host} 不是本机地址；服务没有认证，如确需对外监听请加 --allow-remote。", file=sys.stderr)
+        return 2
+
+    with contextlib.redirect_stdout(sys.stderr):
+        from scorer import FaceScorer
+        face_scorer = FaceScorer(cache_path=args.cache, detection_mode=args.detection, backend=args.backend,
+                                 score_model=args.score_model, latency_budget_ms=args.latency_budget)
+        face_scorer.warm_up()
+    if not all(face_scorer.models_loaded.values()):
+        print("错误: 模型加载失败，无法启动服务。", file=sys.stderr)
+        return 1
+
+    server = ScoringServer((args.host, args.port), face_scorer, max_batch=args.max_batch, max_wait_ms=args.max_wait_ms,
+                           max_queue=args.max_queue, max_upload_mb=args.max_upload_mb, request_timeout=args.timeout,
+                           path_root=args.allow_paths)
+    metrics.event("serve_started", f"打分服务已启动: {server.url} (每批最多 {args.max_batch} 张，最多等待 {args.max_wait_ms} ms，"
+                  f"队列上限 {args.max_queue})", url=server.url)
+    # SIGTERM (服务管理器停止服务) 与 Ctrl+C 一样正常退出；shutdown() 会等待 serve_forever 返回，需在其他线程调用
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        metrics.event("serve_stopped", "打分服务已停止。")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
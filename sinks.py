@@ -0,0 +1,236 @@
+# sinks.py
+"""批量打分结果的流式写出 (JSONL / CSV)，每条结果写完立即刷新。
+
+CheckpointedSink 在此之上按块提交: 可同时把每块结果写成一个 Parquet 分片，并用检查点支持断点续跑 (见 checkpoint.py)。
+"""
+import csv
+import glob
+import json
+import os
+import sys
+
+import config
+import metrics
+from checkpoint import Checkpoint, checkpoint_path
+
+CSV_FIELDS = ["path", "status", "score", "num_faces", "boxes", "face_scores", "message", "dedup_of"]
+
+
+def serializable(result):
+    """去掉结果中不可序列化的字段 (例如标注后的图像)"""
+    return {k: v for k, v in result.items() if k != "image"}
+
+
+class JsonlSink:
+    """每行一个 JSON 对象"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, result):
+        self.stream.write(json.dumps(serializable(result), ensure_ascii=False) + "\n")
+        self.stream.flush()
+
+    def close(self):
+        self.stream.flush()
+        if self.stream is not sys.stdout:
+            self.stream.close()
+
+
+class CsvSink:
+    """CSV 格式，人脸框和各人脸分数以 JSON 字符串存放在单元格中"""
+
+    def __init__(self, stream, header=True):
+        self.stream = stream
+        self.writer = csv.DictWriter(stream, fieldnames=CSV_FIELDS)
+        if header: # 断点续跑追加写入时文件里已有表头
+            self.writer.writeheader()
+
+    def write(self, result):
+        faces = result.get("faces", [])
+        self.writer.writerow({
+            "path": result["path"],
+            "status": result["status"],
+            "score": "" if result["score"] is None else f"{result['score']:.4f}",
+            "num_faces": len(faces),
+            "boxes": json.dumps([face["box"] for face in faces]),
+            "face_scores": json.dumps([round(face["score"], 4) for face in faces]),
+            "message": result.get("message", ""),
+            "dedup_of": result.get("dedup_of", ""),
+        })
+        self.stream.flush()
+
+    def close(self):
+        self.stream.flush()
+        if self.stream is not sys.stdout:
+            self.stream.close()
+
+
+SINKS = {"jsonl": JsonlSink, "csv": CsvSink}
+
+
+def open_sink(fmt, output_path=None):
+    """按格式创建结果写出器，output_path 为空时写到标准输出"""
+    if fmt not in SINKS:
+        raise ValueError(f"不支持的输出格式: {fmt} (可选: {', '.join(SINKS)})")
+    if output_path:
+        stream = open(output_path, "w", encoding="utf-8", newline="")
+    else:
+        stream = sys.stdout
+    return SINKS[fmt](stream)
+
+
+def import_pyarrow():
+    """导入 pyarrow (Parquet 输出的可选依赖)，缺失时返回 None"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        metrics.event("import_failed", "错误: 缺少 pyarrow，无法输出 Parquet。请运行 'pip install pyarrow'",
+                      level="error", module="pyarrow")
+        return None
+    return pyarrow
+
+
+class ParquetParts:
+    """把结果按块写成 Parquet 分片 part-000000.parquet, part-000001.parquet, ... (每个分片一个行组)。
+
+    分片先写临时文件再改名，目录里不会出现写了一半的文件；整个目录可直接作为一个数据集读取
+    (pyarrow.dataset / pandas.read_parquet / DuckDB)。
+    """
+
+    def __init__(self, directory, pyarrow):
+        self.directory = directory
+        self.pa = pyarrow
+        self.schema = pyarrow.schema([
+            ("path", pyarrow.string()), ("status", pyarrow.string()), ("content_hash", pyarrow.string()),
+            ("score", pyarrow.float64()), ("num_faces", pyarrow.int32()),
+            ("boxes", pyarrow.list_(pyarrow.list_(pyarrow.int32()))), ("confidences", pyarrow.list_(pyarrow.float64())),
+            ("face_scores", pyarrow.list_(pyarrow.float64())), ("elapsed_ms", pyarrow.float64()),
+            ("fingerprint", pyarrow.string()), ("cached", pyarrow.bool_()), ("dedup_of", pyarrow.string()),
+            ("message", pyarrow.string())])
+        os.makedirs(directory, exist_ok=True)
+
+    def part_path(self, number):
+        return os.path.join(self.directory, f"part-{number:06d}.parquet")
+
+    def write_part(self, number, results):
+        columns = {name: [] for name in self.schema.names}
+        for result in results:
+            faces = result.get("faces", [])
+            columns["boxes"].append([face["box"] for face in faces])
+            columns["confidences"].append([face["confidence"] for face in faces])
+            columns["face_scores"].append([face["score"] for face in faces])
+            columns["num_faces"].append(len(faces))
+            for name in ("path", "status", "content_hash", "score", "elapsed_ms", "fingerprint", "cached",
+                         "dedup_of", "message"):
+                columns[name].append(result.get(name))
+        table = self.pa.Table.from_pydict(columns, schema=self.schema)
+        path = self.part_path(number)
+        self.pa.parquet.write_table(table, path + ".tmp", row_group_size=len(results))
+        os.replace(path + ".tmp", path)
+        return path
+
+    def discard_from(self, number):
+        """删除编号不小于 number 的分片 (上次中断时写出但未提交的)，以及残留的临时文件"""
+        for path in glob.glob(os.path.join(self.directory, "part-*.parquet*")):
+            name = os.path.basename(path)
+            if name.endswith(".tmp") or int(name[len("part-"):len("part-") + 6]) >= number:
+                os.remove(path)
+
+
+class CheckpointedSink:
+    """按块提交的结果写出: 每条结果立即写进 JSONL / CSV，每 chunk_size 条提交一次。
+
+    提交时先把输出文件刷到磁盘、把这一块写成一个 Parquet 分片 (给出 parquet_dir 时)，
+    再在检查点中登记这些图片和输出文件的长度 (resume=True 时)。内存中最多暂存一块结果。
+    resume=True 时追加写入: 输出文件截断到上次提交的位置，未提交的分片删除，已登记的图片由 pending() 跳过；
+    输出文件非空却没有检查点记录的提交位置 (例如不带 --resume 写出的结果)，或比记录的位置短 (被改写过) 时
+    抛出 ValueError，不截断。否则从头写，旧的检查点和分片一并清除。
+    """
+
+    def __init__(self, fmt, output_path=None, parquet_dir=None, chunk_size=None, resume=False, pyarrow=None):
+        if fmt not in SINKS:
+            raise ValueError(f"不支持的输出格式: {fmt} (可选: {', '.join(SINKS)})")
+        if resume and not output_path:
+            raise ValueError("断点续跑需要指定输出文件 (-o)")
+        self.chunk_size = max(1, chunk_size or config.RESUME_CHUNK_SIZE)
+        self.pending = []
+        self.checkpoint = None
+        self.next_part = 0
+        offset = 0
+        if output_path:
+            ckpt_path = checkpoint_path(output_path)
+            if not resume and os.path.exists(ckpt_path):
+                os.remove(ckpt_path) # 结果文件将被重写，旧的检查点不再对应
+            if resume:
+                existing = os.path.getsize(output_path) if os.path.exists(output_path) else 0
+                recorded = None
+                if os.path.exists(ckpt_path):
+                    self.checkpoint = Checkpoint(ckpt_path)
+                    recorded = self.checkpoint.get_state("offset")
+                # 只截断检查点登记过的输出文件，其他内容不属于这次续跑，不能丢弃
+                if existing and (recorded is None or existing < recorded):
+                    if self.checkpoint is not None:
+                        self.checkpoint.close()
+                    if recorded is None:
+                        raise ValueError(f"输出文件 {output_path} 已存在但没有续跑检查点 ({ckpt_path})，"
+                                         "续跑会覆盖其中的结果；请换一个输出文件或先删除它")
+                    raise ValueError(f"输出文件 {output_path} 比检查点记录的短 ({existing} < {recorded} 字节)，"
+                                     f"已被改写过；请换一个输出文件，或删除它和 {ckpt_path} 后重新运行")
+                if self.checkpoint is None:
+                    self.checkpoint = Checkpoint(ckpt_path)
+                offset = recorded or 0
+                self.next_part = self.checkpoint.get_state("next_part", 0)
+                if not existing and offset: # 输出文件已被删除，检查点作废
+                    metrics.event("checkpoint_reset", f"警告: {output_path} 已不存在，将从头重新处理。",
+                                  level="warning", path=output_path)
+                    self.checkpoint.reset()
+                    offset = self.next_part = 0
+                elif existing > offset:
+                    metrics.event("checkpoint_truncate", f"丢弃 {output_path} 末尾 {existing - offset} 字节未提交的结果。",
+                                  path=output_path, dropped_bytes=existing - offset)
+            stream = open(output_path, "a+" if resume else "w", encoding="utf-8", newline="")
+            stream.truncate(offset)
+        else:
+            stream = sys.stdout
+        self.stream = stream
+        self.sink = CsvSink(stream, header=offset == 0) if fmt == "csv" else SINKS[fmt](stream)
+        self.parts = None
+        if parquet_dir:
+            pyarrow = pyarrow or import_pyarrow()
+            if pyarrow is None:
+                raise ImportError("Parquet 输出需要 pyarrow")
+            self.parts = ParquetParts(parquet_dir, pyarrow)
+            self.parts.discard_from(self.next_part)
+
+    def pending_paths(self, image_paths):
+        """resume=True 时跳过已提交的图片"""
+        return self.checkpoint.pending(image_paths) if self.checkpoint is not None else image_paths
+
+    def write(self, result):
+        self.sink.write(result)
+        self.pending.append(serializable(result))
+        if len(self.pending) >= self.chunk_size:
+            self.commit()
+
+    def commit(self):
+        if not self.pending:
+            return
+        if self.stream is not sys.stdout:
+            os.fsync(self.stream.fileno()) # 每条结果写完已刷新，这里确保落盘后再登记
+        if self.parts is not None:
+            self.parts.write_part(self.next_part, self.pending)
+            self.next_part += 1
+        if self.checkpoint is not None:
+            self.checkpoint.commit([(result["path"], result.get("content_hash"), result["status"]) for result in self.pending],
+                                   offset=os.fstat(self.stream.fileno()).st_size, next_part=self.next_part)
+        self.pending = []
+
+    def close(self):
+        try:
+            self.commit()
+        finally:
+            self.sink.close()
+            if self.checkpoint is not None:
+                self.checkpoint.close()
@@ -0,0 +1,70 @@
+# tiling.py
+"""分块检测的几何计算: 切块、块内坐标换算和跨块 NMS (纯 numpy，不依赖模型)。
+
+大合影里的人脸可能只有几十个像素，整图缩小到 YOLO 输入尺寸后就检测不到了。
+分块模式按原始分辨率把图像切成互相重叠的小块，每块单独检测；
+一张人脸如果被块边界切开，会在相邻块中完整出现 (重叠区域大于人脸时)，
+合并时优先保留没有贴着块内部边界的框。
+"""
+import numpy as np
+
+
+def _tile_origins(length, tile_size, stride):
+    """一个方向上各块的起点，最后一块与图像边缘对齐，保证完整覆盖"""
+    if length <= tile_size:
+        return [0]
+    origins = list(range(0, length - tile_size, stride))
+    origins.append(length - tile_size)
+    return origins
+
+
+def tile_grid(width, height, tile_size, overlap):
+    """返回覆盖整张图像的块 [(x0, y0, x1, y1), ...]，相邻块重叠 overlap (0~1) 比例"""
+    stride = max(1, int(tile_size * (1.0 - overlap)))
+    return [(x0, y0, min(x0 + tile_size, width), min(y0 + tile_size, height))
+            for y0 in _tile_origins(height, tile_size, stride)
+            for x0 in _tile_origins(width, tile_size, stride)]
+
+
+def touches_inner_edge(xyxy, tile, image_size, margin=2):
+    """块内检测框 (块坐标) 是否贴着块的内部边界 (不是图像边缘的那几条边)，这样的框可能是被切开的人脸"""
+    x0, y0, x1, y1 = tile
+    width, height = image_size
+    tile_w, tile_h = x1 - x0, y1 - y0
+    touches = np.zeros(len(xyxy), dtype=bool)
+    if x0 > 0:
+        touches |= xyxy[:, 0] <= margin
+    if y0 > 0:
+        touches |= xyxy[:, 1] <= margin
+    if x1 < width:
+        touches |= xyxy[:, 2] >= tile_w - margin
+    if y1 < height:
+        touches |= xyxy[:, 3] >= tile_h - margin
+    return touches
+
+
+def merge_tile_detections(xyxy, confidence, on_edge, threshold):
+    """跨块 NMS: 按 (不贴内部边界优先, 置信度从高到低) 排序后贪心保留。
+
+    重叠度用 交集 / 较小框面积: 被切开的半张脸完全落在完整的人脸框内，IoU 可能很低，但这个比例接近 1。
+    返回保留下来的下标 (按保留顺序)。
+    """
+    if len(xyxy) == 0:
+        return np.empty(0, dtype=np.int64)
+    areas = np.maximum(xyxy[:, 2] - xyxy[:, 0], 0) * np.maximum(xyxy[:, 3] - xyxy[:, 1], 0)
+    order = np.lexsort((-confidence, on_edge)) # 最后一个键为主键
+    keep = []
+    while order.size > 0:
+        best = order[0]
+        keep.append(best)
+        rest = order[1:]
+        inter_w = np.clip(np.minimum(xyxy[best, 2], xyxy[rest, 2]) - np.maximum(xyxy[best, 0], xyxy[rest, 0]), 0, None)
+        inter_h = np.clip(np.minimum(xyxy[best, 3], xyxy[rest, 3]) - np.maximum(xyxy[best, 1], xyxy[rest, 1]), 0, None)
+        smaller = np.maximum(np.minimum(areas[best], areas[rest]), 1e-6)
+        order = rest[inter_w * inter_h / smaller <= threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+def tile_batch_bytes(tile_size, batch):
+    """一批块在 YOLO 预处理中的大致内存: uint8 副本 + float32 输入张量"""
+    return batch * tile_size * tile_size * 3 * (1 + 4)
@@ -0,0 +1,208 @@
+# train.py
+"""在人脸裁剪数据集 (python -m face_dataset build 生成) 上训练和评估颜值打分模型。
+
+数据从内存映射的 uint8 数组按批读取，多个 DataLoader 工作进程并行取数据，
+转换为模型输入时使用与打分相同的 batch_to_tensor，每个 epoch 的耗时主要花在模型计算上。
+每个 epoch 输出训练 / 验证的 MAE、RMSE、皮尔逊相关系数以及等待数据的时间占比 (接近 0 说明瓶颈在模型计算)。
+
+用法:
+    python -m train fit datasets/train -o beauty_cnn_model.finetuned.pth --epochs 20
+    python -m train fit datasets/train --init beauty_cnn_model.pth --lr 1e-4 --epochs 5   # 在现有权重上微调
+    python -m train fit datasets/train224 --val datasets/test224 --model resnet --pretrained -o beauty_resnet_model.pth
+    python -m train evaluate datasets/test --weights beauty_cnn_model.pth
+
+模型结构、输入尺寸和输入归一化取自打分模型注册表 (score_models.py)，训练与打分的预处理一致；
+数据集的裁剪尺寸必须与模型的输入尺寸相同 (python -m face_dataset build --score-model)。
+"""
+import argparse
+import math
+import sys
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+import config
+import metrics
+from face_dataset import FaceCropDataset, split_indices
+from image_io import batch_to_tensor
+from score_models import SCORE_MODELS, ExpectedScore
+
+
+def make_loader(dataset, batch_size, shuffle=False, workers=0, seed=0):
+    return torch.utils.data.DataLoader(
+        dataset, batch_size=batch_size, shuffle=shuffle, num_workers=workers,
+        persistent_workers=workers > 0, pin_memory=torch.cuda.is_available(),
+        generator=torch.Generator().manual_seed(seed))
+
+
+def regression_report(predictions, targets):
+    """MAE / RMSE / 皮尔逊相关系数"""
+    errors = predictions - targets
+    pearson = float(np.corrcoef(predictions, targets)[0, 1]) if len(targets) > 1 and np.std(predictions) > 0 else 0.0
+    return {"mae": float(np.mean(np.abs(errors))), "rmse": float(math.sqrt(np.mean(errors ** 2))), "pearson": pearson}
+
+
+def run_epoch(model, spec, loader, device, optimizer=None, flip=False):
+    """跑一遍 loader: 给出 optimizer 时训练，否则只评估。返回误差指标、耗时和等待数据的时间"""
+    training = optimizer is not None
+    model.train(training)
+    predictions, targets = [], []
+    total_loss = 0.0
+    data_seconds = 0.0
+    start = time.perf_counter()
+    waiting_since = start
+    for pixels, scores in loader:
+        data_seconds += time.perf_counter() - waiting_since
+        inputs = batch_to_tensor(pixels, spec.mean, spec.std)
+        if flip: # 随机水平翻转，人脸左右对称，分数不变
+            mask = torch.rand(len(inputs)) < 0.5
+            inputs[mask] = inputs[mask].flip(3)
+        inputs = inputs.to(device, non_blocking=True)
+        scores = scores.to(device, non_blocking=True)
+        with torch.set_grad_enabled(training):
+            outputs = model(inputs).view(-1)
+            loss = F.mse_loss(outputs, scores)
+        if training:
+            optimizer.zero_grad(set_to_none=True)
+            loss.backward()
+            optimizer.step()
+        total_loss += loss.item() * len(scores)
+        predictions.append(outputs.detach().float().cpu().numpy())
+        targets.append(scores.cpu().numpy())
+        waiting_since = time.perf_counter()
+    seconds = time.perf_counter() - start
+    predictions = np.concatenate(predictions) if predictions else np.zeros(0, dtype=np.float32)
+    targets = np.concatenate(targets) if targets else np.zeros(0, dtype=np.float32)
+    report = regression_report(predictions, targets) if len(targets) else {"mae": 0.0, "rmse": 0.0, "pearson": 0.0}
+    report.update({"loss": total_loss / max(1, len(targets)), "faces": len(targets), "seconds": seconds,
+                   "faces_per_sec": len(targets) / seconds if seconds > 0 else 0.0,
+                   "data_wait": data_seconds / seconds if seconds > 0 else 0.0})
+    return report
+
+
+def build_model(spec, init=None, device=None, pretrained=False):
+    """创建模型，给出 init 时加载该权重文件 (分类头的权重包装为输出期望分数，只能评估不能按回归训练)"""
+    device = device or config.DEVICE
+    if not init:
+        return spec.build(1, pretrained=pretrained).to(device)
+    state_dict = torch.load(init, map_location="cpu", weights_only=True)
+    model = spec.build(spec.outputs(state_dict))
+    model.load_state_dict(state_dict)
+    return spec.wrap(model, spec.outputs(state_dict)).to(device)
+
+
+def check_input_size(spec, *datasets):
+    """数据集的裁剪尺寸与模型输入尺寸不同时返回错误信息"""
+    for dataset in datasets:
+        if dataset is not None and (dataset.meta["height"], dataset.meta["width"]) != spec.input_size:
+            return (f"数据集 {dataset.directory} 的裁剪尺寸为 {dataset.meta['height']}x{dataset.meta['width']}，"
+                    f"{spec.name} 模型需要 {spec.input_size[0]}x{spec.input_size[1]}，"
+                    f"请用 python -m face_dataset build --score-model {spec.name} 重新生成。")
+    return None
+
+
+def format_report(name, report):
+    return (f"{name}: MAE {report['mae']:.4f}，RMSE {report['rmse']:.4f}，r {report['pearson']:.4f}，"
+            f"{report['faces_per_sec']:.0f} 张/秒，等待数据 {report['data_wait'] * 100:.0f}%")
+
+
+def fit(args):
+    device = config.DEVICE
+    if args.val:
+        train_set, val_set = FaceCropDataset(args.dataset), FaceCropDataset(args.val)
+    else:
+        count = FaceCropDataset(args.dataset).meta["count"]
+        train_rows, val_rows = split_indices(count, args.val_split, args.seed)
+        train_set = FaceCropDataset(args.dataset, train_rows)
+        val_set = FaceCropDataset(args.dataset, val_rows) if len(val_rows) else None
+    if len(train_set) == 0:
+        print("错误: 训练集为空。", file=sys.stderr)
+        return 1
+    spec = SCORE_MODELS[args.model]
+    error = check_input_size(spec, train_set, val_set)
+    if error:
+        print(f"错误: {error}", file=sys.stderr)
+        return 1
+    torch.manual_seed(args.seed)
+    model = build_model(spec, args.init, device, pretrained=args.pretrained)
+    if isinstance(model, ExpectedScore):
+        print("错误: --init 权重是分类头，只能用 evaluate 评估，不能按回归训练。", file=sys.stderr)
+        return 1
+    optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr, weight_decay=args.weight_decay)
+    schedule = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=max(1, args.epochs))
+    train_loader = make_loader(train_set, args.batch_size, shuffle=True, workers=args.workers, seed=args.seed)
+    val_loader = make_loader(val_set, args.batch_size, workers=args.workers) if val_set is not None else None
+    print(f"训练 {args.model}: 训练集 {len(train_set)} 张，验证集 {len(val_set) if val_set is not None else 0} 张，"
+          f"设备 {device}，{args.workers} 个数据加载进程", file=sys.stderr)
+
+    best = None
+    for epoch in range(1, args.epochs + 1):
+        train_report = run_epoch(model, spec, train_loader, device, optimizer, flip=not args.no_flip)
+        schedule.step()
+        val_report = run_epoch(model, spec, val_loader, device) if val_loader is not None else None
+        message = f"epoch {epoch}/{args.epochs} 损失 {train_report['loss']:.4f}，{format_report('训练', train_report)}"
+        if val_report is not None:
+            message += f"；{format_report('验证', val_report)}"
+        metrics.event("train_epoch", message, epoch=epoch, train_loss=round(train_report["loss"], 5),
+                      train_mae=round(train_report["mae"], 5),
+                      val_mae=round(val_report["mae"], 5) if val_report is not None else None,
+                      seconds=round(train_report["seconds"], 2), data_wait=round(train_report["data_wait"], 3))
+        # 按验证集 MAE 保存最好的权重 (没有验证集时保存最后一个 epoch)
+        score = val_report["mae"] if val_report is not None else -epoch
+        if best is None or score < best:
+            best = score
+            torch.save(model.state_dict(), args.output)
+    print(f"权重已保存到 {args.output}" + (f" (验证集最佳 MAE {best:.4f})" if val_loader is not None else ""),
+          file=sys.stderr)
+    return 0
+
+
+def evaluate(args):
+    dataset = FaceCropDataset(args.dataset)
+    if len(dataset) == 0:
+        print("错误: 数据集为空。", file=sys.stderr)
+        return 1
+    spec = SCORE_MODELS[args.model]
+    error = check_input_size(spec, dataset)
+    if error:
+        print(f"错误: {error}", file=sys.stderr)
+        return 1
+    model = build_model(spec, args.weights or spec.weights_path)
+    report = run_epoch(model, spec, make_loader(dataset, args.batch_size, workers=args.workers), config.DEVICE)
+    print(format_report(f"{args.dataset} ({len(dataset)} 张)", report))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m train", description="训练 / 评估颜值打分模型")
+    sub = parser.add_subparsers(dest="command", required=True)
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("dataset", help="人脸裁剪数据集目录 (python -m face_dataset build 生成)")
+    common.add_argument("--model", choices=sorted(SCORE_MODELS), default=config.SCORE_MODEL,
+                        help="打分模型结构 (默认 %(default)s)")
+    common.add_argument("--batch-size", type=int, default=64, help="批大小 (默认 %(default)s)")
+    common.add_argument("--workers", type=int, default=2, help="DataLoader 工作进程数 (默认 %(default)s)")
+
+    fit_parser = sub.add_parser("fit", parents=[common], help="训练并保存验证集上最好的权重")
+    fit_parser.add_argument("-o", "--output", required=True, help="权重输出路径 (state_dict)")
+    fit_parser.add_argument("--init", help="从已有权重开始微调")
+    fit_parser.add_argument("--pretrained", action="store_true",
+                            help="resnet 从 ImageNet 预训练权重开始 (需要联网下载一次，打分时不需要)")
+    fit_parser.add_argument("--val", help="单独的验证集目录；省略时从训练集中划出 --val-split")
+    fit_parser.add_argument("--val-split", type=float, default=0.1, help="验证集比例 (默认 %(default)s)")
+    fit_parser.add_argument("--epochs", type=int, default=20, help="训练轮数 (默认 %(default)s)")
+    fit_parser.add_argument("--lr", type=float, default=1e-3, help="初始学习率 (默认 %(default)s，余弦衰减)")
+    fit_parser.add_argument("--weight-decay", type=float, default=1e-4, help="权重衰减 (默认 %(default)s)")
+    fit_parser.add_argument("--no-flip", action="store_true", help="不做随机水平翻转")
+    fit_parser.add_argument("--seed", type=int, default=0, help="随机种子 (划分验证集和打乱顺序)")
+
+    eval_parser = sub.add_parser("evaluate", parents=[common], help="计算 MAE / RMSE / 皮尔逊相关系数")
+    eval_parser.add_argument("--weights", help="权重文件 (默认为该打分模型在 config.py 中配置的权重)")
+    args = parser.parse_args(argv)
+    return fit(args) if args.command == "fit" else evaluate(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
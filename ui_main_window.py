@@ -3,30 +3,53 @@ import os
 import sys
 from PyQt5.QtWidgets import (QWidget, QLabel, QPushButton, QVBoxLayout, QHBoxLayout,
                              QFileDialog, QMessageBox, QApplication, QFrame,
-                             QSpacerItem, QSizePolicy, QProgressBar, QStatusBar, QMainWindow)
+                             QSpacerItem, QSizePolicy, QProgressBar, QStatusBar, QMainWindow,
+                             QSplitter, QComboBox)
 from PyQt5.QtGui import QPixmap, QIcon, QFont
 from PyQt5.QtCore import Qt, QSize, QTimer
 
 # --- 导入代码 ---
 try:
     import config
-    from processing import ProcessingThread, get_model_load_status
+    import metrics
+    from processing import InferenceWorker, get_model_load_status
+    from scorer import format_startup_report
     from utils import cv_image_to_qpixmap
+    from image_io import iter_image_paths
+    from gallery import ThumbnailLoader, GalleryModel, GalleryProxyModel, PathRole, create_gallery_view
 except ImportError as e:
     print("导入错误: {}. 请确保 config.py, processing.py, utils.py 在正确的位置。".format(e))
     # --- 模拟类和函数 ---
     class MockConfig:
         WINDOW_WIDTH = 600; WINDOW_HEIGHT = 650; IMAGE_MIN_WIDTH = 550; IMAGE_MIN_HEIGHT = 450; DEVICE = "cpu"
+        SUPPORTED_FORMATS = ('.png', '.jpg', '.jpeg', '.bmp')
+        THUMBNAIL_SIZE = 96; THUMBNAIL_CACHE_SIZE = 300; GALLERY_MIN_WIDTH = 260
     config = MockConfig()
     def get_model_load_status(): return {"yolo": False, "beauty": False}
-    class ProcessingThread:
-        finished = type('MockSignal', (object,), {'connect': lambda self, slot: None, 'disconnect': lambda self, slot: None})() # 模拟信号
-        def __init__(self, path): pass
-        def start(self): print("[Mock] ProcessingThread started.")
+    class MockSignal:
+        def __init__(self): self.slot = lambda *args: None
+        def connect(self, slot): self.slot = slot
+    class InferenceWorker:
+        def __init__(self):
+            self.models_ready, self.job_started, self.job_progress, self.job_finished, self.queue_changed = (MockSignal() for _ in range(5)) # 模拟信号
+        def start(self): self.models_ready.slot({"yolo": False, "beauty": False})
+        def submit(self, path, annotate=True): print("[Mock] 任务已忽略: {}".format(path))
+        def cancel(self, job_id=None): pass
+        def pending_count(self): return 0
+        current_job = None
+        def stop(self): pass
         def isRunning(self): return False
-        def requestInterruption(self): pass
         def wait(self, timeout=0): return True
+    def format_startup_report(): return "启动耗时: 不可用"
     def cv_image_to_qpixmap(img, size): return None, "工具函数未加载"
+    def iter_image_paths(inputs, recursive=False): return [p for p in inputs if p.lower().endswith(config.SUPPORTED_FORMATS)]
+    ThumbnailLoader = None # 画廊不可用
+    class MockMetrics:
+        @staticmethod
+        def event(name, message=None, level="info", **fields): print(message or name)
+        @staticmethod
+        def summary(name, **labels): return None
+    metrics = MockMetrics()
     print("警告：正在使用模拟的配置、处理和工具函数。")
 # --- 导入代码结束 ---
 
@@ -35,14 +58,13 @@ class FaceScoringApp(QMainWindow):
     def __init__(self):
         super().__init__()
         self.image_path = None
-        self.processing_thread = None
+        self.worker = None
+        self.preview_path = None # 当前在大图区域显示的画廊图片
+        self.displayed_cv_img = None # 当前显示的标注结果，窗口缩放时按新尺寸重新显示
         self.model_status = get_model_load_status()
-        self.progress_timer = QTimer(self)
-        self.progress_timer.timeout.connect(self.update_fake_progress)
-        self.progress_value = 0
         self.initUI()
         self.applyStyles()
-        self.check_model_status_on_init()
+        self.startModelLoading()
 
     def initUI(self):
         self.setWindowTitle('颜值打分系统 Pro')
@@ -50,10 +72,13 @@ class FaceScoringApp(QMainWindow):
         try:
             self.setWindowIcon(QIcon.fromTheme("face-smile", QIcon("icon.png")))
         except Exception as icon_e:
-             print("警告：无法加载窗口图标: {}".format(icon_e))
+             metrics.event("icon_failed", "警告：无法加载窗口图标: {}".format(icon_e), level="warning")
 
+        # 左侧为原有的大图 / 分数 / 按钮区域，右侧为结果画廊
+        splitter = QSplitter(Qt.Horizontal)
+        self.setCentralWidget(splitter)
         central_widget = QWidget()
-        self.setCentralWidget(central_widget)
+        splitter.addWidget(central_widget)
         main_layout = QVBoxLayout(central_widget)
 
         # --- 图片显示标签 ---
@@ -96,18 +121,58 @@ class FaceScoringApp(QMainWindow):
             self.uploadButton.setIcon(QIcon.fromTheme("document-open", QIcon("upload_icon.png")))
             self.uploadButton.setIconSize(QSize(24, 24))
         except Exception as icon_e:
-            print("警告：无法加载上传按钮图标: {}".format(icon_e))
+            metrics.event("icon_failed", "警告：无法加载上传按钮图标: {}".format(icon_e), level="warning")
         self.uploadButton.setCursor(Qt.PointingHandCursor)
         self.uploadButton.clicked.connect(self.startProcessing)
-        control_layout.addWidget(self.uploadButton)
+        self.folderButton = QPushButton(" 添加文件夹")
+        self.folderButton.setCursor(Qt.PointingHandCursor)
+        self.folderButton.clicked.connect(self.addFolder)
+        self.cancelButton = QPushButton(" 取消")
+        self.cancelButton.setObjectName("cancelButton")
+        self.cancelButton.setCursor(Qt.PointingHandCursor)
+        self.cancelButton.clicked.connect(self.cancelProcessing)
+        self.cancelButton.setVisible(False)
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(self.uploadButton, 1)
+        button_layout.addWidget(self.folderButton)
+        button_layout.addWidget(self.cancelButton)
+        control_layout.addLayout(button_layout)
         main_layout.addWidget(control_frame)
 
+        # --- 结果画廊 ---
+        self.gallery = None
+        if ThumbnailLoader is not None:
+            gallery_widget = QWidget()
+            gallery_layout = QVBoxLayout(gallery_widget)
+            self.sortCombo = QComboBox()
+            self.sortCombo.addItems([name for name, _, _ in GalleryProxyModel.SORT_MODES])
+            gallery_layout.addWidget(self.sortCombo)
+            self.thumbnailLoader = ThumbnailLoader()
+            self.thumbnailLoader.preview_ready.connect(self.onPreviewReady)
+            self.thumbnailLoader.start()
+            self.gallery = GalleryModel(self.thumbnailLoader, self)
+            self.galleryProxy = GalleryProxyModel(self)
+            self.galleryProxy.setSourceModel(self.gallery)
+            self.sortCombo.currentIndexChanged.connect(self.galleryProxy.setSortMode)
+            self.galleryView = create_gallery_view()
+            self.galleryView.setModel(self.galleryProxy)
+            self.galleryView.clicked.connect(self.onGalleryClicked)
+            gallery_layout.addWidget(self.galleryView, 1)
+            splitter.addWidget(gallery_widget)
+            splitter.setStretchFactor(0, 3)
+            splitter.setStretchFactor(1, 1)
+            self.resize(self.width() + config.GALLERY_MIN_WIDTH, self.height())
+
         # --- 状态栏 ---
         self.statusBar = QStatusBar()
         self.setStatusBar(self.statusBar)
         self.statusLabel = QLabel("就绪")
         self.fileNameLabel = QLabel("")
+        self.queueLabel = QLabel("")
+        self.latencyLabel = QLabel("") # 上一个任务的实测耗时，悬停显示最近任务的分位数
         self.statusBar.addPermanentWidget(self.fileNameLabel, 1)
+        self.statusBar.addPermanentWidget(self.queueLabel)
+        self.statusBar.addPermanentWidget(self.latencyLabel)
         self.statusBar.addPermanentWidget(self.statusLabel)
 
     def applyStyles(self):
@@ -164,6 +229,12 @@ class FaceScoringApp(QMainWindow):
             QPushButton:pressed {
                 background-color: #509aed;
             }
+            QPushButton#cancelButton {
+                background-color: #e06c75;
+            }
+            QPushButton#cancelButton:hover {
+                background-color: #f07c85;
+            }
             QPushButton:disabled {
                 background-color: #5c6370;
                 color: #40454e;
@@ -182,6 +253,21 @@ class FaceScoringApp(QMainWindow):
                 background-color: qlineargradient(x1:0, y1:0, x2:1, y2:0, stop:0 #e06c75, stop:1 #be5046);
                 border-radius: 4px;
             }
+            QListView#galleryView {
+                background-color: #21252b;
+                border: 1px solid #3b4048;
+                border-radius: 5px;
+            }
+            QListView#galleryView::item:selected {
+                background-color: #3e4451;
+                color: #e5c07b;
+            }
+            QComboBox {
+                background-color: #3b4048;
+                border: 1px solid #5c6370;
+                border-radius: 3px;
+                padding: 4px 8px;
+            }
             QStatusBar {
                 background-color: #21252b;
                 color: #9da5b4;
@@ -197,10 +283,29 @@ class FaceScoringApp(QMainWindow):
         """
         self.setStyleSheet(style_sheet)
 
+    def startModelLoading(self):
+        """窗口先显示，常驻推理线程在后台加载和预热模型，完成后再启用上传"""
+        self.uploadButton.setEnabled(False)
+        self.folderButton.setEnabled(False)
+        self.statusLabel.setText("模型加载中...")
+        self.worker = InferenceWorker()
+        self.worker.models_ready.connect(self.onModelsLoaded)
+        self.worker.job_started.connect(self.onJobStarted)
+        self.worker.job_progress.connect(self.onJobProgress)
+        self.worker.job_finished.connect(self.onProcessingFinished)
+        self.worker.queue_changed.connect(self.onQueueChanged)
+        self.worker.start()
+
+    def onModelsLoaded(self, model_status):
+        self.model_status = model_status
+        metrics.event("startup_report", format_startup_report())
+        self.check_model_status_on_init()
+
     def check_model_status_on_init(self):
-        """在初始化时检查模型加载状态并更新UI"""
+        """模型加载完成后检查加载状态并更新UI"""
         if not self.model_status["yolo"] or not self.model_status["beauty"]:
             self.uploadButton.setEnabled(False)
+            self.folderButton.setEnabled(False)
             missing = []
             if not self.model_status["yolo"]: missing.append("YOLOv8")
             if not self.model_status["beauty"]: missing.append("颜值打分")
@@ -209,76 +314,107 @@ class FaceScoringApp(QMainWindow):
             self.statusBar.setStyleSheet("background-color: #e06c75; color: white;")
             QMessageBox.critical(self, "模型加载失败", "以下模型未能成功加载：\n- {}\n请检查文件路径、依赖库和控制台错误信息。".format('\n- '.join(missing)))
         else:
+             self.uploadButton.setEnabled(True)
+             self.folderButton.setEnabled(True)
              self.statusLabel.setText("模型加载成功 | 设备: {}".format(config.DEVICE)) # 使用 format 避免潜在 f-string 问题
              self.statusBar.setStyleSheet("")
 
-    def startProcessing(self, file_path=None):
-        if self.processing_thread and self.processing_thread.isRunning():
-            QMessageBox.warning(self, "提示", "正在处理上一张图片，请稍候...")
-            return
-
-        image_to_process = file_path
+    def startProcessing(self, file_paths=None):
+        """把图片 (或文件夹) 加入推理队列；处理过程中可以继续添加"""
+        if isinstance(file_paths, str):
+            file_paths = [file_paths]
 
-        if not image_to_process:
+        if not file_paths:
             options = QFileDialog.Options()
-            fileName, _ = QFileDialog.getOpenFileName(self, "选择图片文件", "",
-                                                      "图片文件 (*.png *.jpg *.jpeg *.bmp);;所有文件 (*)",
-                                                      options=options)
-            if fileName:
-                image_to_process = fileName
-            else:
+            file_paths, _ = QFileDialog.getOpenFileNames(self, "选择图片文件", "",
+                                                         "图片文件 (*.png *.jpg *.jpeg *.bmp);;所有文件 (*)",
+                                                         options=options)
+            if not file_paths:
                 return
 
-        self.image_path = image_to_process
-        print("UI: 选择的文件: {}".format(self.image_path))
+        if self.worker is None:
+            QMessageBox.critical(self, "错误", "处理模块未正确加载，无法处理图片。")
+            self.resetUIState()
+            return
+
+        file_paths = list(iter_image_paths(file_paths, recursive=True)) # 展开文件夹
+        if not file_paths:
+            QMessageBox.warning(self, "没有图片", "所选位置中没有 PNG, JPG, JPEG 或 BMP 图片。")
+            return
+
+        # 只加入一张图片时沿用原来的方式直接显示标注结果；
+        # 多张图片时不在信号中传递整图，由画廊按需生成缩略图和预览
+        annotate = len(file_paths) == 1 or self.gallery is None
+        if self.gallery is not None:
+            self.gallery.addPaths(file_paths)
+        metrics.event("ui_enqueued", "UI: 加入队列: {} 张图片".format(len(file_paths)), images=len(file_paths))
+        for path in file_paths:
+            self.worker.submit(path, annotate=annotate)
 
+        self.progressBar.setVisible(True)
+        self.cancelButton.setVisible(True)
+        self.cancelButton.setEnabled(True)
+        self.statusBar.setStyleSheet("")
+
+    def addFolder(self):
+        folder = QFileDialog.getExistingDirectory(self, "选择图片文件夹", "")
+        if folder:
+            self.startProcessing([folder])
+
+    def cancelProcessing(self):
+        """取消所有排队中的任务，正在处理的任务在下一个阶段边界停止"""
+        if self.worker is not None:
+            self.worker.cancel()
+            self.statusLabel.setText("正在取消...")
+            self.cancelButton.setEnabled(False)
+
+    def onQueueChanged(self, pending):
+        self.queueLabel.setText("队列中: {} 张".format(pending) if pending else "")
+
+    def onJobStarted(self, job_id, image_path):
+        self.image_path = image_path
         base_name = os.path.basename(self.image_path)
         display_name = base_name if len(base_name) < 40 else base_name[:37] + '...'
         self.fileNameLabel.setText("文件: {}".format(display_name)) # 使用 format
         self.statusLabel.setText("处理中...")
         self.scoreLabel.setText("...")
-        self.uploadButton.setEnabled(False)
-        self.imageLabel.setText('正在加载和处理图片...')
-
         self.progressBar.setVisible(True)
         self.progressBar.setValue(0)
-        self.progress_value = 0
-        self.progress_timer.start(50)
-
-        if 'ProcessingThread' in globals() and ProcessingThread is not None:
-            try:
-                self.processing_thread = ProcessingThread(self.image_path)
-                if hasattr(self.processing_thread, 'finished') and self.processing_thread.finished:
-                     self.processing_thread.finished.connect(self.onProcessingFinished)
-                else:
-                     raise AttributeError("ProcessingThread 实例缺少 'finished' 信号")
-                self.processing_thread.start()
-            except Exception as e:
-                 print("启动处理线程时出错: {}".format(e))
-                 QMessageBox.critical(self, "错误", "无法启动处理线程: {}".format(e))
-                 self.resetUIState()
-        else:
-            QMessageBox.critical(self, "错误", "处理模块未正确加载，无法处理图片。")
-            self.resetUIState()
-
-    def update_fake_progress(self):
-        if self.progress_value < 95:
-            self.progress_value += 2
-            self.progressBar.setValue(self.progress_value)
-
-    def onProcessingFinished(self, cv_img, score_text, status_message):
-        print("UI: 收到处理结果 - Score: {}, Status: {}".format(score_text, status_message))
-
-        self.progress_timer.stop()
-        self.progressBar.setValue(100)
-        QTimer.singleShot(800, lambda: self.progressBar.setVisible(False))
+        if self.gallery is not None:
+            self.gallery.updateEntry(image_path, status="processing")
+
+    def onJobProgress(self, job_id, percent, stage_name):
+        """由推理线程在每个处理阶段开始时报告的真实进度"""
+        self.progressBar.setValue(percent)
+        self.statusLabel.setText("{}...".format(stage_name))
+
+    def onProcessingFinished(self, job_id, cv_img, score_text, status_message, result):
+        metrics.event("ui_result", "UI: 收到处理结果 - Score: {}, Status: {}".format(score_text, status_message),
+                      job_id=job_id, status=result.get("status"))
+        idle = self.worker.pending_count() == 0
+        self.showLatency(result)
+
+        if idle:
+            self.progressBar.setValue(100)
+            QTimer.singleShot(800, self.hideProgressIfIdle)
+            self.cancelButton.setVisible(False)
+
+        if self.gallery is not None and "path" in result:
+            self.gallery.updateResult(result)
+
+        if result.get("status") == "cancelled":
+            if idle:
+                self.statusLabel.setText("已取消")
+            return
 
         self.scoreLabel.setText(str(score_text)) # 确保是字符串
         status_core = status_message.split('-')[0].strip() if '-' in status_message else status_message
         self.statusLabel.setText(status_core)
 
         if "错误" in status_message or score_text == "错误":
-             QMessageBox.warning(self, "处理错误", status_message)
+             # 队列中还有任务时只在状态栏提示，避免连续弹窗
+             if idle:
+                 QMessageBox.warning(self, "处理错误", status_message)
              self.statusBar.setStyleSheet("background-color: #e06c75; color: white;")
              if cv_img is not None:
                   self.displayCvImage(cv_img)
@@ -288,25 +424,34 @@ class FaceScoringApp(QMainWindow):
              self.statusBar.setStyleSheet("")
              if cv_img is not None:
                  self.displayCvImage(cv_img)
-             else:
+             elif self.gallery is not None and not self.galleryView.selectionModel().hasSelection():
+                 # 批量处理时大图区域跟随最新完成的图片；用户在画廊中选中图片后不再自动切换
+                 self.showPreview(result["path"])
+             elif self.gallery is None:
                  self.imageLabel.setText('未收到图像结果')
 
-        self.uploadButton.setEnabled(True)
-        if self.processing_thread:
-             try:
-                if hasattr(self.processing_thread, 'finished') and self.processing_thread.finished:
-                    # 尝试断开连接，如果信号不存在或未连接，会忽略
-                    self.processing_thread.finished.disconnect(self.onProcessingFinished)
-             except (TypeError, AttributeError):
-                pass # 忽略断开连接时可能出现的错误
-             self.processing_thread = None
+    def showLatency(self, result):
+        """状态栏显示推理线程实测的上一个任务耗时 (从开始处理到结果就绪)"""
+        if result.get("worker_ms") is None or result.get("status") == "cancelled":
+            return
+        self.latencyLabel.setText("耗时: {:.0f} ms{}".format(result["worker_ms"], " (缓存)" if result.get("cached") else ""))
+        recent = metrics.summary("job_seconds", status="ok")
+        if recent:
+            self.latencyLabel.setToolTip("最近 {} 张成功处理的图片: p50 {:.0f} ms / p95 {:.0f} ms / p99 {:.0f} ms".format(
+                recent["window"], recent["p50"] * 1000, recent["p95"] * 1000, recent["p99"] * 1000))
+
+    def hideProgressIfIdle(self):
+        if self.worker is None or (self.worker.pending_count() == 0 and self.worker.current_job is None):
+            self.progressBar.setVisible(False)
 
     def displayCvImage(self, cv_img):
+        self.displayed_cv_img = cv_img
+        self.preview_path = None
         if 'cv_image_to_qpixmap' in globals() and cv_image_to_qpixmap is not None:
             pixmap, error = cv_image_to_qpixmap(cv_img, self.imageLabel.size())
             if error:
                 self.imageLabel.setText(error)
-                print("UI: 显示图片错误 - {}".format(error))
+                metrics.event("ui_display_error", "UI: 显示图片错误 - {}".format(error), level="warning", error=error)
             elif pixmap:
                 self.imageLabel.setPixmap(pixmap)
                 self.imageLabel.setScaledContents(False)
@@ -315,6 +460,39 @@ class FaceScoringApp(QMainWindow):
         else:
              self.imageLabel.setText("图像显示工具不可用")
 
+    def resizeEvent(self, event):
+        """窗口缩放后按新的标签尺寸重新显示 (同一尺寸的结果已缓存)"""
+        super().resizeEvent(event)
+        if self.displayed_cv_img is not None:
+            self.displayCvImage(self.displayed_cv_img)
+
+    # --- 结果画廊 ---
+    def onGalleryClicked(self, proxy_index):
+        image_path = self.galleryProxy.data(proxy_index, PathRole)
+        entry = self.gallery.entry(image_path)
+        if entry is None:
+            return
+        self.scoreLabel.setText("{:.2f}".format(entry["score"]) if entry["score"] is not None else "N/A")
+        base_name = os.path.basename(image_path)
+        self.fileNameLabel.setText("文件: {}".format(base_name if len(base_name) < 40 else base_name[:37] + '...'))
+        if entry["message"]:
+            self.statusLabel.setText(entry["message"])
+        self.showPreview(image_path)
+
+    def showPreview(self, image_path):
+        """在后台按大图区域尺寸解码并绘制人脸框，完成后由 onPreviewReady 显示"""
+        entry = self.gallery.entry(image_path)
+        if entry is None:
+            return
+        self.preview_path = image_path
+        self.displayed_cv_img = None
+        size = self.imageLabel.size()
+        self.thumbnailLoader.request_preview(image_path, entry["faces"], (size.width(), size.height()))
+
+    def onPreviewReady(self, image_path, image):
+        if image_path == self.preview_path: # 忽略已被新请求取代的预览
+            self.imageLabel.setPixmap(QPixmap.fromImage(image))
+            self.imageLabel.setScaledContents(False)
 
     # --- 拖放事件处理 ---
     def dragEnterEvent(self, event):
@@ -331,14 +509,15 @@ class FaceScoringApp(QMainWindow):
         """处理文件放下事件"""
         urls = event.mimeData().urls()
         if urls:
-            file_path = urls[0].toLocalFile()
-            supported_formats = ('.png', '.jpg', '.jpeg', '.bmp')
-            if file_path.lower().endswith(supported_formats):
-                print("UI: 拖放的文件: {}".format(file_path))
-                self.startProcessing(file_path)
+            file_paths = [url.toLocalFile() for url in urls]
+            supported = [path for path in file_paths
+                         if os.path.isdir(path) or path.lower().endswith(config.SUPPORTED_FORMATS)]
+            if supported:
+                metrics.event("ui_dropped", "UI: 拖放了 {} 个文件/文件夹".format(len(supported)), items=len(supported))
+                self.startProcessing(supported)
                 event.acceptProposedAction() # 接受这次放置
             else:
-                QMessageBox.warning(self, "文件类型错误", "不支持的文件类型: {}\n请选择 PNG, JPG, JPEG, 或 BMP 图片。".format(os.path.basename(file_path)))
+                QMessageBox.warning(self, "文件类型错误", "不支持的文件类型: {}\n请选择 PNG, JPG, JPEG, 或 BMP 图片。".format(os.path.basename(file_paths[0])))
                 event.ignore() # 忽略无效文件类型
         else:
             event.ignore() # 忽略无效数据
@@ -346,38 +525,37 @@ class FaceScoringApp(QMainWindow):
     def resetUIState(self):
         """将UI恢复到空闲状态"""
         self.uploadButton.setEnabled(True)
+        self.folderButton.setEnabled(True)
         self.progressBar.setVisible(False)
         self.statusLabel.setText("就绪")
         self.fileNameLabel.setText("")
         self.scoreLabel.setText("N/A")
+        self.displayed_cv_img = None
         self.imageLabel.setText('拖拽图片到这里或点击下方按钮上传')
         self.statusBar.setStyleSheet("")
-        if self.progress_timer.isActive():
-            self.progress_timer.stop()
-        print("UI已重置到空闲状态。")
+        self.cancelButton.setVisible(False)
+        metrics.event("ui_reset", "UI已重置到空闲状态。")
 
 
     def closeEvent(self, event):
         """确保在关闭窗口时，后台线程也停止"""
-        if self.processing_thread and self.processing_thread.isRunning():
-            print("UI: 关闭窗口，正在请求处理线程停止...")
-            try:
-                self.processing_thread.requestInterruption()
-                if not self.processing_thread.wait(1000):
-                     print("UI: 处理线程未能及时停止。")
-                else:
-                     print("UI: 处理线程已停止。")
-            except AttributeError:
-                 print("UI: 处理线程对象似乎不完整或不支持请求停止。")
+        if self.worker is not None and self.worker.isRunning():
+            metrics.event("ui_closing", "UI: 关闭窗口，正在请求推理线程停止...")
+            self.worker.stop()
+            # 正在处理的任务会在下一个阶段边界停止；模型加载中时需要等加载完成
+            if not self.worker.wait(3000):
+                 metrics.event("worker_stop_timeout", "UI: 推理线程未能及时停止。", level="warning")
+            else:
+                 metrics.event("worker_stopped", "UI: 推理线程已停止。")
+        if self.gallery is not None:
+            self.thumbnailLoader.stop()
+            self.thumbnailLoader.wait(3000)
         event.accept()
 
 
 if __name__ == '__main__':
      print("正在直接运行 ui_main_window.py 进行测试...")
      app = QApplication(sys.argv)
-     model_status = get_model_load_status()
-     if not model_status['yolo'] or not model_status['beauty']:
-          print("警告：一个或多个模型未能加载，功能将受限。")
      mainWindow = FaceScoringApp()
      mainWindow.show()
      sys.exit(app.exec_())
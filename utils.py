@@ -1,50 +1,93 @@
 # utils.py
+from collections import OrderedDict
+
 from PyQt5.QtGui import QPixmap, QImage
 from PyQt5.QtCore import Qt
 import numpy as np
 import cv2
-import traceback # Import traceback for detailed error printing
+
+import metrics
+
+# Qt 5.14 起支持 BGR888，可以直接用 OpenCV 的 BGR 数据，省去一次颜色转换
+_BGR_FORMAT = getattr(QImage, "Format_BGR888", None)
+
+# 显示缓存: 只保留当前显示图片在各个标签尺寸下的 QPixmap，窗口来回缩放时不必重新转换
+_PIXMAP_CACHE_SIZE = 8
+_pixmap_cache = {"image": None, "pixmaps": OrderedDict()}
+
+
+def _fit_size(width, height, label_size):
+    """按纵横比缩放到不超过 label_size 的尺寸 (不放大)"""
+    scale = min(label_size.width() / width, label_size.height() / height, 1.0)
+    return max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+
+
+def _to_pixmap(cv_img, label_size):
+    """先在 OpenCV 中用区域平均缩小到标签尺寸，再用缩小后的数据创建 QImage/QPixmap"""
+    height, width = cv_img.shape[:2]
+    target_width, target_height = _fit_size(width, height, label_size)
+    if (target_width, target_height) != (width, height):
+        # INTER_AREA 缩小时质量接近 Qt.SmoothTransformation，且只分配目标尺寸的内存。
+        # 非整数倍率的区域平均很慢，先按整数倍率缩小 (OpenCV 对整数倍率有快速路径)，
+        # 裁掉不足一个倍率的边缘像素 (切片视图，不复制)，再缩放到最终尺寸
+        factor = min(width // target_width, height // target_height)
+        if factor >= 2:
+            cv_img = cv2.resize(cv_img[:height - height % factor, :width - width % factor],
+                                (width // factor, height // factor), interpolation=cv2.INTER_AREA)
+        small = cv2.resize(cv_img, (target_width, target_height), interpolation=cv2.INTER_AREA)
+    else:
+        small = np.ascontiguousarray(cv_img) # QImage 要求每行数据连续
+
+    if small.ndim == 3 and small.shape[2] == 3: # 彩色图像
+        if _BGR_FORMAT is None:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2RGB) # 旧版 Qt: 在缩小后的图上转换，开销很小
+            image_format = QImage.Format_RGB888
+        else:
+            image_format = _BGR_FORMAT
+        bytes_per_line = 3 * small.shape[1]
+    elif small.ndim == 2: # 灰度图像
+        image_format = QImage.Format_Grayscale8
+        bytes_per_line = small.shape[1]
+    else:
+        return None
+
+    # QImage 直接引用 small 的内存 (不复制)；QPixmap.fromImage 会复制数据，
+    # 所以 small 只需在本函数返回前保持存活
+    q_img = QImage(small.data, small.shape[1], small.shape[0], bytes_per_line, image_format)
+    return QPixmap.fromImage(q_img)
+
 
 def cv_image_to_qpixmap(cv_img, label_size):
-    """将 OpenCV 图像 (numpy array) 转换为 QPixmap 并在 QLabel 中显示"""
+    """将 OpenCV 图像 (numpy array) 转换为适合 QLabel 大小的 QPixmap"""
     try:
         # 检查图像是否有效
         if cv_img is None or cv_img.size == 0:
-             print("错误：cv_image_to_qpixmap 接收到无效的图像数据")
+             metrics.event("display_failed", "错误：cv_image_to_qpixmap 接收到无效的图像数据", level="error")
              return None, "无效的图像数据"
-
-        qImg = None
-        # 检查图像维度
-        if len(cv_img.shape) == 3 and cv_img.shape[2] == 3: # 彩色图像
-            height, width, channel = cv_img.shape
-            bytesPerLine = 3 * width
-
-            # --- !!! 修改点在这里 !!! ---
-            # 1. 使用 OpenCV 将 BGR 转换为 RGB
-            rgb_image = cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB)
-            # 2. 使用 RGB 数据创建 QImage，并指定格式为 Format_RGB888
-            qImg = QImage(rgb_image.data, width, height, bytesPerLine, QImage.Format_RGB888)
-            # --- 修改结束 ---
-
-        elif len(cv_img.shape) == 2: # 灰度图像 (保持不变)
-             height, width = cv_img.shape
-             bytesPerLine = width
-             qImg = QImage(cv_img.data, width, height, bytesPerLine, QImage.Format_Grayscale8)
-        else:
-             print(f"错误：不支持的图像形状 {cv_img.shape}")
+        if cv_img.ndim not in (2, 3) or (cv_img.ndim == 3 and cv_img.shape[2] != 3):
+             metrics.event("display_failed", f"错误：不支持的图像形状 {cv_img.shape}", level="error",
+                           shape=list(cv_img.shape))
              return None, "不支持的图像格式"
 
-        if qImg is None:
-            # This case might be redundant now, but kept for safety
-            return None, "无法创建 QImage"
-
-        pixmap = QPixmap.fromImage(qImg)
-        # 缩放图片以适应 QLabel 大小，保持纵横比
-        # 使用 label_size (QSize) 来进行缩放
-        scaled_pixmap = pixmap.scaled(label_size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-        return scaled_pixmap, None # 返回 pixmap 和 无错误
+        # 同一张图片、同一标签尺寸直接复用上次的结果；换了图片则清空缓存
+        if _pixmap_cache["image"] is not cv_img:
+            _pixmap_cache["image"] = cv_img
+            _pixmap_cache["pixmaps"].clear()
+        pixmaps = _pixmap_cache["pixmaps"]
+        key = (label_size.width(), label_size.height())
+        pixmap = pixmaps.get(key)
+        if pixmap is None:
+            with metrics.timed("stage_seconds", stage="display"):
+                pixmap = _to_pixmap(cv_img, label_size)
+            if pixmap is None:
+                return None, "无法创建 QImage"
+            pixmaps[key] = pixmap
+            while len(pixmaps) > _PIXMAP_CACHE_SIZE:
+                pixmaps.popitem(last=False)
+        else:
+            pixmaps.move_to_end(key)
+        return pixmap, None # 返回 pixmap 和 无错误
 
     except Exception as e:
-        print(f"转换图片到 QPixmap 时出错: {e}")
-        traceback.print_exc() # 打印详细错误堆栈
-        return None, f"显示图片时出错: {e}"
\ No newline at end of file
+        metrics.event("display_failed", f"转换图片到 QPixmap 时出错: {e}", level="error", exc_info=True, error=str(e))
+        return None, f"显示图片时出错: {e}"
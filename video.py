@@ -0,0 +1,424 @@
+# video.py
+"""视频打分: 逐帧跟踪人脸，输出每个人脸轨迹的分数时间线。
+
+逐帧运行 YOLO 很浪费，跟踪模式下:
+- 每 detect_every 帧或检测到镜头切换 (相邻帧灰度直方图差异) 时运行一次 YOLO，
+  检测框按 IoU 与已有轨迹匹配，未匹配的检测框开始新轨迹，多次未匹配的轨迹结束；
+- 其余帧在缩小的灰度图上用 Lucas-Kanade 光流移动每条轨迹的特征点，按特征点的中位位移和缩放更新人脸框；
+- 只有新轨迹，或人脸外观 (16x16 灰度缩略图) / 大小相对上次打分变化足够大时才重新打分，
+  一帧内需要打分的人脸合并为一次 CNNRegressionModel 调用。
+检测、筛选、裁剪和打分复用 FaceScorer 的各阶段方法，与图片打分完全一致。
+
+用法:
+    python -m video clip.mp4 -o tracks.json
+    python -m video clip.mp4 -o tracks.json --annotate annotated.mp4 --detect-every 5
+    python -m video clip.mp4 --compare --max-frames 300     # 跟踪模式与逐帧检测模式的 fps 对比
+"""
+import argparse
+import contextlib
+import json
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import config
+import metrics
+from image_io import make_detection_proxy
+
+MIN_POINTS = 4 # 估计位移至少需要的特征点数
+SIGNATURE_SIZE = 16
+
+
+def box_iou(boxes_a, boxes_b):
+    """两组框 [N,4] / [M,4] 的 IoU 矩阵 [N,M]"""
+    if len(boxes_a) == 0 or len(boxes_b) == 0:
+        return np.zeros((len(boxes_a), len(boxes_b)), dtype=np.float32)
+    a = np.asarray(boxes_a, dtype=np.float32)[:, None, :]
+    b = np.asarray(boxes_b, dtype=np.float32)[None, :, :]
+    inter_w = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    inter_h = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    inter = inter_w * inter_h
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    return inter / np.maximum(area_a + area_b - inter, 1e-6)
+
+
+def match_boxes(iou, threshold):
+    """按 IoU 从高到低贪心匹配，返回 [(行, 列), ...]"""
+    pairs = []
+    if iou.size == 0:
+        return pairs
+    used_rows, used_cols = set(), set()
+    for flat in np.argsort(-iou, axis=None):
+        row, col = divmod(int(flat), iou.shape[1])
+        if iou[row, col] < threshold:
+            break
+        if row not in used_rows and col not in used_cols:
+            pairs.append((row, col))
+            used_rows.add(row)
+            used_cols.add(col)
+    return pairs
+
+
+def face_signature(frame, box):
+    """人脸区域的 16x16 灰度缩略图 (0~1)，用于判断外观是否变化到需要重新打分"""
+    x_min, y_min, x_max, y_max = box
+    crop = frame[y_min:y_max, x_min:x_max]
+    if crop.size == 0:
+        return None
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, (SIGNATURE_SIZE, SIGNATURE_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32) / 255
+
+
+def gray_histogram(gray):
+    hist = cv2.calcHist([gray], [0], None, [32], [0, 256])
+    return cv2.normalize(hist, hist).flatten()
+
+
+class Track:
+    """一张人脸的轨迹: 当前框 (原图坐标)、光流特征点 (缩小图坐标) 和分数时间线"""
+
+    def __init__(self, track_id, box, confidence):
+        self.track_id = track_id
+        self.box = np.asarray(box, dtype=np.float32)
+        self.confidence = confidence
+        self.points = None
+        self.score = None
+        self.signature = None  # 上次打分时的外观
+        self.scored_area = None # 上次打分时的框面积
+        self.misses = 0
+        self.timeline = []
+
+    def int_box(self, width, height):
+        x_min, y_min, x_max, y_max = self.box
+        return [max(0, int(x_min)), max(0, int(y_min)), min(width - 1, int(x_max)), min(height - 1, int(y_max))]
+
+    def as_dict(self):
+        scores = [entry["score"] for entry in self.timeline if entry["score"] is not None]
+        return {"track_id": self.track_id, "first_frame": self.timeline[0]["frame"], "last_frame": self.timeline[-1]["frame"],
+                "frames": len(self.timeline), "rescored": sum(entry["rescored"] for entry in self.timeline),
+                "mean_score": float(np.mean(scores)) if scores else None,
+                "max_score": float(np.max(scores)) if scores else None, "timeline": self.timeline}
+
+
+class VideoScorer:
+    """用常驻的 FaceScorer 为视频逐帧跟踪人脸并打分"""
+
+    def __init__(self, face_scorer, detect_every=None, scene_threshold=None, track_iou=None, max_misses=None,
+                 rescore_threshold=None, flow_width=None):
+        self.face_scorer = face_scorer
+        self.detect_every = max(1, detect_every or config.VIDEO_DETECT_EVERY)
+        self.scene_threshold = config.VIDEO_SCENE_THRESHOLD if scene_threshold is None else scene_threshold
+        self.track_iou = config.VIDEO_TRACK_IOU if track_iou is None else track_iou
+        self.max_misses = config.VIDEO_MAX_MISSES if max_misses is None else max_misses
+        self.rescore_threshold = config.VIDEO_RESCORE_THRESHOLD if rescore_threshold is None else rescore_threshold
+        self.flow_width = flow_width or config.VIDEO_FLOW_WIDTH
+
+    # --- 检测与匹配 ---
+    def _detect(self, frame):
+        """返回 [(box, confidence), ...] (原图坐标，已按 select_faces 筛选)"""
+        face_scorer = self.face_scorer
+        height, width = frame.shape[:2]
+        proxy = frame if face_scorer.detection_mode == "tiled" else make_detection_proxy(frame, face_scorer.yolo_image_size)
+        detections = face_scorer.remap_detections(face_scorer.detect(proxy), proxy, (width, height))
+        return face_scorer.select_faces(detections, (width, height))
+
+    def _associate(self, selected, tracks, next_id):
+        """检测框与轨迹匹配: 匹配的轨迹采用检测框，未匹配的检测框开始新轨迹。返回 (轨迹列表, 结束的轨迹, next_id)"""
+        pairs = match_boxes(box_iou([box for box, _ in selected], [track.box for track in tracks]), self.track_iou)
+        for det_index, track_index in pairs:
+            track = tracks[track_index]
+            track.box = np.asarray(selected[det_index][0], dtype=np.float32)
+            track.confidence = selected[det_index][1]
+            track.misses = 0
+            track.points = None # 在新框内重新选取特征点
+        matched_dets = {det_index for det_index, _ in pairs}
+        matched_tracks = {track_index for _, track_index in pairs}
+        kept, ended = [], []
+        for index, track in enumerate(tracks):
+            if index in matched_tracks:
+                kept.append(track)
+            else:
+                track.misses += 1
+                (ended if track.misses > self.max_misses else kept).append(track)
+        for det_index, (box, confidence) in enumerate(selected):
+            if det_index not in matched_dets:
+                kept.append(Track(next_id, box, confidence))
+                next_id += 1
+        return kept, ended, next_id
+
+    # --- 光流跟踪 ---
+    def _seed_points(self, track, gray, scale):
+        height, width = gray.shape[:2]
+        x_min, y_min, x_max, y_max = (track.box * scale).astype(int)
+        x_min, y_min = max(0, x_min), max(0, y_min)
+        x_max, y_max = min(width, x_max), min(height, y_max)
+        if x_max - x_min < 4 or y_max - y_min < 4:
+            track.points = None
+            return
+        points = cv2.goodFeaturesToTrack(gray[y_min:y_max, x_min:x_max], maxCorners=30, qualityLevel=0.01, minDistance=3)
+        track.points = None if points is None else points + np.array([x_min, y_min], dtype=np.float32)
+
+    def _propagate(self, tracks, prev_gray, gray, scale):
+        """一次 calcOpticalFlowPyrLK 调用移动所有轨迹的特征点，按中位位移和中位缩放更新人脸框"""
+        moving = [track for track in tracks if track.points is not None and len(track.points) >= MIN_POINTS]
+        if not moving:
+            return
+        old = np.concatenate([track.points for track in moving]).astype(np.float32)
+        new, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, old, None, winSize=(15, 15), maxLevel=2)
+        offset = 0
+        for track in moving:
+            count = len(track.points)
+            ok = status[offset:offset + count, 0] == 1
+            before, after = old[offset:offset + count, 0][ok], new[offset:offset + count, 0][ok]
+            offset += count
+            if len(after) < MIN_POINTS:
+                track.points = None # 跟丢了，保持原框直到下一次检测
+                continue
+            shift = np.median(after - before, axis=0) / scale
+            spread_before = np.linalg.norm(before - before.mean(axis=0), axis=1)
+            spread_after = np.linalg.norm(after - after.mean(axis=0), axis=1)
+            zoom = float(np.clip(np.median(spread_after / np.maximum(spread_before, 1e-3)), 0.8, 1.25))
+            x_min, y_min, x_max, y_max = track.box
+            center_x, center_y = (x_min + x_max) / 2 + shift[0], (y_min + y_max) / 2 + shift[1]
+            half_w, half_h = (x_max - x_min) * zoom / 2, (y_max - y_min) * zoom / 2
+            track.box = np.array([center_x - half_w, center_y - half_h, center_x + half_w, center_y + half_h], dtype=np.float32)
+            track.points = after.reshape(-1, 1, 2)
+
+    # --- 打分 ---
+    def _needs_rescore(self, track, signature, area):
+        if track.score is None or track.signature is None:
+            return True
+        if signature is None:
+            return False
+        if not 1 / 1.3 <= area / max(track.scored_area, 1.0) <= 1.3:
+            return True
+        return float(np.abs(signature - track.signature).mean()) > self.rescore_threshold
+
+    def _score_tracks(self, frame, tracks):
+        """外观或大小变化足够大的轨迹合并为一次打分调用，返回重新打分的轨迹 id 集合"""
+        height, width = frame.shape[:2]
+        to_score, boxes, signatures = [], [], []
+        for track in tracks:
+            box = track.int_box(width, height)
+            if box[2] - box[0] < self.face_scorer.min_face_size or box[3] - box[1] < self.face_scorer.min_face_size:
+                continue
+            signature = face_signature(frame, box)
+            area = float((box[2] - box[0]) * (box[3] - box[1]))
+            if self._needs_rescore(track, signature, area):
+                to_score.append((track, signature, area))
+                boxes.append((box, track.confidence))
+        if not to_score:
+            return set()
+        scores = self.face_scorer.score_faces(self.face_scorer.crop_selected(frame, boxes, (width, height)))
+        for (track, signature, area), score in zip(to_score, scores):
+            track.score, track.signature, track.scored_area = score, signature, area
+        return {track.track_id for track, _, _ in to_score}
+
+    # --- 主循环 ---
+    def run(self, video_path, annotate_path=None, max_frames=None):
+        """处理整个视频，返回 {"video", "fps", "frames", "stats", "tracks": [...]}"""
+        capture = cv2.VideoCapture(video_path)
+        if not capture.isOpened():
+            raise ValueError(f"无法打开视频: {video_path}")
+        fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+        writer = None
+        tracks, finished = [], []
+        next_id = 1
+        prev_gray = prev_hist = None
+        stats = {"detections": 0, "scene_cuts": 0, "faces_scored": 0, "score_calls": 0}
+        frame_index = 0
+        start = time.perf_counter()
+        try:
+            while max_frames is None or frame_index < max_frames:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                height, width = frame.shape[:2]
+                scale = min(1.0, self.flow_width / width)
+                small = frame if scale == 1.0 else cv2.resize(frame, (int(width * scale), int(height * scale)),
+                                                                interpolation=cv2.INTER_AREA)
+                gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+                hist = gray_histogram(gray)
+                scene_cut = prev_hist is not None and \
+                    cv2.compareHist(prev_hist, hist, cv2.HISTCMP_BHATTACHARYYA) > self.scene_threshold
+
+                if scene_cut:
+                    stats["scene_cuts"] += 1
+                    finished.extend(tracks) # 新镜头里的人脸另起轨迹
+                    tracks = []
+                if scene_cut or frame_index % self.detect_every == 0:
+                    with metrics.timed("stage_seconds", stage="video_detect"):
+                        selected = self._detect(frame)
+                    stats["detections"] += 1
+                    tracks, ended, next_id = self._associate(selected, tracks, next_id)
+                    finished.extend(ended)
+                    source = "detect"
+                else:
+                    with metrics.timed("stage_seconds", stage="video_track"):
+                        self._propagate(tracks, prev_gray, gray, scale)
+                    source = "flow"
+                for track in tracks:
+                    if track.points is None or len(track.points) < MIN_POINTS:
+                        self._seed_points(track, gray, scale)
+
+                with metrics.timed("stage_seconds", stage="video_score"):
+                    rescored = self._score_tracks(frame, tracks)
+                if rescored:
+                    stats["score_calls"] += 1
+                    stats["faces_scored"] += len(rescored)
+
+                time_s = round(frame_index / fps, 3)
+                for track in tracks:
+                    track.timeline.append({"frame": frame_index, "time": time_s,
+                                           "box": [round(float(v), 1) for v in track.box],
+                                           "score": track.score, "source": source,
+                                           "rescored": track.track_id in rescored})
+                if annotate_path:
+                    if writer is None:
+                        writer = open_video_writer(annotate_path, fps, (width, height))
+                    writer.write(draw_tracks(frame, tracks))
+                prev_gray, prev_hist = gray, hist
+                frame_index += 1
+        finally:
+            capture.release()
+            if writer is not None:
+                writer.release()
+        elapsed = time.perf_counter() - start
+        finished.extend(tracks)
+        stats.update({"seconds": round(elapsed, 3), "processing_fps": round(frame_index / elapsed, 2) if elapsed > 0 else 0.0})
+        return {"video": video_path, "fps": fps, "frames": frame_index, "mode": "tracked", "detect_every": self.detect_every,
+                "stats": stats, "tracks": [track.as_dict() for track in finished if track.timeline]}
+
+    def run_per_frame(self, video_path, max_frames=None):
+        """对照组: 每一帧都检测并为所有人脸打分。返回 ({"frames", "stats"}, [[(box, score), ...] 每帧])"""
+        capture = cv2.VideoCapture(video_path)
+        if not capture.isOpened():
+            raise ValueError(f"无法打开视频: {video_path}")
+        per_frame = []
+        faces_scored = 0
+        start = time.perf_counter()
+        try:
+            while max_frames is None or len(per_frame) < max_frames:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                height, width = frame.shape[:2]
+                selected = self._detect(frame)
+                scores = self.face_scorer.score_faces(self.face_scorer.crop_selected(frame, selected, (width, height))) \
+                    if selected else []
+                faces_scored += len(scores)
+                per_frame.append([(box, score) for (box, _), score in zip(selected, scores)])
+        finally:
+            capture.release()
+        elapsed = time.perf_counter() - start
+        stats = {"detections": len(per_frame), "faces_scored": faces_scored, "seconds": round(elapsed, 3),
+                 "processing_fps": round(len(per_frame) / elapsed, 2) if elapsed > 0 else 0.0}
+        return {"frames": len(per_frame), "mode": "per_frame", "stats": stats}, per_frame
+
+
+def open_video_writer(path, fps, size):
+    fourcc = cv2.VideoWriter_fourcc(*("MJPG" if path.lower().endswith(".avi") else "mp4v"))
+    writer = cv2.VideoWriter(path, fourcc, fps, size)
+    if not writer.isOpened():
+        raise ValueError(f"无法创建输出视频: {path}")
+    return writer
+
+
+def draw_tracks(frame, tracks):
+    """在帧上绘制每条轨迹的框、编号和当前分数 (原地修改)"""
+    height, width = frame.shape[:2]
+    for track in tracks:
+        x_min, y_min, x_max, y_max = track.int_box(width, height)
+        cv2.rectangle(frame, (x_min, y_min), (x_max, y_max), (0, 255, 0), 2)
+        label = f"#{track.track_id}" + (f" {track.score:.2f}" if track.score is not None else "")
+        cv2.putText(frame, label, (x_min, max(y_min - 6, 12)), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2, cv2.LINE_AA)
+    return frame
+
+
+def agreement(tracked, per_frame, iou_threshold=0.5):
+    """跟踪模式与逐帧模式的分数差异: 同一帧中 IoU 足够大的人脸视为同一张，返回 (匹配率, 平均绝对分数差)"""
+    by_frame = {}
+    for track in tracked["tracks"]:
+        for entry in track["timeline"]:
+            if entry["score"] is not None:
+                by_frame.setdefault(entry["frame"], []).append((entry["box"], entry["score"]))
+    total = matched = 0
+    diffs = []
+    for frame_index, faces in enumerate(per_frame):
+        candidates = by_frame.get(frame_index, [])
+        total += len(faces)
+        iou = box_iou([box for box, _ in faces], [box for box, _ in candidates])
+        for face_index, candidate_index in match_boxes(iou, iou_threshold):
+            matched += 1
+            diffs.append(abs(faces[face_index][1] - candidates[candidate_index][1]))
+    return (matched / total if total else 1.0), (float(np.mean(diffs)) if diffs else 0.0)
+
+
+def format_comparison(tracked, per_frame, match_rate, score_diff):
+    lines = [f"{'模式':<10} {'帧数':>6} {'耗时s':>8} {'fps':>8} {'YOLO次数':>8} {'打分人脸':>8}"]
+    for name, result in (("跟踪", tracked), ("逐帧", per_frame)):
+        stats = result["stats"]
+        lines.append(f"{name:<10} {result['frames']:>6} {stats['seconds']:>8.2f} {stats['processing_fps']:>8.2f} "
+                     f"{stats['detections']:>8} {stats['faces_scored']:>8}")
+    speedup = tracked["stats"]["processing_fps"] / per_frame["stats"]["processing_fps"] if per_frame["stats"]["processing_fps"] else 0.0
+    lines.append(f"跟踪模式加速 {speedup:.2f}x；逐帧检测到的人脸中 {match_rate * 100:.1f}% 与轨迹匹配，平均分数差 {score_diff:.4f}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m video", description="视频人脸跟踪与颜值打分")
+    parser.add_argument("video", help="视频文件 (mp4 / avi 等 OpenCV 能读取的格式)")
+    parser.add_argument("-o", "--output", help="轨迹与分数时间线写入该 JSON 文件，省略时只输出摘要")
+    parser.add_argument("--annotate", metavar="PATH", help="输出绘制了人脸框、轨迹编号和分数的视频 (.mp4 / .avi)")
+    parser.add_argument("--detect-every", type=int, default=config.VIDEO_DETECT_EVERY, help="每隔多少帧检测一次 (默认 %(default)s)")
+    parser.add_argument("--scene-threshold", type=float, default=config.VIDEO_SCENE_THRESHOLD, help="镜头切换阈值 (默认 %(default)s)")
+    parser.add_argument("--rescore-threshold", type=float, default=config.VIDEO_RESCORE_THRESHOLD,
+                        help="外观变化超过该值时重新打分 (默认 %(default)s，0 表示每帧都打分)")
+    parser.add_argument("--max-frames", type=int, help="只处理前 N 帧")
+    parser.add_argument("--compare", action="store_true", help="再用逐帧检测模式处理一遍，对比 fps 和分数")
+    parser.add_argument("--detection", choices=["single", "tiled"], default=config.DETECTION_MODE, help="检测模式")
+    parser.add_argument("--backend", choices=["eager", "torchscript", "onnx"], default=config.INFERENCE_BACKEND, help="推理后端")
+    args = parser.parse_args(argv)
+
+    with contextlib.redirect_stdout(sys.stderr):
+        from scorer import FaceScorer
+        face_scorer = FaceScorer(cache_path=None, detection_mode=args.detection, backend=args.backend)
+        face_scorer.warm_up()
+    if not all(face_scorer.models_loaded.values()):
+        print("错误: 模型加载失败，无法处理视频。", file=sys.stderr)
+        return 1
+
+    video_scorer = VideoScorer(face_scorer, detect_every=args.detect_every, scene_threshold=args.scene_threshold,
+                               rescore_threshold=args.rescore_threshold)
+    try:
+        result = video_scorer.run(args.video, annotate_path=args.annotate, max_frames=args.max_frames)
+    except ValueError as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 1
+    stats = result["stats"]
+    print(f"{result['frames']} 帧，{len(result['tracks'])} 条人脸轨迹，{stats['processing_fps']} 帧/秒 "
+          f"(检测 {stats['detections']} 次，镜头切换 {stats['scene_cuts']} 次，打分 {stats['faces_scored']} 张人脸)",
+          file=sys.stderr)
+    for track in result["tracks"]:
+        mean_score = f"{track['mean_score']:.2f}" if track["mean_score"] is not None else "N/A"
+        print(f"  - 轨迹 #{track['track_id']}: 第 {track['first_frame']}~{track['last_frame']} 帧，"
+              f"平均分 {mean_score}，重新打分 {track['rescored']} 次", file=sys.stderr)
+
+    if args.compare:
+        per_frame, faces = video_scorer.run_per_frame(args.video, max_frames=result["frames"])
+        match_rate, score_diff = agreement(result, faces)
+        result["comparison"] = {"per_frame": per_frame["stats"], "match_rate": round(match_rate, 4),
+                                "mean_abs_score_diff": round(score_diff, 5)}
+        print(format_comparison(result, per_frame, match_rate, score_diff), file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
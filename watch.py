@@ -0,0 +1,349 @@
+# watch.py
+"""目录监视模式: 模型常驻，持续为放入目录的新图片 (或被修改的图片) 打分，结果追加写入结果文件。
+
+- Linux 上用 inotify (通过 ctypes 调用 libc，无需额外依赖) 接收文件写完 / 移入的通知，
+  没有事件时阻塞在 select 上，空闲时几乎不占 CPU；其他系统或 inotify 不可用时退回定时扫描目录。
+- 防抖: 文件大小和修改时间连续 debounce 秒不变才处理，正在写入的文件不会被读到一半。
+- 清单: 已打分的图片按 路径 + 大小 + 修改时间 + 内容哈希 登记在结果文件旁的检查点中 (见 checkpoint.py)，
+  重启后不重复处理；大小或修改时间变了但内容哈希相同 (例如 touch) 的图片也不重新打分。
+- 批处理: 同时就绪的图片 (例如一次拷入几千张) 每次最多 max_batch 张交给分阶段流水线 (pipeline.py)，
+  多张图片合并为一次 YOLO 调用，人脸跨图片合并为一次打分调用，而不是逐张处理。
+
+用法:
+    python -m watch incoming/ -o results.jsonl
+    python -m watch incoming/ -r -o results.jsonl --parquet results_parquet/ --debounce 2
+    python -m watch incoming/ -o results.jsonl --poll --poll-interval 5     # 网络文件系统上 inotify 收不到其他主机的写入
+"""
+import argparse
+import contextlib
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import signal
+import struct
+import sys
+import time
+
+import config
+import metrics
+from checkpoint import RETRY_STATUSES, file_stamp
+from image_io import iter_image_paths, read_image_bytes
+from pipeline import ScoringPipeline
+from result_cache import content_hash
+from sinks import SINKS, CheckpointedSink, import_pyarrow
+
+# inotify 事件掩码 (<sys/inotify.h>)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CREATE | IN_CLOSE_WRITE | IN_MOVED_TO
+
+_EVENT_HEADER = struct.Struct("iIII") # wd, mask, cookie, len
+# 子目录无法监视时跳过而不是退出: 监视建立前已被删除或替换 (rsync、解压工具的临时目录)，或达到监视数上限
+_SKIPPED_WATCH_ERRORS = (errno.ENOENT, errno.ENOTDIR, errno.ENOSPC)
+
+
+def is_image_path(path):
+    return path.lower().endswith(config.SUPPORTED_FORMATS) and not os.path.basename(path).startswith(".")
+
+
+def scan_directories(directories, recursive):
+    """目录中现有的图片路径"""
+    return list(iter_image_paths(directories, recursive))
+
+
+# --- 1. 文件变化通知 ---
+class InotifyWatcher:
+    """用 inotify 监视目录: wait(timeout) 返回期间新建 / 写完 / 移入的图片路径，
+    内核事件队列溢出时返回 None，表示需要重新扫描整个目录"""
+
+    def __init__(self, directories, recursive=False):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._libc = libc
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+        self.recursive = recursive
+        self.directories = {} # 监视描述符 -> 目录
+        for directory in directories:
+            self._add_tree(directory, required=True)
+
+    def _add_watch(self, directory):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"无法监视目录 {directory}")
+        self.directories[wd] = directory
+
+    def _add_subdirectory(self, directory):
+        """监视子目录，返回是否成功；目录已消失或达到监视数上限时跳过"""
+        try:
+            self._add_watch(directory)
+        except OSError as e:
+            if e.errno not in _SKIPPED_WATCH_ERRORS:
+                raise
+            if e.errno == errno.ENOSPC:
+                metrics.event("watch_limit_reached",
+                              f"警告: 达到 inotify 监视数上限，不监视 {directory} (可调大 fs.inotify.max_user_watches)。",
+                              level="warning", path=directory)
+            return False
+        return True
+
+    def _add_tree(self, directory, required=False):
+        """监视目录 (recursive 时连同其下所有子目录)。required=True 为启动时给出的目录，无法监视时抛出 OSError"""
+        if required:
+            self._add_watch(directory)
+        elif not self._add_subdirectory(directory):
+            return
+        if self.recursive:
+            for root, names, _ in os.walk(directory):
+                for name in names:
+                    self._add_subdirectory(os.path.join(root, name))
+
+    def wait(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return []
+        paths = []
+        overflow = False
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + _EVENT_HEADER.size:offset + _EVENT_HEADER.size + length].rstrip(b"\0")
+            offset += _EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            if mask & IN_IGNORED:
+                self.directories.pop(wd, None)
+                continue
+            directory = self.directories.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if self.recursive and mask & (IN_CREATE | IN_MOVED_TO):
+                    # 新子目录: 开始监视，并把其中已有的文件当作新文件 (监视建立前写入的文件不会产生事件)
+                    self._add_tree(path)
+                    paths.extend(scan_directories([path], True))
+            elif is_image_path(path):
+                paths.append(path)
+        metrics.increment("watch_events_total", len(paths), watcher="inotify")
+        return None if overflow else paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """定时扫描目录，wait(timeout) 最多等待 interval 秒后返回新出现或大小 / 修改时间变化的图片路径"""
+
+    def __init__(self, directories, recursive=False, interval=None):
+        self.directories = directories
+        self.recursive = recursive
+        self.interval = interval or config.WATCH_POLL_INTERVAL
+        # 启动时已有的文件由 DirectoryScorer 的首次扫描处理，这里只报告之后的变化
+        self.stamps = {path: file_stamp(path) for path in scan_directories(directories, recursive)}
+        self._next_scan = time.monotonic() + self.interval
+
+    def wait(self, timeout):
+        delay = self._next_scan - time.monotonic()
+        if timeout is not None:
+            delay = min(delay, timeout)
+        if delay > 0:
+            time.sleep(delay)
+        if time.monotonic() < self._next_scan:
+            return []
+        self._next_scan = time.monotonic() + self.interval
+        stamps = {path: file_stamp(path) for path in scan_directories(self.directories, self.recursive)}
+        changed = [path for path, stamp in stamps.items() if self.stamps.get(path) != stamp]
+        self.stamps = stamps
+        metrics.increment("watch_events_total", len(changed), watcher="poll")
+        return changed
+
+    def close(self):
+        pass
+
+
+def open_watcher(directories, recursive=False, poll=False, poll_interval=None):
+    """优先使用 inotify，不可用时退回定时扫描"""
+    if not poll and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(directories, recursive)
+        except (OSError, AttributeError) as e:
+            metrics.event("watch_fallback", f"inotify 不可用 ({e})，改为每 {poll_interval or config.WATCH_POLL_INTERVAL} 秒扫描一次目录。",
+                          level="warning", error=str(e))
+    return PollingWatcher(directories, recursive, poll_interval)
+
+
+# --- 2. 防抖、清单与批处理 ---
+class DirectoryScorer:
+    """把 watcher 报告的路径防抖、按清单过滤后分批打分，结果写入 sink (CheckpointedSink)"""
+
+    def __init__(self, face_scorer, sink, watcher, debounce=None, max_batch=None):
+        self.sink = sink
+        self.manifest = sink.checkpoint
+        self.watcher = watcher
+        self.debounce = config.WATCH_DEBOUNCE if debounce is None else debounce
+        self.max_batch = max_batch or config.WATCH_MAX_BATCH
+        self.pipeline = ScoringPipeline(face_scorer)
+        self.pending = {} # 路径 -> (最近一次观察到的 (大小, 修改时间), 观察到该状态的时间)
+        self.stats = {"scored": 0, "unchanged": 0, "batches": 0}
+
+    def add(self, paths, settled=False):
+        """记录待处理的路径; settled=True 表示启动时已存在的文件，不必等待防抖"""
+        now = time.monotonic()
+        for path in paths:
+            self.pending[path] = (file_stamp(path), now - self.debounce if settled else now)
+
+    def _is_unchanged(self, path, stamp):
+        """清单中已有同一文件 (大小和修改时间相同，或内容哈希相同) 且上次没有出错时返回 True"""
+        entry = self.manifest.entry(path)
+        if entry is None or entry[3] in RETRY_STATUSES:
+            return False
+        if tuple(entry[:2]) == stamp:
+            return True
+        data = read_image_bytes(path)
+        if data is None or entry[2] != content_hash(data):
+            return False
+        self.manifest.commit([(path, entry[2], entry[3])]) # 只更新清单中的大小和修改时间
+        return True
+
+    def ready_paths(self):
+        """大小和修改时间已稳定 debounce 秒的路径 (从 pending 中移除)；返回 (就绪路径, 距下一个路径就绪的秒数)"""
+        now = time.monotonic()
+        ready = []
+        next_due = None
+        for path, (stamp, since) in list(self.pending.items()):
+            current = file_stamp(path)
+            if current[0] < 0: # 文件已被删除或移走
+                del self.pending[path]
+                continue
+            if current != stamp:
+                self.pending[path] = (current, now)
+                since = now
+            elif now - since >= self.debounce:
+                del self.pending[path]
+                if self._is_unchanged(path, current):
+                    self.stats["unchanged"] += 1
+                else:
+                    ready.append(path)
+                continue
+            due = since + self.debounce - now
+            next_due = due if next_due is None else min(next_due, due)
+        return ready, next_due
+
+    def score(self, paths):
+        """每次最多 max_batch 张交给流水线，每批处理完立即提交"""
+        for start in range(0, len(paths), self.max_batch):
+            batch = paths[start:start + self.max_batch]
+            started = time.perf_counter()
+            for result in self.pipeline.run(batch):
+                self.sink.write(result)
+            self.sink.commit()
+            self.stats["scored"] += len(batch)
+            self.stats["batches"] += 1
+            metrics.observe("watch_batch_size", len(batch))
+            metrics.event("watch_batch", f"已处理 {len(batch)} 张新图片，耗时 {time.perf_counter() - started:.1f}s",
+                          images=len(batch), seconds=round(time.perf_counter() - started, 3))
+
+    def run(self, directories, recursive=False, once=False):
+        """先处理目录中现有的图片，之后持续等待新文件 (once=True 时处理完现有图片即返回)"""
+        self.add(scan_directories(directories, recursive), settled=True)
+        while True:
+            ready, next_due = self.ready_paths()
+            if ready:
+                self.score(ready)
+                continue # 打分期间可能又有文件就绪或到达
+            if once and not self.pending:
+                return
+            paths = self.watcher.wait(next_due) # 没有待定文件时无限期阻塞
+            if paths is None: # inotify 队列溢出，丢失了事件: 重新扫描，清单会跳过已处理的图片
+                metrics.event("watch_overflow", "inotify 事件队列溢出，重新扫描目录。", level="warning")
+                paths = scan_directories(directories, recursive)
+            self.add(paths)
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(prog="python -m watch", description="监视目录，持续为新图片打分")
+    parser.add_argument("directories", nargs="+", help="要监视的目录")
+    parser.add_argument("-o", "--output", required=True,
+                        help="结果追加写入的文件；已处理图片的清单保存在 <输出文件>.ckpt")
+    parser.add_argument("-f", "--format", choices=sorted(SINKS), default="jsonl", help="输出格式 (默认 jsonl)")
+    parser.add_argument("--parquet", metavar="DIR", help="同时把每批结果写成一个 Parquet 分片 (需要 pyarrow)")
+    parser.add_argument("-r", "--recursive", action="store_true", help="同时监视子目录")
+    parser.add_argument("--debounce", type=float, default=config.WATCH_DEBOUNCE,
+                        help="文件大小和修改时间保持不变多少秒后才处理 (默认 %(default)s)")
+    parser.add_argument("--max-batch", type=int, default=config.WATCH_MAX_BATCH,
+                        help="每次交给流水线的最多图片数 (默认 %(default)s)")
+    parser.add_argument("--poll", action="store_true", help="不使用 inotify，定时扫描目录")
+    parser.add_argument("--poll-interval", type=float, default=config.WATCH_POLL_INTERVAL,
+                        help="定时扫描的间隔秒数 (默认 %(default)s)")
+    parser.add_argument("--once", action="store_true", help="只处理目录中现有的图片，处理完即退出")
+    parser.add_argument("--cache", default=config.RESULT_CACHE_PATH if config.RESULT_CACHE_ENABLED else None,
+                        help="结果缓存数据库路径 (默认使用 config.RESULT_CACHE_PATH)")
+    parser.add_argument("--no-cache", dest="cache", action="store_const", const=None, help="不使用结果缓存")
+    parser.add_argument("--detection", choices=["single", "tiled"], default=config.DETECTION_MODE, help="检测模式")
+    parser.add_argument("--backend", choices=["eager", "torchscript", "onnx"], default=config.INFERENCE_BACKEND,
+                        help="推理后端")
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    for directory in args.directories:
+        if not os.path.isdir(directory):
+            print(f"错误: 目录不存在: {directory}", file=sys.stderr)
+            return 2
+    pyarrow = None
+    if args.parquet:
+        pyarrow = import_pyarrow()
+        if pyarrow is None:
+            return 2
+
+    # 提交由每批结束时显式完成，这里的块大小只作为上限。在加载模型之前打开，
+    # -o 指向没有检查点的已有结果文件时 CheckpointedSink 拒绝续写 (不会截断)，直接退出
+    try:
+        sink = CheckpointedSink(args.format, args.output, parquet_dir=args.parquet, chunk_size=args.max_batch,
+                                resume=True, pyarrow=pyarrow)
+    except ValueError as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 2
+
+    with contextlib.redirect_stdout(sys.stderr):
+        from scorer import FaceScorer
+        face_scorer = FaceScorer(cache_path=args.cache, detection_mode=args.detection, backend=args.backend)
+        face_scorer.warm_up()
+    if not all(face_scorer.models_loaded.values()):
+        print("错误: 模型加载失败，无法处理图片。", file=sys.stderr)
+        sink.close()
+        return 1
+
+    watcher = open_watcher(args.directories, args.recursive, args.poll, args.poll_interval)
+    directory_scorer = DirectoryScorer(face_scorer, sink, watcher, debounce=args.debounce, max_batch=args.max_batch)
+    # 后台运行时 SIGINT 可能被忽略，SIGTERM 同样按中断处理: 写完当前结果并提交后退出
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    print(f"正在监视 {', '.join(args.directories)} ({type(watcher).__name__})，按 Ctrl+C 停止。", file=sys.stderr)
+    try:
+        directory_scorer.run(args.directories, args.recursive, once=args.once)
+    except KeyboardInterrupt:
+        print("已停止。", file=sys.stderr)
+    finally:
+        watcher.close()
+        sink.close()
+    stats = directory_scorer.stats
+    print(f"共处理 {stats['scored']} 张图片 ({stats['batches']} 批)，{stats['unchanged']} 张内容未变化已跳过",
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())